@@ -0,0 +1,224 @@
+"""
+Headless benchmark: renders scenes into an offscreen console buffer and reports frame rate, time of every stage
+of the pipeline and peak memory as JSON. Results can be compared with a saved baseline:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # pygame greeting would break JSON written to stdout
+from objects import Vector3D, Object3D, Camera3D, Mesh
+from console_drawer import ConsoleDrawer
+from telemetry import profiler
+import models
+
+STAGES = ("clear", "transform", "cull", "sort", "raster", "present")
+DEFAULT_MESHES = ("untitled", "cube", "cut_pyramid", "1k", "10k", "100k", "1m")
+DEFAULT_RESOLUTIONS = ("80x24", "200x60")
+DEFAULT_COUNTS = (1, 16)
+MAX_SCENE_TRIANGLES = 4_000_000  # Scenes with more triangles are skipped unless asked for explicitly
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "untitled.obj")
+TOLERANCE = 0.1  # Allowed relative loss of frames per second before a scenario counts as regression
+
+
+def load_mesh(name: str) -> Mesh:
+    """
+    :param name: "untitled", "cube", "cut_pyramid" or number of triangles of a generated sphere: "5000", "10k", "1m"
+    """
+    if name == "untitled":
+        return models.FileObject(MODEL_PATH).mesh
+    if name == "cube":
+        return models.Cube().mesh
+    if name == "cut_pyramid":
+        return models.CutPyramid().mesh
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    triangles = int(float(name[:-1]) * multipliers[name[-1]]) if name[-1] in multipliers else int(name)
+    rings = max(int(round((triangles / 4) ** 0.5)), 2)  # 2 * segments * (rings - 1) with segments = 2 * rings
+    return models.make_sphere_mesh(rings, 2 * rings)
+
+
+def make_scene(mesh: Mesh, count: int) -> tuple[list[Object3D], Camera3D]:
+    """
+    Place <count> objects sharing <mesh> on a square grid in front of the camera
+    """
+    camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+    side = int(np.ceil(count ** 0.5))
+    center, radius = mesh.get_bounding_sphere()
+    objects = []
+    for i in range(count):
+        obj = Object3D(mesh)
+        obj.set_scale(1 / max(radius, 1e-9))
+        row, column = divmod(i, side)
+        obj.set_pos(2.2 * (column - (side - 1) / 2), 2.2 * (row - (side - 1) / 2), -2.5 * side)
+        objects.append(obj)
+    return objects, camera
+
+
+def render_frame(objects: list[Object3D], camera: Camera3D, drawer: ConsoleDrawer, sort: bool = False):
+    """
+    Draw objects with Object3D.draw_console and present the frame. Time of stages and counters are collected by
+    telemetry.profiler, its frame is closed at the end
+    """
+    with profiler.stage("clear"):
+        drawer.clear()
+    for obj in objects:
+        obj.draw_console(drawer, camera, sort)
+    drawer.print_surface()
+    profiler.end_frame()
+
+
+def run_scenario(mesh_name: str, mesh: Mesh, width: int, height: int, count: int, frames: int,
+                 sort: bool = False) -> dict:
+    objects, camera = make_scene(mesh, count)
+    camera.set_aspect_ratio(width / height)
+    drawer = ConsoleDrawer(io.StringIO())
+    drawer.set_size(width, height)
+    stages_ms = dict.fromkeys(STAGES, 0.0)
+    counters = dict.fromkeys(("triangles_submitted", "triangles_rasterized", "cells_written"), 0)
+
+    def step(frame):
+        for i, obj in enumerate(objects):  # Objects move, so cached matrices do not hide the transform cost
+            obj.set_rotation(frame * 3, frame * 5 + i * 10, 0)
+        render_frame(objects, camera, drawer, sort)
+        for stage, value in profiler.last_frame["stages_ms"].items():
+            stages_ms[stage] = stages_ms.get(stage, 0.0) + value
+        for name, value in profiler.last_frame["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+
+    was_enabled = profiler.enabled
+    profiler.enable()
+    try:
+        step(0)  # Warming up: buffers are allocated, caches are filled
+        stages_ms = dict.fromkeys(stages_ms, 0.0)
+        counters = dict.fromkeys(counters, 0)
+        start = time.perf_counter()
+        for frame in range(1, frames + 1):
+            step(frame)
+        total = time.perf_counter() - start
+
+        # Separate frame for memory, tracing slows everything down
+        frame_stages_ms = {stage: value / frames for stage, value in stages_ms.items()}
+        frame_counters = {name: value // frames for name, value in counters.items()}
+        tracemalloc.start()
+        step(frames + 1)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        if not was_enabled:
+            profiler.disable()
+
+    return {
+        "mesh": mesh_name,
+        "triangles": mesh.get_face_count(),
+        "width": width,
+        "height": height,
+        "objects": count,
+        "frames": frames,
+        "fps": frames / total if total > 0 else float("inf"),
+        "frame_ms": 1000 * total / frames,
+        "stages_ms": frame_stages_ms,
+        "counters": frame_counters,
+        "peak_frame_memory_bytes": peak,
+    }
+
+
+def run(meshes, resolutions, counts, frames: int, sort: bool = False,
+        max_scene_triangles: int = MAX_SCENE_TRIANGLES, log=sys.stderr) -> dict:
+    """
+    Run every combination of meshes, resolutions and object counts
+    :return: Report with environment description and list of results
+    """
+    results = []
+    for mesh_name in meshes:
+        mesh = load_mesh(mesh_name)
+        for resolution in resolutions:
+            width, height = (int(value) for value in resolution.split("x"))
+            for count in counts:
+                if mesh.get_face_count() * count > max_scene_triangles:
+                    continue
+                result = run_scenario(mesh_name, mesh, width, height, count, frames, sort)
+                results.append(result)
+                if log is not None:
+                    print(f"{mesh_name:>12} {resolution:>9} x{count:<4} {result['fps']:9.1f} fps", file=log)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "system": platform.system(),
+        },
+        "peak_process_memory_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        "results": results,
+    }
+
+
+def get_key(result: dict) -> tuple:
+    return result["mesh"], result["width"], result["height"], result["objects"]
+
+
+def compare(report: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """
+    Find scenarios whose frame rate dropped by more than <tolerance> compared with the baseline
+    :return: Descriptions of regressions
+    """
+    baseline_results = {get_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = baseline_results.get(get_key(result))
+        if old is None:
+            continue
+        ratio = result["fps"] / old["fps"]
+        if ratio < 1 - tolerance:
+            mesh, width, height, count = get_key(result)
+            slowest = max(STAGES, key=lambda stage: result["stages_ms"][stage] - old["stages_ms"].get(stage, 0))
+            regressions.append(f"{mesh} {width}x{height} x{count}: {old['fps']:.1f} -> {result['fps']:.1f} fps "
+                               f"({ratio - 1:+.0%}), most grown stage: {slowest}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meshes", default=",".join(DEFAULT_MESHES),
+                        help="untitled, cube, cut_pyramid or triangle counts like 1k, 100k, 1m")
+    parser.add_argument("--resolutions", default=",".join(DEFAULT_RESOLUTIONS), help="like 80x24,200x60")
+    parser.add_argument("--counts", default=",".join(map(str, DEFAULT_COUNTS)), help="numbers of objects")
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--sort", action="store_true", help="sort faces by depth like the pygame renderer")
+    parser.add_argument("--max-scene-triangles", type=int, default=MAX_SCENE_TRIANGLES)
+    parser.add_argument("--output", help="file to write JSON report into, stdout if not given")
+    parser.add_argument("--baseline", help="JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = run(args.meshes.split(","), args.resolutions.split(","), [int(c) for c in args.counts.split(",")],
+                 args.frames, args.sort, args.max_scene_triangles)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+from __future__ import annotations  # For cases when we need to specify parameter's ClassType inside ClassType's method
+from typing import Union
+import numpy as np
+
+
+class BoxTree:
+    """
+    Bounding volume hierarchy over axis-aligned boxes. Nodes are stored in arrays, node i covers items
+    order[start[i]:start[i] + count[i]]. Parents always have smaller indices than their children.
+    Queries go through the tree level by level, testing the whole level at once
+    """
+    def __init__(self, box_min: np.ndarray, box_max: np.ndarray, leaf_size: int):
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(box_min))
+        starts, counts, lefts, rights, parents, depths = [0], [len(box_min)], [-1], [-1], [-1], [0]
+
+        # Splitting items at the median of their centers along the longest axis
+        centers = (box_min + box_max) / 2
+        stack = [0] if len(box_min) > leaf_size else []
+        while stack:
+            node = stack.pop()
+            start, count = starts[node], counts[node]
+            items = self.order[start:start + count]
+            item_centers = centers[items]
+            axis = np.argmax(item_centers.max(axis=0) - item_centers.min(axis=0))
+            half = count // 2
+            self.order[start:start + count] = items[np.argpartition(item_centers[:, axis], half)]
+            for child_start, child_count in ((start, half), (start + half, count - half)):
+                starts.append(child_start)
+                counts.append(child_count)
+                lefts.append(-1)
+                rights.append(-1)
+                parents.append(node)
+                depths.append(depths[node] + 1)
+                if child_count > leaf_size:
+                    stack.append(len(starts) - 1)
+            lefts[node] = len(starts) - 2
+            rights[node] = len(starts) - 1
+
+        self.start = np.array(starts, dtype=np.int64)
+        self.count = np.array(counts, dtype=np.int64)
+        self.left = np.array(lefts, dtype=np.int64)
+        self.right = np.array(rights, dtype=np.int64)
+        self.parent = np.array(parents, dtype=np.int64)
+        self.depth = np.array(depths, dtype=np.int64)
+        self.is_leaf = self.left < 0
+        self.leaf_of_item = np.empty(len(box_min), dtype=np.int64)
+        for leaf in np.flatnonzero(self.is_leaf):
+            self.leaf_of_item[self.order[self.start[leaf]:self.start[leaf] + self.count[leaf]]] = leaf
+
+        self.node_min = np.zeros((len(starts), 3))
+        self.node_max = np.zeros((len(starts), 3))
+        self.refit(box_min, box_max)
+
+    def refit(self, box_min: np.ndarray, box_max: np.ndarray, items: np.ndarray = None):
+        """
+        Update boxes of nodes after boxes of items have changed. Structure of the tree stays the same
+        :param box_min: Minimal coordinates of boxes of all items, array of shape (N, 3)
+        :param box_max: Maximal coordinates of boxes of all items, array of shape (N, 3)
+        :param items: Indices of changed items. All nodes are updated if not given
+        """
+        if items is None:
+            leaves = np.flatnonzero(self.is_leaf)
+            inner = np.flatnonzero(~self.is_leaf)
+        else:
+            leaves = np.unique(self.leaf_of_item[items])
+            inner = set()
+            for node in self.parent[leaves].tolist():
+                while node >= 0 and node not in inner:
+                    inner.add(node)
+                    node = self.parent[node]
+            inner = np.array(sorted(inner), dtype=np.int64)
+        if len(leaves) == 0:
+            return
+
+        # Leaves: reducing boxes of their items, which are contiguous in order
+        leaves = leaves[self.count[leaves] > 0]
+        if items is None:  # Leaves sorted by start split the whole order into consecutive ranges
+            leaves = leaves[np.argsort(self.start[leaves])]
+            self.node_min[leaves] = np.minimum.reduceat(box_min[self.order], self.start[leaves])
+            self.node_max[leaves] = np.maximum.reduceat(box_max[self.order], self.start[leaves])
+        else:
+            for leaf in leaves.tolist():
+                leaf_items = self.order[self.start[leaf]:self.start[leaf] + self.count[leaf]]
+                self.node_min[leaf] = box_min[leaf_items].min(axis=0)
+                self.node_max[leaf] = box_max[leaf_items].max(axis=0)
+
+        # Inner nodes: uniting boxes of children, deepest levels first
+        depths = self.depth[inner]
+        for depth in np.unique(depths)[::-1]:
+            nodes = inner[depths == depth]
+            self.node_min[nodes] = np.minimum(self.node_min[self.left[nodes]], self.node_min[self.right[nodes]])
+            self.node_max[nodes] = np.maximum(self.node_max[self.left[nodes]], self.node_max[self.right[nodes]])
+
+    def query(self, test, box_min: np.ndarray, box_max: np.ndarray) -> np.ndarray:
+        """
+        Find items whose boxes are accepted by <test>
+        :param test: Function that takes minimal and maximal coordinates of K boxes and returns two boolean arrays:
+        whether box may contain matching items and whether all items inside the box match
+        :param box_min: Minimal coordinates of boxes of items, tested in leaves that are not accepted as a whole
+        :param box_max: Maximal coordinates of boxes of items
+        :return: Indices of items
+        """
+        if len(self.order) == 0:
+            return np.empty(0, dtype=np.int64)
+        accepted = []
+        partial_leaves = []
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier):
+            overlap, contained = test(self.node_min[frontier], self.node_max[frontier])
+            accepted.append(frontier[overlap & contained])
+            frontier = frontier[overlap & ~contained]
+            leaf = self.is_leaf[frontier]
+            partial_leaves.append(frontier[leaf])
+            frontier = np.concatenate((self.left[frontier[~leaf]], self.right[frontier[~leaf]]))
+        candidates = self._get_items(np.concatenate(partial_leaves))
+        candidates = candidates[test(box_min[candidates], box_max[candidates])[0]]
+        return np.concatenate((self._get_items(np.concatenate(accepted)), candidates))
+
+    def _get_items(self, nodes: np.ndarray) -> np.ndarray:
+        counts = self.count[nodes]
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.order[np.repeat(self.start[nodes], counts) + local]
+
+    def query_ray(self, origin: np.ndarray, direction: np.ndarray, box_min: np.ndarray, box_max: np.ndarray,
+                  max_distance: float = np.inf) -> np.ndarray:
+        """
+        Find items whose boxes are crossed by the ray origin + t * direction, 0 <= t <= <max_distance>
+        :return: Indices of items
+        """
+        with np.errstate(divide="ignore"):
+            inverse = 1 / direction
+
+        def test(test_min, test_max):
+            t_near, t_far = ray_box_distances(origin, inverse, test_min, test_max)
+            return (t_near <= t_far) & (t_far >= 0) & (t_near <= max_distance), np.zeros(len(test_min), dtype=bool)
+        return self.query(test, box_min, box_max)
+
+
+def ray_box_distances(origin: np.ndarray, inverse_direction: np.ndarray,
+                      box_min: np.ndarray, box_max: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Slab test of a ray against many boxes
+    :return: Ray parameters of entering and leaving every box, the ray misses a box if the first is greater
+    """
+    with np.errstate(invalid="ignore"):  # 0 * inf for rays parallel to box sides
+        t1 = (box_min - origin) * inverse_direction
+        t2 = (box_max - origin) * inverse_direction
+    # fmin and fmax skip NaN, so parallel axes do not limit the distances
+    t_near = np.fmax.reduce(np.fmin(t1, t2), axis=1)
+    t_far = np.fmin.reduce(np.fmax(t1, t2), axis=1)
+    return t_near, t_far
+
+
+def ray_triangle_distances(origin: np.ndarray, direction: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """
+    Moller-Trumbore intersection of a ray with many triangles
+    :param triangles: Array of shape (K, 3, 3) with vertices of triangles
+    :return: Ray parameter of intersection with every triangle, inf for triangles that are missed
+    """
+    edge_1 = triangles[:, 1] - triangles[:, 0]
+    edge_2 = triangles[:, 2] - triangles[:, 0]
+    p = np.cross(direction, edge_2)
+    determinant = np.einsum("ij,ij->i", edge_1, p)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1 / determinant
+        s = origin - triangles[:, 0]
+        u = np.einsum("ij,ij->i", s, p) * inverse
+        q = np.cross(s, edge_1)
+        v = (q @ direction) * inverse
+        t = np.einsum("ij,ij->i", edge_2, q) * inverse
+        hit = (np.abs(determinant) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return np.where(hit, t, np.inf)
+
+
+class MeshBVH:
+    """
+    Bounding volume hierarchy over triangles of a mesh, in model space
+    """
+    def __init__(self, vertices: np.ndarray, indices: np.ndarray, leaf_size: int = 8):
+        self.triangles = np.asarray(vertices)[:, :3].astype(np.float64)[indices]  # (M, 3, 3)
+        self.box_min = self.triangles.min(axis=1)
+        self.box_max = self.triangles.max(axis=1)
+        self.tree = BoxTree(self.box_min, self.box_max, leaf_size)
+
+    def ray_cast(self, origin: np.ndarray, direction: np.ndarray,
+                 max_distance: float = np.inf) -> Union[tuple[int, float], None]:
+        """
+        Find the nearest triangle crossed by the ray origin + t * direction, 0 <= t <= <max_distance>
+        :return: Index of the triangle and its ray parameter t, or None if no triangle is crossed
+        """
+        candidates = self.tree.query_ray(origin, direction, self.box_min, self.box_max, max_distance)
+        if len(candidates) == 0:
+            return None
+        distances = ray_triangle_distances(origin, direction, self.triangles[candidates])
+        nearest = np.argmin(distances)
+        if distances[nearest] > max_distance:
+            return None
+        return int(candidates[nearest]), float(distances[nearest])
+
+
+class RayHit:
+    def __init__(self, obj, triangle: int, distance: float, point: np.ndarray):
+        self.obj = obj  # Object that was hit
+        self.triangle = triangle  # Index of the triangle in object's mesh
+        self.distance = distance  # Ray parameter t of the hit
+        self.point = point  # Hit point in world space
+
+
+class ObjectBVH:
+    """
+    Bounding volume hierarchy over scene objects, built from their world space bounding boxes.
+    Objects should have get_world_bounds, get_world_matrix, world_version and mesh like Object3D
+    """
+    def __init__(self, objects: list, leaf_size: int = 2):
+        self.objects = list(objects)
+        self.leaf_size = leaf_size
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Build the tree from scratch. Refit is cheaper, but tree built for old positions becomes less efficient
+        as objects move far from them
+        """
+        self.box_min, self.box_max = self._get_boxes(self.objects)
+        self._versions = [obj.world_version for obj in self.objects]
+        self.tree = BoxTree(self.box_min, self.box_max, self.leaf_size)
+
+    def refit(self) -> int:
+        """
+        Update boxes of objects that have moved since the last refit and of the nodes above them
+        :return: Number of moved objects
+        """
+        changed = []
+        for i, obj in enumerate(self.objects):
+            obj.get_world_matrix()  # Makes world_version up to date
+            if obj.world_version != self._versions[i]:
+                changed.append(i)
+                self._versions[i] = obj.world_version
+        if changed:
+            box_min, box_max = self._get_boxes([self.objects[i] for i in changed])
+            self.box_min[changed] = box_min
+            self.box_max[changed] = box_max
+            self.tree.refit(self.box_min, self.box_max, np.array(changed))
+        return len(changed)
+
+    @staticmethod
+    def _get_boxes(objects: list) -> tuple[np.ndarray, np.ndarray]:
+        bounds = [obj.get_world_bounds() for obj in objects]
+        box_min = np.array([b[2] for b in bounds], dtype=np.float64).reshape(-1, 3)
+        box_max = np.array([b[3] for b in bounds], dtype=np.float64).reshape(-1, 3)
+        return box_min, box_max
+
+    def query_frustum(self, planes: np.ndarray) -> list:
+        """
+        Find objects whose bounding boxes intersect the frustum
+        :param planes: Array of shape (6, 4) from Camera3D.get_frustum_planes
+        """
+        normals = planes[:, :3]
+        positive = normals >= 0
+
+        def test(test_min, test_max):
+            node_min = test_min[:, None]
+            node_max = test_max[:, None]
+            farthest = np.where(positive, node_max, node_min)  # (K, 6, 3), corners farthest along normals
+            nearest = np.where(positive, node_min, node_max)
+            overlap = ((farthest * normals).sum(axis=2) + planes[:, 3] >= 0).all(axis=1)
+            contained = ((nearest * normals).sum(axis=2) + planes[:, 3] >= 0).all(axis=1)
+            return overlap, contained
+        return [self.objects[i] for i in self.tree.query(test, self.box_min, self.box_max).tolist()]
+
+    def query_box(self, box_min: np.ndarray, box_max: np.ndarray) -> list:
+        """
+        Find objects whose bounding boxes overlap the box
+        """
+        def test(node_min, node_max):
+            overlap = ((node_min <= box_max) & (node_max >= box_min)).all(axis=1)
+            contained = ((node_min >= box_min) & (node_max <= box_max)).all(axis=1)
+            return overlap, contained
+        return [self.objects[i] for i in self.tree.query(test, self.box_min, self.box_max).tolist()]
+
+    def ray_cast(self, origin: np.ndarray, direction: np.ndarray) -> Union[RayHit, None]:
+        """
+        Find the nearest triangle of any object crossed by the ray origin + t * direction, t >= 0
+        """
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        candidates = self.tree.query_ray(origin, direction, self.box_min, self.box_max)
+        if len(candidates) == 0:
+            return None
+        with np.errstate(divide="ignore"):
+            t_near, _ = ray_box_distances(origin, 1 / direction, self.box_min[candidates], self.box_max[candidates])
+        best = None
+        for i in np.argsort(t_near).tolist():
+            if best is not None and t_near[i] > best.distance:  # Remaining objects are farther
+                break
+            obj = self.objects[candidates[i]]
+            # Moving the ray into model space keeps its parameter t
+            inverse = np.linalg.inv(np.array(obj.get_world_matrix()._values, dtype=np.float64))
+            local_origin = np.append(origin, 1) @ inverse
+            local_direction = np.append(direction, 0) @ inverse
+            hit = obj.mesh.get_bvh().ray_cast(local_origin[:3], local_direction[:3],
+                                              np.inf if best is None else best.distance)
+            if hit is not None:
+                best = RayHit(obj, hit[0], hit[1], origin + hit[1] * direction)
+        return best
+
+    def pick(self, camera, screen_x: float, screen_y: float, scale_x: float, scale_y: float,
+             center_x: float, center_y: float) -> Union[RayHit, None]:
+        """
+        Find object and triangle under a point of the screen. Screen mapping is the same as in
+        pipeline.project_to_screen
+        """
+        origin, direction = camera.get_ray(screen_x, screen_y, scale_x, scale_y, center_x, center_y)
+        return self.ray_cast(origin, direction)
@@ -1,21 +1,84 @@
 import os
+import sys
+from math import inf
+import numpy as np
+import rasterizer
+from telemetry import profiler
+from tiled_rasterizer import TiledRasterizer, TILE_SIZE
+
+BLANK = ord(" ")
+TRIANGLE_INDICES = np.array([[0, 1, 2]])
+BRIGHTNESS_CHARS = "$@B%8&WM#*oahkbdpqwmZO0QLCJUYXzcvunxrjft/\\|()1{}[]?-_+~<>i!lI;:,\"^`\'."
+BRIGHTNESS_CODES = np.frombuffer(BRIGHTNESS_CHARS.encode("ascii"), dtype=np.uint8)
+SHADE_LEVELS = 256  # Size of the palette of characters for interpolated brightness
+MIN_RUN_GAP = 8  # Changed runs closer than this are sent as one run, cursor movement would cost more bytes
 
 
 class ConsoleDrawer:
-    def __init__(self):
-        self.surface: list[list[str]] = []
+    def __init__(self, stream=None):
+        self.surface: np.ndarray = np.full((0, 0), BLANK, dtype=np.uint8)  # ASCII codes of characters
+        self.depth: np.ndarray = np.full((0, 0), inf, dtype=np.float32)  # Depth of the nearest drawn point
         self.width: int = 0
         self.height: int = 0
 
+        self.stream = stream  # Text stream to print into, sys.stdout if None
+        self.last_frame_bytes: int = 0  # Number of bytes written by the last print_surface call
+        self._previous_surface: np.ndarray = None  # Surface as it is currently shown in terminal
+        self.tiled_rasterizer: TiledRasterizer = None  # Set by enable_tiled_rendering
+        self.output_size: tuple[int, int] = None  # Size of the shown image if it differs, see set_output_size
+        self._texts: list[tuple[int, int, str]] = []  # Text drawn over the scaled image
+
+    def enable_tiled_rendering(self, workers: int = None, tile_size: int = TILE_SIZE):
+        """
+        Fill triangles in worker processes, each filling its own tiles of the screen.
+        Surface and depth buffer are moved into memory shared with the workers
+        :param workers: Number of worker processes, number of CPUs if not given
+        :param tile_size: Side of a tile in cells
+        """
+        self.disable_tiled_rendering()
+        self.tiled_rasterizer = TiledRasterizer(self.width, self.height, workers=workers, tile_size=tile_size)
+        self.set_size(self.width, self.height)
+
+    def disable_tiled_rendering(self):
+        """
+        Stop worker processes and go back to filling triangles in this process
+        """
+        if self.tiled_rasterizer is not None:
+            self.surface = self.depth = None
+            self.tiled_rasterizer.close()
+            self.tiled_rasterizer = None
+            self.set_size(self.width, self.height)
+
     def clear(self):
-        for i in range(self.height):
-            for j in range(self.width):
-                self.surface[i][j] = " "
+        self.surface.fill(BLANK)
+        self.depth.fill(inf)
+        self._texts = []
 
     def set_size(self, width: int, height: int):
         self.width = width
         self.height = height
-        self.surface = [[" " for _ in range(self.width)] for __ in range(self.height)]
+        if self.tiled_rasterizer is None:
+            self.surface = np.full((height, width), BLANK, dtype=np.uint8)
+            self.depth = np.full((height, width), inf, dtype=np.float32)
+        else:
+            self.surface = self.depth = None  # Shared memory can not be freed while arrays use it
+            self.tiled_rasterizer.set_size(width, height)
+            self.surface = self.tiled_rasterizer.color_buffer
+            self.depth = self.tiled_rasterizer.depth_buffer
+            self.clear()
+        self._previous_surface = None  # Terminal has to be fully redrawn
+
+    def set_output_size(self, width: int, height: int):
+        """
+        Set size of the terminal area the surface is shown in. When it differs from the size of the surface
+        (dynamic resolution), every cell of the output shows the nearest cell of the surface
+        """
+        if (width, height) != self.output_size:
+            self.output_size = (width, height)
+            self._previous_surface = None
+
+    def is_scaled(self) -> bool:
+        return self.output_size is not None and self.output_size != (self.width, self.height)
 
     def draw_line(self, p1: tuple[float, float], p2: tuple[float, float], color: str = "@"):
         dx = p2[0] - p1[0]
@@ -27,50 +90,124 @@ class ConsoleDrawer:
             x_index = round(p1[0] + i * x_inc)
             y_index = round(p1[1] + i * y_inc)
             if 0 <= x_index < self.width and 0 <= y_index < self.height:
-                self.surface[y_index][x_index] = color
-
-    def fill_triangle(self, p1: tuple[float, float], p2: tuple[float, float], p3: tuple[float, float], color: str):
-        # Dividing triangle into two parts
-        vertices = sorted([p1, p2, p3], key=lambda v: v[1])
-        low = vertices[0]
-        mid_1 = vertices[1]
-        high = vertices[2]
-
-        dx_l_h = high[0] - low[0]
-        dy_l_h = high[1] - low[1]
-        if dy_l_h == 0:
-            dy_l_h = 1
-        r_l_h = dx_l_h / dy_l_h
-
-        dy_l_m2 = mid_1[1] - low[1]
-        mid_2 = (low[0] + r_l_h * dy_l_m2, mid_1[1])
-
-        # Drawing lower triangle
-        dx_l_m1 = mid_1[0] - low[0]
-        dy_l_m1 = mid_1[1] - low[1]
-        if dy_l_m1 == 0:
-            dy_l_m1 = 1
-        r_l_m1 = dx_l_m1 / dy_l_m1
-        for dy in range(0, int(dy_l_m2 + 1)):
-            y = low[1] + dy
-            x1 = low[0] + r_l_m1 * dy
-            x2 = low[0] + r_l_h * dy
-            self.draw_line((x1, y), (x2, y), color)
-
-        # Drawing upper triangle
-        dx_m1_h = high[0] - mid_1[0]
-        dy_m1_h = high[1] - mid_1[1]
-        if dy_m1_h == 0:
-            dy_m1_h = 1
-        r_m1_h = dx_m1_h / dy_m1_h
-        for dy in range(0, int(dy_m1_h + 1)):
-            y = mid_1[1] + dy
-            x1 = mid_1[0] + r_m1_h * dy
-            x2 = mid_2[0] + r_l_h * dy
-            self.draw_line((x1, y), (x2, y), color)
-
-    def print_surface(self):
-        print("".join(["".join(self.surface[i]) for i in range(len(self.surface))]), end="")
+                self.surface[y_index, x_index] = ord(color)
+
+    def draw_text(self, x: int, y: int, text: str):
+        """
+        Write <text> into row <y> starting from column <x>, cutting it at the edge of the surface.
+        If the surface is scaled, text is written over the scaled image and <x>, <y> are cells of the output
+        """
+        if self.is_scaled():
+            self._texts.append((x, y, text))
+            return
+        if not 0 <= y < self.height or x >= self.width:
+            return
+        codes = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8)[:self.width - x]
+        self.surface[y, x:x + len(codes)] = codes
+        self.depth[y, x:x + len(codes)] = -inf  # Text stays in front of triangles drawn after it
+
+    def fill_triangles(self, screen_vertices: np.ndarray, indices: np.ndarray, colors: np.ndarray,
+                       shades: np.ndarray = None) -> int:
+        """
+        Fill many triangles at once with depth test (see rasterizer.fill_triangles)
+        :param screen_vertices: Array of shape (N, 3) with screen x, screen y and depth of vertices
+        :param indices: Array of shape (K, 3) with indices of vertices of triangles to fill
+        :param colors: Array of shape (K,) with ASCII codes of characters to fill triangles with
+        :param shades: Brightness of every vertex for Gouraud shading, characters are chosen by brightness
+        interpolated inside triangles. Triangles with NaN brightness use their colors
+        :return: Number of cells written
+        """
+        with profiler.stage("raster"):
+            if self.tiled_rasterizer is not None:
+                written = self.tiled_rasterizer.fill_triangles(screen_vertices, indices, colors, shades, SHADE_PALETTE)
+            else:
+                written = rasterizer.fill_triangles(self.depth, self.surface, screen_vertices, indices, colors,
+                                                    shades=shades, palette=SHADE_PALETTE)
+        profiler.count("triangles_rasterized", len(indices))
+        profiler.count("cells_written", written)
+        return written
+
+    def fill_triangle(self, p1: tuple[float, float, float], p2: tuple[float, float, float],
+                      p3: tuple[float, float, float], color: str):
+        """
+        Fill every cell whose center lies inside the triangle and is nearer than what was drawn there before
+        :param p1: Screen x, screen y and depth of the first vertex
+        :param p2: Screen x, screen y and depth of the second vertex
+        :param p3: Screen x, screen y and depth of the third vertex
+        :param color: Character to fill with
+        """
+        self.fill_triangles(np.array([p1, p2, p3], dtype=np.float32), TRIANGLE_INDICES,
+                            np.array([ord(color)], dtype=np.uint8))
+
+    def print_surface(self) -> int:
+        """
+        Show surface in terminal. Only runs of cells that changed since the previous call are written,
+        each one after an ANSI sequence that moves cursor to its start. Everything goes in one write
+        :return: Number of bytes written
+        """
+        with profiler.stage("present"):
+            self.last_frame_bytes = self._present()
+        profiler.count("bytes_presented", self.last_frame_bytes)
+        return self.last_frame_bytes
+
+    def _present(self) -> int:
+        surface = self._get_output_surface()
+        if self._previous_surface is None or self._previous_surface.shape != surface.shape:
+            frame = "\x1b[H" + surface.tobytes().decode("ascii")
+            self._previous_surface = surface.copy()
+        else:
+            frame = "".join(self._get_changed_runs(surface))
+            np.copyto(self._previous_surface, surface)
+
+        stream = sys.stdout if self.stream is None else self.stream
+        if frame:
+            stream.write(frame)
+            stream.flush()
+        return len(frame)  # All characters are ASCII
+
+    def _get_output_surface(self) -> np.ndarray:
+        """
+        Get surface as it should be shown: scaled to the output size with texts over it, if it is set
+        """
+        if not self.is_scaled():
+            return self.surface
+        width, height = self.output_size
+        rows = np.arange(height) * self.height // height
+        columns = np.arange(width) * self.width // width
+        output = self.surface[rows[:, None], columns]
+        for x, y, text in self._texts:
+            if 0 <= y < height and x < width:
+                codes = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8)[:width - x]
+                output[y, x:x + len(codes)] = codes
+        return output
+
+    def _get_changed_runs(self, surface: np.ndarray) -> list[str]:
+        """
+        Get ANSI cursor positioning sequences followed by changed characters for every run of changed cells
+        of <surface> compared with the previous frame
+        """
+        height, width = surface.shape
+        changed = np.zeros((height, width + 1), dtype=bool)  # Extra column splits runs between lines
+        np.not_equal(surface, self._previous_surface, out=changed[:, :-1])
+        edges = np.flatnonzero(np.diff(changed.ravel(), prepend=False, append=False))
+        starts = edges[::2]
+        ends = edges[1::2]
+        if len(starts) == 0:
+            return []
+
+        # Merging runs of the same line separated by short gaps
+        row_width = width + 1
+        keep = np.ones(len(starts), dtype=bool)
+        keep[1:] = (starts[1:] - ends[:-1] >= MIN_RUN_GAP) | (starts[1:] // row_width != ends[:-1] // row_width)
+        starts = starts[keep]
+        ends = ends[np.append(keep[1:], True)]
+
+        runs = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            y, x = divmod(start, row_width)
+            line = surface[y, x:x + end - start]
+            runs.append(f"\x1b[{y + 1};{x + 1}H" + line.tobytes().decode("ascii"))
+        return runs
 
     @staticmethod
     def get_char_by_brightness(brightness: float) -> str:
@@ -79,5 +216,16 @@ class ConsoleDrawer:
         :param brightness: Real number in range [0; 1]
         :return: character
         """
-        chars = "$@B%8&WM#*oahkbdpqwmZO0QLCJUYXzcvunxrjft/\|()1{}[]?-_+~<>i!lI;:,\"^`\'."
-        return chars[-int(len(chars) * brightness)]
+        return BRIGHTNESS_CHARS[-int(len(BRIGHTNESS_CHARS) * brightness)]
+
+    @staticmethod
+    def get_codes_by_brightness(brightness: np.ndarray) -> np.ndarray:
+        """
+        Vectorized get_char_by_brightness
+        :param brightness: Array of real numbers in range [0; 1]
+        :return: Array of ASCII codes of characters
+        """
+        return BRIGHTNESS_CODES[-(brightness * len(BRIGHTNESS_CODES)).astype(np.int64) % len(BRIGHTNESS_CODES)]
+
+
+SHADE_PALETTE = ConsoleDrawer.get_codes_by_brightness(np.arange(SHADE_LEVELS) / SHADE_LEVELS)
@@ -2,38 +2,60 @@ from objects import Vector3D, Matrix4x4, Camera3D
 import models
 import os
 from console_drawer import ConsoleDrawer
+from frame_loop import FrameState, PipelinedFrameLoop, configure_resolution
+from simulation import Simulation
+import telemetry
 
 
 def main():
+    objects = []
+
     obj = models.FileObject("untitled.obj")
     obj.set_pos(0, 0, -300)
     obj.set_scale(20)
-    obj.set_rotation_speed(0, 0.3, 0)
+    obj.set_rotation_speed(0, 18, 0)  # Degrees per second
+    obj.enable_lod()
+    objects.append(obj)
 
     camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
     camera.set_fov(45)
 
+    show_stats = telemetry.configure(telemetry.profiler)  # TELEMETRY=overlay,stderr,stats.jsonl
+    resolution = configure_resolution()  # DYNAMIC_RESOLUTION=16.6,lod for target frame time in milliseconds
+    simulation = Simulation(objects)
     console_drawer = ConsoleDrawer()
-    console_size = tuple(os.get_terminal_size())
-    console_drawer.set_size(console_size[0], console_size[1])
     console_drawer.clear()
-    camera.set_aspect_ratio(console_size[0] / console_size[1])
 
-    old_size = console_size
-    run = True
-    while run:
+    def prepare(state: FrameState):
+        # Objects only record their triangles here, while the previous frame is printed
+        width, height = tuple(os.get_terminal_size())
+        if width / height != camera.aspect_ratio:
+            camera.set_aspect_ratio(width / height)
+        if resolution is not None:  # Image is rendered smaller and scaled to the terminal when printed
+            width, height = resolution.get_size(width, height)
+            for obj in objects:
+                obj.lod_bias = resolution.lod_bias
+        simulation.apply(simulation.tick())
+        state.clear(width, height)
+        for obj in objects:
+            obj.draw_console(state, camera)
+
+    def render(state: FrameState):
         # Resizing image if needed
-        curr_size = tuple(os.get_terminal_size())
-        if curr_size != old_size:
-            console_drawer.set_size(curr_size[0], curr_size[1])
-            camera.set_aspect_ratio(curr_size[0] / curr_size[1])
+        if (state.width, state.height) != (console_drawer.width, console_drawer.height):
+            console_drawer.set_size(state.width, state.height)
+        if resolution is not None:
+            console_drawer.set_output_size(*os.get_terminal_size())
 
-        # Drawing objects
+        # Drawing objects, depth buffer makes their order irrelevant
         console_drawer.clear()
-
-        obj.draw_console(console_drawer, camera)
-
+        if show_stats:
+            console_drawer.draw_text(0, 0, telemetry.profiler.format_overlay())
+        console_drawer.fill_triangles(*state.get_triangles(), state.get_shades())
         console_drawer.print_surface()
 
+    PipelinedFrameLoop(prepare, render, fps=60, resolution=resolution).run()
+
 
-main()
+if __name__ == "__main__":
+    main()
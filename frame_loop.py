@@ -0,0 +1,309 @@
+import os
+import queue
+import threading
+import time
+from math import sqrt
+import numpy as np
+from telemetry import profiler
+
+MAX_SKIPPED_FRAMES = 2  # Frames skipped in a row at most when rendering is late
+MIN_RENDER_SCALE = 0.25
+SCALE_STEP = 0.1  # Largest increase of render scale at once, decreases are not limited
+MIN_SCALE_CHANGE = 0.03  # Smaller increases of render scale are ignored, so buffers are not resized every time
+
+
+class FramePacer:
+    """
+    Keeps frames at a target rate by sleeping until the deadline of the next frame, so time spent on the frame
+    itself is not added on top of the frame period. When a frame is late by more than a period, deadlines are
+    counted from the current time instead of trying to catch up with a burst of frames
+    """
+    def __init__(self, fps: float = 60, clock=time.perf_counter, sleep=time.sleep):
+        self.frame_time = 1 / fps
+        self.clock = clock
+        self.sleep = sleep
+        self._deadline = None
+
+    def wait(self) -> float:
+        """
+        Sleep until the deadline of the current frame
+        :return: Time left before the deadline, negative if the frame is late
+        """
+        now = self.clock()
+        if self._deadline is None:
+            self._deadline = now
+        self._deadline += self.frame_time
+        left = self._deadline - now
+        if left > 0:
+            self.sleep(left)
+        elif -left > self.frame_time:
+            self._deadline = now
+        return left
+
+
+class ResolutionController:
+    """
+    Dynamic resolution: scales internal render resolution so frames fit into a time budget, the image is scaled
+    to the output size when presented. Time of a frame is taken as proportional to its number of pixels.
+    Every <interval> frames the 90th percentile of their times is compared with the target: slow frames lower
+    the scale at once to fit the budget, fast frames raise it by at most SCALE_STEP, so it settles without
+    jumping back and forth. When the scale is at its minimum and frames are still slow, level of detail bias
+    is raised, and it is lowered first when there is time again
+    """
+    def __init__(self, target_frame_time: float = 1 / 60, min_scale: float = MIN_RENDER_SCALE,
+                 max_scale: float = 1.0, interval: int = 10, headroom: float = 0.85, max_lod_bias: int = 0):
+        """
+        :param target_frame_time: Budget of a frame in seconds
+        :param min_scale: Smallest scale of width and height of the output
+        :param max_scale: Largest scale, 1 for the output size
+        :param interval: Number of frames measured before every decision
+        :param headroom: Part of the budget frames should take, scale is raised only when they take less
+        :param max_lod_bias: Largest level of detail bias, 0 to keep level of detail as is
+        """
+        self.target_frame_time = target_frame_time
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.interval = interval
+        self.headroom = headroom
+        self.max_lod_bias = max_lod_bias
+        self.scale = max_scale
+        self.lod_bias = 0  # For Object3D.lod_bias
+        self._times: list[float] = []  # Frame times measured with the current settings
+
+    def add_frame_time(self, seconds: float) -> bool:
+        """
+        Record time of a frame and adjust settings when enough frames are measured
+        :return: True if scale or level of detail bias has changed
+        """
+        self._times.append(seconds)
+        if len(self._times) < self.interval:
+            return False
+        measured = float(np.percentile(self._times, 90))
+        self._times = []
+        return self._adjust(measured)
+
+    def _adjust(self, measured: float) -> bool:
+        budget = self.target_frame_time * self.headroom
+        if measured > self.target_frame_time:
+            if self.scale <= self.min_scale:
+                if self.lod_bias >= self.max_lod_bias:
+                    return False
+                self.lod_bias += 1
+                return True
+            scale = max(self.scale * sqrt(budget / measured), self.min_scale)
+        elif measured < budget:
+            if self.lod_bias > 0:
+                self.lod_bias -= 1
+                return True
+            scale = min(self.scale * sqrt(budget / max(measured, 1e-9)), self.scale + SCALE_STEP, self.max_scale)
+            if scale - self.scale < MIN_SCALE_CHANGE and scale != self.max_scale:
+                return False
+        else:
+            return False
+        changed = scale != self.scale
+        self.scale = scale
+        return changed
+
+    def get_size(self, width: int, height: int) -> tuple[int, int]:
+        """
+        :return: Size of the internal image for output of size <width> x <height>
+        """
+        return max(int(width * self.scale + 0.5), 1), max(int(height * self.scale + 0.5), 1)
+
+
+def configure_resolution(setting: str = None) -> ResolutionController:
+    """
+    Create ResolutionController described by <setting>, taken from environment variable DYNAMIC_RESOLUTION
+    if not given. Setting is the target frame time in milliseconds, optionally followed by ",lod" to allow
+    level of detail bias, like "16.6,lod"
+    :return: Controller or None if setting is empty
+    """
+    if setting is None:
+        setting = os.environ.get("DYNAMIC_RESOLUTION", "")
+    items = [item.strip() for item in setting.split(",") if item.strip()]
+    if not items:
+        return None
+    return ResolutionController(float(items[0]) / 1000, max_lod_bias=3 if "lod" in items[1:] else 0)
+
+
+class FrameState:
+    """
+    Triangles of one frame, prepared for rasterization. Has the same width, height and fill_triangles
+    as ConsoleDrawer, so objects can draw into it, but triangles are only recorded.
+    Vertex buffer is kept between frames and grows when needed
+    """
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.frame = 0  # Number of the frame, set by the loop
+        self.prepare_time = 0.0  # Seconds spent in prepare, set by the loop
+        self._vertices = np.empty((0, 3), dtype=np.float32)
+        self._shades = np.empty(0, dtype=np.float32)  # Brightness of vertices, NaN for flat shaded triangles
+        self._vertex_count = 0
+        self._has_shades = False
+        self._indices: list[np.ndarray] = []
+        self._colors: list[np.ndarray] = []
+        self._textured: list[tuple] = []  # Vertex range, indices, colors, texture, uvs and clip w of textured calls
+
+    def clear(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self._vertex_count = 0
+        self._has_shades = False
+        self._indices = []
+        self._colors = []
+        self._textured = []
+
+    def fill_triangles(self, screen_vertices: np.ndarray, indices: np.ndarray, colors: np.ndarray,
+                       shades: np.ndarray = None, texture=None, uvs: np.ndarray = None,
+                       clip_w: np.ndarray = None) -> int:
+        """
+        Record triangles. Vertices are copied, so the caller may reuse its buffer
+        :param shades: Brightness of every vertex for Gouraud shading, see ConsoleDrawer.fill_triangles
+        :param texture: Texture of the triangles, see PygameDrawer.fill_triangles. Textured triangles are kept
+        apart from others, see get_textured_batches
+        :return: Number of recorded triangles
+        """
+        start = self._vertex_count
+        end = start + len(screen_vertices)
+        if end > len(self._vertices):
+            size = max(end, 2 * len(self._vertices))
+            vertices = np.empty((size, 3), dtype=np.float32)
+            vertices[:start] = self._vertices[:start]
+            self._vertices = vertices
+            vertex_shades = np.empty(size, dtype=np.float32)
+            vertex_shades[:start] = self._shades[:start]
+            self._shades = vertex_shades
+        self._vertices[start:end] = screen_vertices
+        if shades is None:
+            self._shades[start:end] = np.nan
+        else:
+            self._shades[start:end] = shades
+            self._has_shades = True
+        self._vertex_count = end
+        if texture is not None:
+            self._textured.append((start, end, np.array(indices), np.array(colors), shades is not None, texture,
+                                   np.array(uvs), None if clip_w is None else np.array(clip_w)))
+            return len(indices)
+        self._indices.append(np.asarray(indices) + start)
+        self._colors.append(np.asarray(colors))
+        return len(indices)
+
+    def get_triangles(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get all recorded triangles in the order they were added
+        :return: Screen vertices, indices of shape (K, 3) and colors of triangles
+        """
+        if not self._indices:
+            return self._vertices[:0], np.empty((0, 3), dtype=np.int64), np.empty(0, dtype=np.uint8)
+        return self._vertices[:self._vertex_count], np.concatenate(self._indices), np.concatenate(self._colors)
+
+    def get_textured_batches(self) -> list[tuple]:
+        """
+        Get textured triangles, one batch for every call that recorded them
+        :return: Tuples of screen vertices, indices, colors, shades, texture, texture coordinates and clip w,
+        in order of arguments of PygameDrawer.fill_triangles
+        """
+        return [(self._vertices[start:end], indices, colors, self._shades[start:end] if has_shades else None,
+                 texture, uvs, clip_w)
+                for start, end, indices, colors, has_shades, texture, uvs, clip_w in self._textured]
+
+    def get_shades(self) -> np.ndarray:
+        """
+        :return: Brightness of recorded vertices, NaN for vertices of flat shaded triangles, or None if all
+        triangles are flat shaded
+        """
+        return self._shades[:self._vertex_count] if self._has_shades else None
+
+
+class PipelinedFrameLoop:
+    """
+    Frame loop with two stages running at the same time: while frame N is rendered in the calling thread,
+    frame N + 1 is prepared in a background thread. Two FrameState objects are passed between the stages,
+    so throughput is limited by the slower stage rather than by the sum of both.
+    Numpy and terminal output release the GIL for most of their work, which makes the overlap possible.
+    When a frame misses its deadline by more than a frame period, the next prepared frames are dropped
+    without rendering, so simulation done in prepare keeps its pace
+    """
+    def __init__(self, prepare, render, fps: float = 60, max_skipped_frames: int = MAX_SKIPPED_FRAMES,
+                 resolution: ResolutionController = None):
+        """
+        :param prepare: Function that fills FrameState with the next frame: simulation, transform, culling.
+        It must not touch the output device. Returning False stops the loop
+        :param render: Function that rasterizes and presents FrameState. Returning False stops the loop
+        :param fps: Target frame rate, frames are not limited if None
+        :param max_skipped_frames: Number of frames that may be skipped in a row
+        :param resolution: Controller given time of every rendered frame: the longer of its two stages, which
+        limits the frame rate. Prepare should take the render size from it
+        """
+        self.prepare = prepare
+        self.render = render
+        self.pacer = FramePacer(fps) if fps else None
+        self.max_skipped_frames = max_skipped_frames
+        self.resolution = resolution
+        self.skipped_frames = 0  # Total number of frames prepared but not rendered
+
+    def run(self, frames: int = None) -> int:
+        """
+        Run the loop until one of the stages stops it or <frames> frames are rendered
+        :return: Number of rendered frames
+        """
+        free = queue.Queue()
+        ready = queue.Queue()
+        for _ in range(2):
+            free.put(FrameState())
+        stop = threading.Event()
+
+        def produce():
+            frame = 0
+            try:
+                while not stop.is_set():
+                    state = free.get()
+                    if state is None:
+                        break
+                    state.frame = frame
+                    start = time.perf_counter()
+                    with profiler.frame_scope(frame):  # Rendering of the previous frame is measured meanwhile
+                        if self.prepare(state) is False:
+                            break
+                    state.prepare_time = time.perf_counter() - start
+                    frame += 1
+                    ready.put(state)
+            except BaseException as error:  # Passed to the rendering thread
+                ready.put(error)
+            ready.put(None)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        rendered = 0
+        skip = 0  # Number of next frames to skip
+        try:
+            while frames is None or rendered < frames:
+                state = ready.get()
+                if state is None:
+                    break
+                if isinstance(state, BaseException):
+                    raise state
+                if skip:
+                    skip -= 1
+                    self.skipped_frames += 1
+                    free.put(state)
+                    continue
+                start = time.perf_counter()
+                with profiler.frame_scope(state.frame):
+                    if self.render(state) is False:
+                        break
+                if self.resolution is not None:
+                    self.resolution.add_frame_time(max(state.prepare_time, time.perf_counter() - start))
+                profiler.end_frame(state.frame)
+                rendered += 1
+                free.put(state)
+                if self.pacer is not None:
+                    late = -self.pacer.wait()
+                    if late > self.pacer.frame_time:
+                        skip = min(int(late / self.pacer.frame_time), self.max_skipped_frames)
+        finally:
+            stop.set()
+            free.put(None)
+            producer.join()
+        return rendered
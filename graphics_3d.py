@@ -1,18 +1,19 @@
 import pygame
-import time
 from objects import Object3D, Vector3D, Matrix4x4, Camera3D
 import models
+from frame_loop import FrameState, PipelinedFrameLoop, configure_resolution
+from simulation import Simulation
+from pygame_drawer import PygameDrawer
 
 WIDTH = 1400
 HEIGHT = 800
 
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
 
 def main():
+    win = pygame.display.set_mode((WIDTH, HEIGHT))
     objects = []
 
     # obj = models.Cube()
@@ -29,30 +30,47 @@ def main():
     obj = models.FileObject("untitled.obj")
     obj.set_pos(0, 0, -300)
     obj.set_scale(20)
-    obj.set_rotation_speed(0, 1, 0)
+    obj.set_rotation_speed(0, 60, 0)  # Degrees per second
     objects.append(obj)
 
     camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
 
-    run = True
-    while run:
+    simulation = Simulation(objects)
+    drawer = PygameDrawer(WIDTH, HEIGHT, BLACK)
+    resolution = configure_resolution()  # DYNAMIC_RESOLUTION=16.6,lod for target frame time in milliseconds
+    moves = []  # Camera movements from input, applied by the stage that uses the camera
+
+    def prepare(state: FrameState):
+        while moves:
+            camera.move_by(moves.pop(0))
+        simulation.apply(simulation.tick())
+        if resolution is None:
+            state.clear(WIDTH, HEIGHT)
+        else:  # Image is rendered smaller and scaled to the window when presented
+            state.clear(*resolution.get_size(WIDTH, HEIGHT))
+            for obj in objects:
+                obj.lod_bias = resolution.lod_bias
+        for obj in objects:
+            obj.draw(state, WHITE, camera)  # Faces are only recorded, depth buffer makes their order irrelevant
+
+    def render(state: FrameState):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                run = False
+                return False
         keys_pressed = pygame.key.get_pressed()
         if keys_pressed[pygame.K_w]:  # Move forward
-            camera.move_by(Vector3D(0, 0, -2))
+            moves.append(Vector3D(0, 0, -2))
         if keys_pressed[pygame.K_s]:  # Move backward
-            camera.move_by(Vector3D(0, 0, 2))
+            moves.append(Vector3D(0, 0, 2))
         if keys_pressed[pygame.K_a]:  # Move left
-            camera.move_by(Vector3D(-2, 0, 0))
+            moves.append(Vector3D(-2, 0, 0))
         if keys_pressed[pygame.K_d]:  # Move right
-            camera.move_by(Vector3D(2, 0, 0))
+            moves.append(Vector3D(2, 0, 0))
 
         if keys_pressed[pygame.K_SPACE]:  # Move up
-            camera.move_by(Vector3D(0, 2, 0))
+            moves.append(Vector3D(0, 2, 0))
         if keys_pressed[pygame.K_LSHIFT]:  # Move down
-            camera.move_by(Vector3D(0, -2, 0))
+            moves.append(Vector3D(0, -2, 0))
 
         # WIP
         # if keys_pressed[pygame.K_d]:  # Turn up
@@ -65,13 +83,18 @@ def main():
         #     camera.turn_right(2)
 
         """Main Loop"""
-        WIN.fill(BLACK)
-        for i in range(len(objects)):
-            objects[i].draw(WIN, WHITE, camera)
-        time.sleep(1 / 60)
+        if (state.width, state.height) != (drawer.width, drawer.height):
+            drawer.set_size(state.width, state.height)
+        drawer.clear()
+        drawer.fill_triangles(*state.get_triangles(), state.get_shades())
+        for batch in state.get_textured_batches():
+            drawer.fill_triangles(*batch)
+        drawer.present(win)
         pygame.display.update()
 
+    PipelinedFrameLoop(prepare, render, fps=60, resolution=resolution).run()
     pygame.quit()
 
 
-main()
+if __name__ == "__main__":
+    main()
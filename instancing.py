@@ -0,0 +1,240 @@
+from typing import Union, Iterator
+import numpy as np
+import pygame
+from objects import Mesh, Camera3D
+from console_drawer import ConsoleDrawer
+from pygame_drawer import PygameDrawer
+from scene import SceneNode
+import pipeline
+from telemetry import profiler
+
+BATCH_VERTICES = 1 << 16  # Vertices of instances processed at once when faces are not sorted, limits temporary arrays
+
+class InstancedObject(SceneNode):
+    """
+    Many copies of one mesh. Every instance has only position, rotation, scale and their speeds, stored in
+    arrays shared by all instances, so memory does not grow with the size of the mesh.
+    Instances are placed relative to the node, which may be moved like any other node of the scene graph
+    """
+    def __init__(self, mesh: Mesh, capacity: int = 16):
+        super().__init__()
+        self.mesh = mesh
+        self.count = 0
+        self.positions = np.zeros((capacity, 3))
+        self.rotations = np.zeros((capacity, 3))
+        self.scales = np.zeros(capacity)
+        self.velocities = np.zeros((capacity, 3))
+        self.rotation_speeds = np.zeros((capacity, 3))
+
+        # Buffers of the transform stage, reused every frame
+        self._transformed_vertices = np.empty((0, 4), dtype=np.float32)
+        self._screen_vertices = np.empty((0, 3), dtype=np.float32)
+        self._indices = np.empty((0, 3), dtype=np.int32)  # Index buffer of consecutive instances of _indices_mesh
+        self._indices_mesh: Union[Mesh, None] = None
+
+    def _reserve(self, count: int):
+        capacity = len(self.scales)
+        if count <= capacity:
+            return
+        capacity = max(count, 2 * capacity)
+        for name in ("positions", "rotations", "scales", "velocities", "rotation_speeds"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, *old.shape[1:]))
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add_instances(self, positions, rotations=None, scales=100, velocities=None, rotation_speeds=None) -> range:
+        """
+        Add many instances at once. Every parameter is an array with a row per instance or a value for all of them
+        :param positions: Array of shape (K, 3)
+        :param rotations: Angles around x, y and z axes in degrees, zero if not given
+        :param scales: Uniform scales
+        :param velocities: Movement per unit of time (see update), zero if not given
+        :param rotation_speeds: Rotation in degrees per unit of time, zero if not given
+        :return: Indices of added instances
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        start = self.count
+        end = start + len(positions)
+        self._reserve(end)
+        self.positions[start:end] = positions
+        self.rotations[start:end] = 0 if rotations is None else rotations
+        self.scales[start:end] = scales
+        self.velocities[start:end] = 0 if velocities is None else velocities
+        self.rotation_speeds[start:end] = 0 if rotation_speeds is None else rotation_speeds
+        self.count = end
+        return range(start, end)
+
+    def add_instance(self, x, y, z, x_rot=0, y_rot=0, z_rot=0, scale=100) -> int:
+        return self.add_instances([x, y, z], [x_rot, y_rot, z_rot], scale)[0]
+
+    def remove_instance(self, index: int):
+        """
+        Remove instance <index>. The last instance takes its index
+        """
+        last = self.count - 1
+        for array in (self.positions, self.rotations, self.scales, self.velocities, self.rotation_speeds):
+            array[index] = array[last]
+        self.count = last
+
+    def update(self, dt: float = 1):
+        """
+        Move and rotate all instances by their speeds multiplied by <dt>
+        """
+        self.positions[:self.count] += self.velocities[:self.count] * dt
+        self.rotations[:self.count] += self.rotation_speeds[:self.count] * dt
+
+    def get_instance_matrices(self) -> np.ndarray:
+        """
+        Get matrices that move points of the mesh into world space
+        :return: Array of shape (K, 4, 4)
+        """
+        matrices = pipeline.compose_transforms(self.positions[:self.count], self.rotations[:self.count],
+                                               self.scales[:self.count])
+        return matrices @ np.array(self.get_world_matrix()._values, dtype=np.float64)
+
+    def get_visible_instances(self, camera: Camera3D, matrices: np.ndarray) -> np.ndarray:
+        """
+        Find instances whose bounding spheres intersect camera's view frustum
+        :param matrices: Instance matrices from get_instance_matrices
+        :return: Indices of visible instances
+        """
+        center, radius = self.mesh.get_bounding_sphere()
+        centers = center @ matrices[:, :3, :3] + matrices[:, 3, :3]
+        radii = radius * np.sqrt((matrices[:, :3, :3] ** 2).sum(axis=2).max(axis=1))
+        return np.flatnonzero(pipeline.spheres_in_frustum(camera.get_frustum_planes(), centers, radii))
+
+    def transform_vertices(self, camera: Camera3D, matrices: np.ndarray) -> np.ndarray:
+        """
+        Transform the shared vertex buffer by every matrix with one broadcast multiplication.
+        Result is written into a buffer owned by the object, so it is only valid until the next call
+        :param matrices: Array of shape (K, 4, 4) moving points of the mesh into world space
+        :return: Array of shape (K * N, 4), vertices of instance i are rows i * N ... (i + 1) * N - 1
+        """
+        vertices = self.mesh.vertices
+        vertex_count = len(vertices)
+        size = len(matrices) * vertex_count
+        if len(self._transformed_vertices) < size:
+            self._transformed_vertices = np.empty((size, 4), dtype=np.float32)
+        out = self._transformed_vertices[:size].reshape(len(matrices), vertex_count, 4)
+        clip_matrices = (matrices @ np.array(camera.get_camera_matrix()._values, dtype=np.float64))
+        clip_matrices = clip_matrices.astype(np.float32)
+        np.matmul(vertices, clip_matrices, out=out)
+        return self._transformed_vertices[:size]
+
+    def get_normal_matrices(self, camera: Camera3D, matrices: np.ndarray) -> np.ndarray:
+        """
+        Get matrices that move normals of the mesh into camera's view space (see pipeline.get_normal_matrix)
+        :param matrices: Instance matrices from get_instance_matrices
+        :return: Array of shape (K, 3, 3)
+        """
+        view = np.array(camera.get_view_matrix()._values, dtype=np.float64)[:3, :3]
+        return pipeline.get_normal_matrix(matrices[:, :3, :3] @ view).astype(np.float32)
+
+    def get_instance_indices(self, count: int) -> np.ndarray:
+        """
+        Get index buffer of <count> instances whose vertices are consecutive blocks, as in transform_vertices.
+        It is kept and grows when needed, so it is valid until the next call
+        :return: Array of shape (count * M, 3)
+        """
+        face_count = len(self.mesh.indices)
+        if self._indices_mesh is not self.mesh or len(self._indices) < count * face_count:
+            offsets = np.arange(count, dtype=np.int32) * len(self.mesh.vertices)
+            self._indices = (self.mesh.indices[None] + offsets[:, None, None]).reshape(-1, 3)
+            self._indices_mesh = self.mesh
+        return self._indices[:count * face_count]
+
+    def _get_visible_instance_matrices(self, camera: Camera3D) -> np.ndarray:
+        with profiler.stage("transform"):
+            matrices = self.get_instance_matrices()
+            visible_instances = self.get_visible_instances(camera, matrices)
+        profiler.count("objects_culled", self.count - len(visible_instances))
+        return matrices[visible_instances]
+
+    def _get_group_faces(self, camera: Camera3D, matrices: np.ndarray, scale_x: float, scale_y: float, width: int,
+                         height: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Run transform, projection, culling and shading of faces for instances with matrices <matrices>
+        :return: Clip and screen vertices, indices of visible faces and their brightness
+        """
+        with profiler.stage("transform"):
+            clip_vertices = self.transform_vertices(camera, matrices)
+            if len(self._screen_vertices) < len(clip_vertices):
+                self._screen_vertices = np.empty((len(clip_vertices), 3), dtype=np.float32)
+            screen_vertices = pipeline.project_to_screen(clip_vertices, scale_x, scale_y, width / 2, height / 2,
+                                                         out=self._screen_vertices[:len(clip_vertices)])
+        with profiler.stage("cull"):
+            indices = self.get_instance_indices(len(matrices))
+            visible, brightness = pipeline.cull_and_shade(clip_vertices, screen_vertices, indices,
+                                                          width, height, camera.get_projection_scale(),
+                                                          self.mesh.get_face_normals(),
+                                                          self.get_normal_matrices(camera, matrices))
+            profiler.count("triangles_submitted", len(indices))
+            indices = indices[visible]
+            brightness = brightness[visible]
+            profiler.count("triangles_culled", len(visible) - len(indices))
+        return clip_vertices, screen_vertices, indices, brightness
+
+    def get_visible_faces(self, camera: Camera3D, scale_x: float, scale_y: float, width: int, height: int,
+                          sort: bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Run culling of instances, transform, projection, culling and shading of faces for all instances at once
+        (see Object3D.get_visible_faces). Needed when faces are sorted, see iter_visible_faces otherwise
+        :return: Screen vertices of all visible instances, their index buffer of shape (F, 3) with only visible
+        faces and brightness of every face
+        """
+        matrices = self._get_visible_instance_matrices(camera)
+        clip_vertices, screen_vertices, indices, brightness = self._get_group_faces(camera, matrices, scale_x,
+                                                                                    scale_y, width, height)
+        if sort:
+            with profiler.stage("sort"):
+                order = np.argsort(-clip_vertices[indices, 2].mean(axis=1), kind="stable")  # Sorting by z-coordinate
+                indices = indices[order]
+                brightness = brightness[order]
+        return screen_vertices, indices, brightness
+
+    def iter_visible_faces(self, camera: Camera3D, scale_x: float, scale_y: float, width: int,
+                           height: int) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Run the same stages as get_visible_faces without sorting, for groups of visible instances with about
+        BATCH_VERTICES vertices, so temporary arrays do not grow with the number of instances. Drawing with depth
+        test does not depend on the order of groups. Arrays of a group are only valid until the next one
+        :return: Iterator over screen vertices, indices of visible faces and their brightness of every group
+        """
+        matrices = self._get_visible_instance_matrices(camera)
+        group = max(BATCH_VERTICES // max(len(self.mesh.vertices), 1), 1)
+        for start in range(0, len(matrices), group):
+            _, screen_vertices, indices, brightness = self._get_group_faces(camera, matrices[start:start + group],
+                                                                            scale_x, scale_y, width, height)
+            yield screen_vertices, indices, brightness
+
+    def draw(self, surface: Union[pygame.Surface, PygameDrawer], color: tuple[int, int, int], camera: Camera3D):
+        """
+        Draw all instances on surface <surface> according to position and angle of camera <camera>
+        (see Object3D.draw)
+        """
+        if not isinstance(surface, pygame.Surface):  # PygameDrawer or FrameState recording triangles for it
+            width = surface.width
+            height = surface.height
+            for screen_vertices, indices, brightness in self.iter_visible_faces(camera, width / 2, width / 2, width,
+                                                                                height):
+                surface.fill_triangles(screen_vertices, indices,
+                                       PygameDrawer.get_colors_by_brightness(brightness, color))
+            return
+
+        width = surface.get_width()
+        height = surface.get_height()
+        screen_vertices, indices, brightness = self.get_visible_faces(camera, width / 2, width / 2, width, height)
+        with profiler.stage("raster"):
+            points = screen_vertices[indices, :2].tolist()
+            colors = PygameDrawer.get_colors_by_brightness(brightness, color).tolist()
+            for triangle, face_color in zip(points, colors):  # Drawing polygons
+                pygame.draw.polygon(surface, face_color, triangle)
+        profiler.count("triangles_rasterized", len(indices))
+
+    def draw_console(self, console_drawer: ConsoleDrawer, camera: Camera3D):
+        width = console_drawer.width
+        height = console_drawer.height
+        for screen_vertices, indices, brightness in self.iter_visible_faces(camera, width / 2, height / 2, width,
+                                                                            height):
+            console_drawer.fill_triangles(screen_vertices, indices, ConsoleDrawer.get_codes_by_brightness(brightness))
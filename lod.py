@@ -0,0 +1,163 @@
+import numpy as np
+
+LEVEL_REDUCTION = 0.25  # Every level has about this part of triangles of the previous one
+MIN_FACES = 8  # Levels with fewer triangles are not built
+MAX_GRID_RESOLUTION = 1024
+FACES_PER_PIXEL = 2  # Triangles allowed per pixel of projected bounding circle, about half of them face the camera
+VERSION = 1  # Increased whenever built levels may change, so levels cached by older versions are rebuilt
+
+
+def get_vertex_quadrics(points: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Get error quadric of every vertex: sum of squared distances to planes of adjacent triangles, weighted by area
+    :param points: Array of shape (N, 3)
+    :param indices: Array of shape (M, 3)
+    :return: Array of shape (N, 4, 4), error of moving vertex to point p is [p, 1] @ Q @ [p, 1]
+    """
+    corners = points[indices]  # (M, 3, 3)
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normals = np.nan_to_num(normals / lengths[:, None])
+    planes = np.hstack((normals, -(normals * corners[:, 0]).sum(axis=1, keepdims=True)))
+    face_quadrics = (lengths / 2)[:, None, None] * planes[:, :, None] * planes[:, None, :]
+    quadrics = np.zeros((len(points), 4, 4))
+    for corner in range(3):
+        np.add.at(quadrics, indices[:, corner], face_quadrics)
+    return quadrics
+
+
+def cluster_vertices(points: np.ndarray, quadrics: np.ndarray, indices: np.ndarray,
+                     resolution: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merge vertices lying in the same cell of a uniform grid. Merged vertex is placed in the point with minimal
+    summed quadric error, or in the mean of the cell's vertices when that point is ambiguous or leaves the cell
+    :param points: Array of shape (N, 3)
+    :param quadrics: Vertex quadrics from get_vertex_quadrics
+    :param indices: Array of shape (M, 3)
+    :param resolution: Number of cells along the longest side of the bounding box
+    :return: New points, indices of triangles that did not collapse and indices of the triangles of <indices>
+    they come from
+    """
+    box_min = points.min(axis=0)
+    extent = points.max(axis=0) - box_min
+    cell_size = max(float(extent.max()) / resolution, 1e-12)
+    cell_counts = np.maximum(np.ceil(extent / cell_size).astype(np.int64), 1)
+    cells = np.minimum(((points - box_min) / cell_size).astype(np.int64), cell_counts - 1)
+    keys = (cells[:, 0] * cell_counts[1] + cells[:, 1]) * cell_counts[2] + cells[:, 2]
+    _, cluster = np.unique(keys, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    count = cluster.max() + 1
+
+    sizes = np.bincount(cluster, minlength=count)
+    means = np.stack([np.bincount(cluster, points[:, i], count) for i in range(3)], axis=1) / sizes[:, None]
+    cluster_min = np.full((count, 3), np.inf)
+    cluster_max = np.full((count, 3), -np.inf)
+    np.minimum.at(cluster_min, cluster, points)
+    np.maximum.at(cluster_max, cluster, points)
+    cluster_quadrics = np.zeros((count, 4, 4))
+    np.add.at(cluster_quadrics, cluster, quadrics)
+
+    # Minimum of the quadric: A @ p = -b, A is the upper left 3x3 block and b is the last column
+    a = cluster_quadrics[:, :3, :3]
+    b = -cluster_quadrics[:, :3, 3]
+    scale = np.abs(a).max(axis=(1, 2))
+    solvable = np.abs(np.linalg.det(a)) > 1e-9 * np.maximum(scale, 1e-30) ** 3
+    new_points = means.copy()
+    if solvable.any():
+        solution = np.linalg.solve(a[solvable], b[solvable][:, :, None])[:, :, 0]
+        tolerance = cell_size * 1e-3
+        inside = ((solution >= cluster_min[solvable] - tolerance) &
+                  (solution <= cluster_max[solvable] + tolerance)).all(axis=1)
+        rows = np.flatnonzero(solvable)[inside]
+        new_points[rows] = solution[inside]
+
+    # Dropping collapsed triangles and duplicates, keeping winding of the first occurrence
+    faces = cluster[indices]
+    source = np.flatnonzero((faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) &
+                            (faces[:, 2] != faces[:, 0]))
+    _, first = np.unique(np.sort(faces[source], axis=1), axis=0, return_index=True)
+    source = source[np.sort(first)]
+
+    # Removing vertices not used by any triangle
+    used, faces = np.unique(faces[source], return_inverse=True)
+    return new_points[used], faces.reshape(-1, 3), source
+
+
+def simplify(vertices: np.ndarray, indices: np.ndarray, target_faces: int,
+             quadrics: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Simplify triangle mesh by vertex clustering to at most <target_faces> triangles.
+    Grid resolution is found by binary search, the finest grid giving few enough triangles is used
+    :param vertices: Array of shape (N, 3) or (N, 4)
+    :param indices: Array of shape (M, 3)
+    :param target_faces: Maximal number of triangles of the result
+    :param quadrics: Vertex quadrics, computed if not given
+    :return: Vertices of shape (N', 4) and indices of shape (M', 3)
+    """
+    return _simplify(vertices, indices, target_faces, quadrics)[:2]
+
+
+def _simplify(vertices: np.ndarray, indices: np.ndarray, target_faces: int,
+              quadrics: np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    See simplify, also returns indices of the original triangles that every new one comes from
+    """
+    points = np.asarray(vertices)[:, :3].astype(np.float64)
+    indices = np.asarray(indices, dtype=np.int64)
+    if quadrics is None:
+        quadrics = get_vertex_quadrics(points, indices)
+    best = (np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64), np.zeros(0, dtype=np.int64))
+    low, high = 1, MAX_GRID_RESOLUTION
+    while low <= high:
+        resolution = (low + high) // 2
+        result = cluster_vertices(points, quadrics, indices, resolution)
+        if len(result[1]) <= target_faces:
+            best = result
+            low = resolution + 1
+        else:
+            high = resolution - 1
+    new_points, new_indices, source = best
+    new_vertices = np.ones((len(new_points), 4), dtype=np.float32)
+    new_vertices[:, :3] = new_points
+    return new_vertices, new_indices.astype(np.int32), source
+
+
+def build_chain(vertices: np.ndarray, indices: np.ndarray, levels: int,
+                reduction: float = LEVEL_REDUCTION) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Build simplified versions of a mesh, each with about <reduction> of triangles of the previous one.
+    Every level is simplified from the original mesh, so errors do not accumulate
+    :return: List of (vertices, indices, source faces) of levels 1, 2, ..., may be shorter than <levels - 1>
+    for small meshes. Source faces are indices of the original triangles that triangles of the level come from,
+    so their texture coordinates and normals can be reused
+    """
+    points = np.asarray(vertices)[:, :3].astype(np.float64)
+    quadrics = get_vertex_quadrics(points, np.asarray(indices, dtype=np.int64))
+    chain = []
+    face_count = len(indices)
+    for _ in range(levels - 1):
+        target = int(face_count * reduction)
+        if target < MIN_FACES:
+            break
+        level = _simplify(vertices, indices, target, quadrics)
+        if len(level[1]) == 0:
+            break
+        chain.append(level)
+        face_count = len(level[1])
+    return chain
+
+
+def select_level(face_counts: list[int], pixel_radius: float, bias: float = 0) -> int:
+    """
+    Choose the most detailed level whose triangles fit into the budget of the object's screen size
+    :param face_counts: Number of triangles of every level, from the most detailed one
+    :param pixel_radius: Radius of the projected bounding sphere in pixels
+    :param bias: Positive values choose coarser levels, every unit halves the budget
+    :return: Index of the level
+    """
+    budget = FACES_PER_PIXEL * np.pi * pixel_radius ** 2 * 2.0 ** -bias
+    for level, face_count in enumerate(face_counts):
+        if face_count <= budget:
+            return level
+    return len(face_counts) - 1
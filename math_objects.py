@@ -8,12 +8,30 @@ def deg_to_rad(degrees: Union[int, float]):
 
 
 class Vector3D:
+    """
+    Point or vector of homogeneous coordinates. Methods that build a new vector also take <out>, an existing
+    vector to write the result into instead, so code called many times per frame does not allocate.
+    <out> may be one of the operands
+    """
+    __slots__ = ("x", "y", "z", "w")
+
     def __init__(self, x: Union[int, float], y: Union[int, float], z: Union[int, float], w: Union[int, float] = 1):
         self.x = x
         self.y = y
         self.z = z
         self.w = w  # 1 - point, 0 - vector
 
+    def set(self, x: Union[int, float], y: Union[int, float], z: Union[int, float],
+            w: Union[int, float] = 1) -> Vector3D:
+        self.x = x
+        self.y = y
+        self.z = z
+        self.w = w
+        return self
+
+    def copy(self) -> Vector3D:
+        return Vector3D(self.x, self.y, self.z, self.w)
+
     def __add__(self, other: Vector3D) -> Vector3D:
         return Vector3D(self.x + other.x,
                         self.y + other.y,
@@ -26,35 +44,74 @@ class Vector3D:
                         self.z - other.z,
                         self.w)
 
-    def mul_by_scalar(self, n: Union[int, float]) -> Vector3D:
-        return Vector3D(self.x * n,
-                        self.y * n,
-                        self.z * n,
-                        self.w)
+    def add(self, other: Vector3D, out: Vector3D = None) -> Vector3D:
+        if out is None:
+            return self + other
+        return out.set(self.x + other.x, self.y + other.y, self.z + other.z, self.w)
+
+    def sub(self, other: Vector3D, out: Vector3D = None) -> Vector3D:
+        if out is None:
+            return self - other
+        return out.set(self.x - other.x, self.y - other.y, self.z - other.z, self.w)
+
+    def mul_by_scalar(self, n: Union[int, float], out: Vector3D = None) -> Vector3D:
+        if out is None:
+            return Vector3D(self.x * n,
+                            self.y * n,
+                            self.z * n,
+                            self.w)
+        return out.set(self.x * n, self.y * n, self.z * n, self.w)
 
-    def mul_by_matrix(self, m: Matrix4x4) -> Vector3D:
-        new_x = self.x * m[0][0] + self.y * m[1][0] + self.z * m[2][0] + self.w * m[3][0]
-        new_y = self.x * m[0][1] + self.y * m[1][1] + self.z * m[2][1] + self.w * m[3][1]
-        new_z = self.x * m[0][2] + self.y * m[1][2] + self.z * m[2][2] + self.w * m[3][2]
-        new_w = self.x * m[0][3] + self.y * m[1][3] + self.z * m[2][3] + self.w * m[3][3]
-        return Vector3D(new_x, new_y, new_z, new_w)
+    def mul_by_matrix(self, m: Matrix4x4, out: Vector3D = None) -> Vector3D:
+        (m00, m01, m02, m03), (m10, m11, m12, m13), (m20, m21, m22, m23), (m30, m31, m32, m33) = m._values
+        x, y, z, w = self.x, self.y, self.z, self.w
+        new_x = x * m00 + y * m10 + z * m20 + w * m30
+        new_y = x * m01 + y * m11 + z * m21 + w * m31
+        new_z = x * m02 + y * m12 + z * m22 + w * m32
+        new_w = x * m03 + y * m13 + z * m23 + w * m33
+        if out is None:
+            return Vector3D(new_x, new_y, new_z, new_w)
+        return out.set(new_x, new_y, new_z, new_w)
+
+    def transform_and_project(self, m: Matrix4x4, scale_x: Union[int, float], scale_y: Union[int, float],
+                              center_x: Union[int, float], center_y: Union[int, float],
+                              out: Vector3D = None) -> Vector3D:
+        """
+        Multiply point by camera matrix <m> and map it onto the screen like pipeline.project_to_screen does
+        :return: Vector with screen x, screen y, depth and w in clip space, which is negative for points
+        in front of the camera
+        """
+        (m00, m01, m02, m03), (m10, m11, m12, m13), (m20, m21, m22, m23), (m30, m31, m32, m33) = m._values
+        x, y, z, w = self.x, self.y, self.z, self.w
+        clip_w = x * m03 + y * m13 + z * m23 + w * m33
+        inverse_w = 1 / clip_w if clip_w else float("inf")
+        screen_x = (x * m00 + y * m10 + z * m20 + w * m30) * inverse_w * scale_x + center_x
+        screen_y = (x * m01 + y * m11 + z * m21 + w * m31) * inverse_w * scale_y + center_y
+        depth = (x * m02 + y * m12 + z * m22 + w * m32) * inverse_w
+        if out is None:
+            return Vector3D(screen_x, screen_y, depth, clip_w)
+        return out.set(screen_x, screen_y, depth, clip_w)
 
     def length(self) -> float:
-        return sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+        return sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
-    def normalize(self) -> Vector3D:
+    def normalize(self, out: Vector3D = None) -> Vector3D:
         l = self.length()
-        return Vector3D(self.x / l,
-                        self.y / l,
-                        self.z / l,
-                        self.w)
+        if out is None:
+            return Vector3D(self.x / l,
+                            self.y / l,
+                            self.z / l,
+                            self.w)
+        return out.set(self.x / l, self.y / l, self.z / l, self.w)
 
     @staticmethod
-    def cross_product(a: Vector3D, b: Vector3D) -> Vector3D:
-        return Vector3D(a.y * b.z - a.z * b.y,
-                        a.z * b.x - a.x * b.z,
-                        a.x * b.y - a.y * b.x,
-                        a.w)
+    def cross_product(a: Vector3D, b: Vector3D, out: Vector3D = None) -> Vector3D:
+        x = a.y * b.z - a.z * b.y
+        y = a.z * b.x - a.x * b.z
+        z = a.x * b.y - a.y * b.x
+        if out is None:
+            return Vector3D(x, y, z, a.w)
+        return out.set(x, y, z, a.w)
 
     @staticmethod
     def dot_product(a: Vector3D, b: Vector3D) -> float:
@@ -65,25 +122,66 @@ class Vector3D:
 
 
 class Matrix4x4:
+    """
+    Matrix stored as a list of 4 rows. Points are rows multiplied by the matrix from the left.
+    Like Vector3D, methods building a matrix take <out> to overwrite an existing matrix instead
+    """
+    __slots__ = ("_values",)
+
     def __init__(self, values: list[list[Union[int, float]]] = None):
+        """
+        :param values: Rows of the matrix, copied so methods writing into the matrix do not change them
+        """
         if values is None:
-            self._values = [[0 for _ in range(4)] for __ in range(4)]
+            self._values = [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
         else:
-            self._values = values
+            self._values = [list(row) for row in values]
+
+    @staticmethod
+    def _from_rows(rows: list[list[Union[int, float]]]) -> Matrix4x4:
+        """
+        Make a matrix owning <rows>, which must not be used anywhere else
+        """
+        matrix = Matrix4x4.__new__(Matrix4x4)
+        matrix._values = rows
+        return matrix
 
     def __getitem__(self, index: int) -> list[float]:
         return self._values[index]
 
     @staticmethod
-    def multiply(a: Matrix4x4, b: Matrix4x4) -> Matrix4x4:
-        res_matrix = Matrix4x4()
-        for i in range(4):
-            for j in range(4):
-                s = 0
-                for k in range(4):
-                    s += a[i][k] * b[k][j]
-                res_matrix[i][j] = s
-        return res_matrix
+    def _write(out: Matrix4x4, rows: list[list[Union[int, float]]]) -> Matrix4x4:
+        """
+        Make a matrix of <rows>, or copy them into the row lists of <out>, which stay the same objects
+        """
+        if out is None:
+            return Matrix4x4._from_rows(rows)
+        row0, row1, row2, row3 = out._values
+        row0[:], row1[:], row2[:], row3[:] = rows
+        return out
+
+    @staticmethod
+    def multiply(a: Matrix4x4, b: Matrix4x4, out: Matrix4x4 = None) -> Matrix4x4:
+        (a00, a01, a02, a03), (a10, a11, a12, a13), (a20, a21, a22, a23), (a30, a31, a32, a33) = a._values
+        (b00, b01, b02, b03), (b10, b11, b12, b13), (b20, b21, b22, b23), (b30, b31, b32, b33) = b._values
+        return Matrix4x4._write(out, [
+            [a00 * b00 + a01 * b10 + a02 * b20 + a03 * b30, a00 * b01 + a01 * b11 + a02 * b21 + a03 * b31,
+             a00 * b02 + a01 * b12 + a02 * b22 + a03 * b32, a00 * b03 + a01 * b13 + a02 * b23 + a03 * b33],
+            [a10 * b00 + a11 * b10 + a12 * b20 + a13 * b30, a10 * b01 + a11 * b11 + a12 * b21 + a13 * b31,
+             a10 * b02 + a11 * b12 + a12 * b22 + a13 * b32, a10 * b03 + a11 * b13 + a12 * b23 + a13 * b33],
+            [a20 * b00 + a21 * b10 + a22 * b20 + a23 * b30, a20 * b01 + a21 * b11 + a22 * b21 + a23 * b31,
+             a20 * b02 + a21 * b12 + a22 * b22 + a23 * b32, a20 * b03 + a21 * b13 + a22 * b23 + a23 * b33],
+            [a30 * b00 + a31 * b10 + a32 * b20 + a33 * b30, a30 * b01 + a31 * b11 + a32 * b21 + a33 * b31,
+             a30 * b02 + a31 * b12 + a32 * b22 + a33 * b32, a30 * b03 + a31 * b13 + a32 * b23 + a33 * b33],
+        ])
+
+    def copy(self, out: Matrix4x4 = None) -> Matrix4x4:
+        """
+        Get a copy of the matrix, written into <out> if given
+        """
+        (m00, m01, m02, m03), (m10, m11, m12, m13), (m20, m21, m22, m23), (m30, m31, m32, m33) = self._values
+        return Matrix4x4._write(out, [[m00, m01, m02, m03], [m10, m11, m12, m13], [m20, m21, m22, m23],
+                                      [m30, m31, m32, m33]])
 
     def print(self) -> None:
         for line in self._values:
@@ -92,7 +190,7 @@ class Matrix4x4:
 
     @staticmethod
     def get_identity_matrix():
-        return Matrix4x4([
+        return Matrix4x4._from_rows([
             [1, 0, 0, 0],
             [0, 1, 0, 0],
             [0, 0, 1, 0],
@@ -107,7 +205,7 @@ class Matrix4x4:
         :return: X-axis rotation matrix
         """
         angle = deg_to_rad(angle)
-        return Matrix4x4([
+        return Matrix4x4._from_rows([
             [1, 0, 0, 0],
             [0, cos(angle), sin(angle), 0],
             [0, -sin(angle), cos(angle), 0],
@@ -122,7 +220,7 @@ class Matrix4x4:
         :return: Y-axis rotation matrix
         """
         angle = deg_to_rad(angle)
-        return Matrix4x4([
+        return Matrix4x4._from_rows([
             [cos(angle), 0, -sin(angle), 0],
             [0, 1, 0, 0],
             [sin(angle), 0, cos(angle), 0],
@@ -137,7 +235,7 @@ class Matrix4x4:
         :return: Z-axis rotation matrix
         """
         angle = deg_to_rad(angle)
-        return Matrix4x4([
+        return Matrix4x4._from_rows([
             [cos(angle), sin(angle), 0, 0],
             [-sin(angle), cos(angle), 0, 0],
             [0, 0, 1, 0],
@@ -153,7 +251,7 @@ class Matrix4x4:
         :param dz: Shift along z-axis
         :return: Translation matrix
         """
-        return Matrix4x4([
+        return Matrix4x4._from_rows([
             [1, 0, 0, 0],
             [0, 1, 0, 0],
             [0, 0, 1, 0],
@@ -169,13 +267,40 @@ class Matrix4x4:
         :param sz: Size modifier along z-axis
         :return: Scaling matrix
         """
-        return Matrix4x4([
+        return Matrix4x4._from_rows([
             [sx, 0, 0, 0],
             [0, sy, 0, 0],
             [0, 0, sz, 0],
             [0, 0, 0, 1]
         ])
 
+    @staticmethod
+    def compose_trs(scale: Union[int, float], x_rot: Union[int, float], y_rot: Union[int, float],
+                    z_rot: Union[int, float], dx: Union[int, float], dy: Union[int, float], dz: Union[int, float],
+                    out: Matrix4x4 = None) -> Matrix4x4:
+        """
+        Get the same matrix as the product of get_scale, get_rotate_x, get_rotate_y, get_rotate_z and
+        get_translation, built at once
+        :param scale: Uniform scale
+        :param x_rot: Angle of rotation around x-axis in degrees
+        :param y_rot: Angle of rotation around y-axis in degrees
+        :param z_rot: Angle of rotation around z-axis in degrees
+        """
+        x_rot = deg_to_rad(x_rot)
+        y_rot = deg_to_rad(y_rot)
+        z_rot = deg_to_rad(z_rot)
+        cx, sx = cos(x_rot), sin(x_rot)
+        cy, sy = cos(y_rot), sin(y_rot)
+        cz, sz = cos(z_rot), sin(z_rot)
+        sx_sy = sx * sy
+        cx_sy = cx * sy
+        return Matrix4x4._write(out, [
+            [scale * cy * cz, scale * cy * sz, -scale * sy, 0],
+            [scale * (sx_sy * cz - cx * sz), scale * (sx_sy * sz + cx * cz), scale * sx * cy, 0],
+            [scale * (cx_sy * cz + sx * sz), scale * (cx_sy * sz - sx * cz), scale * cx * cy, 0],
+            [dx, dy, dz, 1]
+        ])
+
     @staticmethod
     def get_look_at(eye: Vector3D, target: Vector3D, up: Vector3D) -> Matrix4x4:
         """
@@ -186,18 +311,24 @@ class Matrix4x4:
         :param up: Camera's "up" direction
         :return: View matrix
         """
-        vz = (target - eye).normalize()  # Vector "forward"
-        vx = Vector3D.cross_product(up, vz).normalize()  # Vector "right"
-        vy = Vector3D.cross_product(vz, vx).normalize()  # Vector "up"
-        return Matrix4x4.multiply(
-            Matrix4x4.get_translation(-eye.x, -eye.y, -eye.z),
-            Matrix4x4([
-                [vx.x, vy.x, vz.x, 0],
-                [vx.y, vy.y, vz.y, 0],
-                [vx.z, vy.z, vz.z, 0],
-                [0, 0, 0, 1]
-            ])
-        )
+        # Same as building vectors with normalize and cross_product, without allocating them
+        fx, fy, fz = target.x - eye.x, target.y - eye.y, target.z - eye.z
+        l = sqrt(fx * fx + fy * fy + fz * fz)
+        fx, fy, fz = fx / l, fy / l, fz / l  # Vector "forward"
+        rx, ry, rz = up.y * fz - up.z * fy, up.z * fx - up.x * fz, up.x * fy - up.y * fx
+        l = sqrt(rx * rx + ry * ry + rz * rz)
+        rx, ry, rz = rx / l, ry / l, rz / l  # Vector "right"
+        ux, uy, uz = fy * rz - fz * ry, fz * rx - fx * rz, fx * ry - fy * rx
+        l = sqrt(ux * ux + uy * uy + uz * uz)
+        ux, uy, uz = ux / l, uy / l, uz / l  # Vector "up"
+        # Product of translation by -eye and rotation into the camera's axes
+        return Matrix4x4._from_rows([
+            [rx, ux, fx, 0],
+            [ry, uy, fy, 0],
+            [rz, uz, fz, 0],
+            [-(eye.x * rx + eye.y * ry + eye.z * rz), -(eye.x * ux + eye.y * uy + eye.z * uz),
+             -(eye.x * fx + eye.y * fy + eye.z * fz), 1]
+        ])
 
     @staticmethod
     def get_perspective_projection(fov: Union[int, float], aspect: Union[int, float],
@@ -215,7 +346,7 @@ class Matrix4x4:
         sz = (f + n) / (f - n)
         dz = (-2 * f * n) / (f - n)
 
-        return Matrix4x4([
+        return Matrix4x4._from_rows([
             [sx, 0, 0, 0],
             [0, sy, 0, 0],
             [0, 0, sz, -1],
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import struct
+from typing import Union
+import numpy as np
+from objects import Mesh
+import obj_loader
+import lod
+
+MAGIC = b"B3DMESH1"
+CACHE_EXTENSION = ".meshcache"
+ALIGNMENT = 64  # Arrays start at offsets divisible by this, so memory-mapped arrays are aligned
+HASH_CHUNK_SIZE = 1 << 22
+ARRAY_NAMES = ("vertices", "indices", "uvs", "uv_indices", "normals", "normal_indices")
+
+# Cache file layout: MAGIC, length of JSON header (uint32, little-endian), JSON header, arrays.
+# Header has "source" with size, mtime_ns and hash of the source file and version of the parser that read it
+# (obj_loader.PARSER_VERSION), and "arrays" with dtype, shape
+# and offset of every array. Offsets are counted from the first multiple of ALIGNMENT after the header
+
+
+def get_cache_path(source_path: str) -> str:
+    return source_path + CACHE_EXTENSION
+
+
+def get_lod_cache_path(source_path: str, level: int) -> str:
+    return f"{source_path}.lod{level}{CACHE_EXTENSION}"
+
+
+def hash_file(file_path: str) -> str:
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(file_path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def align(size: int) -> int:
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def write_mesh_cache(mesh: Mesh, cache_path: str, source: dict):
+    """
+    Write arrays of <mesh> into binary cache file. File is replaced atomically
+    :param mesh: Mesh to save
+    :param cache_path: Path of the cache file
+    :param source: Size, mtime_ns and hash of the source file, version of the parser
+    """
+    arrays = {name: getattr(mesh, name) for name in ARRAY_NAMES if getattr(mesh, name) is not None}
+    descriptions = {}
+    offset = 0
+    for name, array in arrays.items():
+        descriptions[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += align(array.nbytes)
+    header = json.dumps({"source": source, "arrays": descriptions}).encode()
+    data_start = align(len(MAGIC) + 4 + len(header))
+
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for name, array in arrays.items():
+            file.seek(data_start + descriptions[name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temp_path, cache_path)
+
+
+def read_mesh_cache(cache_path: str) -> tuple[dict, Mesh]:
+    """
+    Read header of cache file and memory-map its arrays
+    :param cache_path: Path of the cache file
+    :return: Description of the source file and mesh with read-only memory-mapped arrays
+    """
+    with open(cache_path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{cache_path} is not a mesh cache file")
+        header_length = struct.unpack("<I", file.read(4))[0]
+        header = json.loads(file.read(header_length))
+    data_start = align(len(MAGIC) + 4 + header_length)
+    arrays = {}
+    for name, description in header["arrays"].items():
+        shape = tuple(description["shape"])
+        if 0 in shape:  # Empty arrays can not be memory-mapped
+            arrays[name] = np.empty(shape, dtype=description["dtype"])
+        else:
+            arrays[name] = np.memmap(cache_path, dtype=description["dtype"], mode="r",
+                                     offset=data_start + description["offset"], shape=shape)
+    return header["source"], Mesh(**arrays)
+
+
+def load_obj_cached(file_path: str) -> Mesh:
+    """
+    Load mesh from .obj file using binary cache file next to it. Cache is used if it was written by the current
+    version of the parser and size and modification time of the source match ones saved in the cache, or if its
+    content has the same hash. Otherwise the source is parsed and the cache is rewritten
+    :param file_path: Path to .obj file
+    :return: Mesh, memory-mapped when cache was used
+    """
+    cache_path = get_cache_path(file_path)
+    stat = os.stat(file_path)
+    try:
+        source, mesh = read_mesh_cache(cache_path)
+        if source.get("parser") == obj_loader.PARSER_VERSION and source["size"] == stat.st_size:
+            if source["mtime_ns"] == stat.st_mtime_ns:
+                return mesh
+            if source["hash"] == hash_file(file_path):  # Source was touched but not changed
+                source["mtime_ns"] = stat.st_mtime_ns
+                _try_write_mesh_cache(mesh, cache_path, source)
+                return mesh
+    except (OSError, ValueError, KeyError, TypeError):  # No cache or it is broken
+        pass
+
+    hasher = hashlib.blake2b(digest_size=20)
+    parser = obj_loader.ObjParser()
+    parser.parse_file(file_path, hasher=hasher)
+    mesh = parser.get_mesh()
+    source = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": hasher.hexdigest(),
+              "parser": obj_loader.PARSER_VERSION}
+    _try_write_mesh_cache(mesh, cache_path, source)
+    return mesh
+
+
+def load_lod_cached(file_path: str, mesh: Mesh, levels: int) -> list[Mesh]:
+    """
+    Get simplified meshes of <mesh> loaded by load_obj_cached (see Mesh.build_lod_chain), using cache files next
+    to its mesh cache. Levels are saved with the description of the source from the mesh cache, so they are
+    rebuilt whenever the mesh is
+    :param file_path: Path to .obj file
+    :param mesh: Mesh loaded from the file
+    :param levels: Maximal number of levels, including the mesh
+    :return: List of simplified meshes, memory-mapped when cache was used
+    """
+    try:
+        source, _ = read_mesh_cache(get_cache_path(file_path))
+    except (OSError, ValueError, KeyError, TypeError):  # Levels can not be checked without the mesh cache
+        return mesh.build_lod_chain(levels)
+    source = dict(source, lod={"levels": levels, "reduction": lod.LEVEL_REDUCTION, "version": lod.VERSION})
+    try:
+        meshes = _read_lod_cache(file_path, source)
+        if meshes is not None:
+            return meshes
+    except (OSError, ValueError, KeyError, TypeError):  # No cache or it is broken
+        pass
+
+    meshes = mesh.build_lod_chain(levels)
+    for level, level_mesh in enumerate(meshes, 1):
+        _try_write_mesh_cache(level_mesh, get_lod_cache_path(file_path, level), dict(source, count=len(meshes)))
+    return meshes
+
+
+def _read_lod_cache(file_path: str, source: dict) -> Union[list[Mesh], None]:
+    """
+    :return: Cached levels, or None if they were built for another source or with other parameters
+    """
+    meshes = []
+    count = 1  # Number of levels, saved in every one of them
+    while len(meshes) < count:
+        level_source, level_mesh = read_mesh_cache(get_lod_cache_path(file_path, len(meshes) + 1))
+        count = level_source.pop("count")
+        if level_source != source:
+            return None
+        meshes.append(level_mesh)
+    return meshes
+
+
+def _try_write_mesh_cache(mesh: Mesh, cache_path: str, source: dict):
+    try:
+        write_mesh_cache(mesh, cache_path, source)
+    except OSError:  # Directory is read-only, mesh is still usable
+        pass
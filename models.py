@@ -1,63 +1,93 @@
-from objects import Vector3D, Object3D, Polygon
+import numpy as np
+from objects import Object3D, Mesh
+import obj_loader
+import mesh_cache
 
 
 class FileObject(Object3D):
-    def __init__(self, file_path: str):
-        file = open(file_path, "r").read().split("\n")
-        vertices = []
-        indices = []
-        for line in file:
-            if line[0] == "v":
-                line = line.split()[1:]
-                line = [float(i) for i in line]
-                vertices.append(Vector3D(line[0], line[1], line[2]))
-            elif line[0] == "f":
-                line = line.split()[1:]
-                line = [int(i) - 1 for i in line]
-                indices.append(line)
+    def __init__(self, file_path: str, use_cache: bool = True, texture_path: str = None):
+        """
+        :param file_path: Path to .obj file
+        :param use_cache: Whether to load mesh from binary cache file next to the source, creating it if needed
+        :param texture_path: Image mapped onto the mesh by its texture coordinates (<vt> statements), loaded
+        through textures.texture_cache
+        """
+        if use_cache:
+            mesh = mesh_cache.load_obj_cached(file_path)
+        else:
+            mesh = obj_loader.load_obj(file_path)
+        super().__init__(mesh)
+        self.file_path = file_path
+        self.use_cache = use_cache
+        self.texture = texture_path
 
-        polygons = []
-        for i in indices:
-            polygons.append(Polygon([vertices[i[0]], vertices[i[1]], vertices[i[2]]]))
-
-        super().__init__(polygons)
+    def enable_lod(self, levels: int = 4):
+        """
+        See Object3D.enable_lod. Levels are read from cache files next to the mesh cache, and are built and
+        saved there on first use
+        """
+        if not self.use_cache:
+            super().enable_lod(levels)
+            return
+        mesh = self.mesh
+        self.lod_meshes = mesh.get_lod_meshes(levels, lambda count: mesh_cache.load_lod_cached(self.file_path, mesh,
+                                                                                                count))
 
 
+# Triangles of a box with 8 corners, shared by Cube and CutPyramid
+BOX_INDICES = [
+    [0, 1, 2], [3, 2, 1],
+    [0, 2, 4], [5, 4, 2],
+    [5, 6, 4], [6, 5, 7],
+    [1, 6, 7], [7, 3, 1],
+    [6, 1, 0], [0, 4, 6],
+    [2, 3, 5], [7, 5, 3],
+]
 
 
 class Cube(Object3D):
     def __init__(self):
-        polygons = [
-            Polygon([Vector3D(-1, -1, -1), Vector3D(-1, -1, 1), Vector3D(-1, 1, -1)]),
-            Polygon([Vector3D(-1, 1, 1), Vector3D(-1, 1, -1), Vector3D(-1, -1, 1)]),
-            Polygon([Vector3D(-1, -1, -1), Vector3D(-1, 1, -1), Vector3D(1, -1, -1)]),
-            Polygon([Vector3D(1, 1, -1), Vector3D(1, -1, -1), Vector3D(-1, 1, -1)]),
-            Polygon([Vector3D(1, 1, -1), Vector3D(1, -1, 1), Vector3D(1, -1, -1)]),
-            Polygon([Vector3D(1, -1, 1), Vector3D(1, 1, -1), Vector3D(1, 1, 1)]),
-            Polygon([Vector3D(-1, -1, 1), Vector3D(1, -1, 1), Vector3D(1, 1, 1)]),
-            Polygon([Vector3D(1, 1, 1), Vector3D(-1, 1, 1), Vector3D(-1, -1, 1)]),
-            Polygon([Vector3D(1, -1, 1), Vector3D(-1, -1, 1), Vector3D(-1, -1, -1)]),
-            Polygon([Vector3D(-1, -1, -1), Vector3D(1, -1, -1), Vector3D(1, -1, 1)]),
-            Polygon([Vector3D(-1, 1, -1), Vector3D(-1, 1, 1), Vector3D(1, 1, -1)]),
-            Polygon([Vector3D(1, 1, 1), Vector3D(1, 1, -1), Vector3D(-1, 1, 1)]),
+        vertices = [
+            (-1, -1, -1), (-1, -1, 1), (-1, 1, -1), (-1, 1, 1),
+            (1, -1, -1), (1, 1, -1), (1, -1, 1), (1, 1, 1),
         ]
-        super().__init__(polygons)
+        super().__init__(Mesh(vertices, BOX_INDICES))
 
 
 class CutPyramid(Object3D):
     def __init__(self):
-        polygons = [
-            Polygon([Vector3D(-1, -1, -1), Vector3D(-1, -1, 1), Vector3D(-0.5, 1, -0.5)]),
-            Polygon([Vector3D(-0.5, 1, 0.5), Vector3D(-0.5, 1, -0.5), Vector3D(-1, -1, 1)]),
-            Polygon([Vector3D(-1, -1, -1), Vector3D(-0.5, 1, -0.5), Vector3D(1, -1, -1)]),
-            Polygon([Vector3D(0.5, 1, -0.5), Vector3D(1, -1, -1), Vector3D(-0.5, 1, -0.5)]),
-            Polygon([Vector3D(0.5, 1, -0.5), Vector3D(1, -1, 1), Vector3D(1, -1, -1)]),
-            Polygon([Vector3D(1, -1, 1), Vector3D(0.5, 1, -0.5), Vector3D(0.5, 1, 0.5)]),
-            Polygon([Vector3D(-1, -1, 1), Vector3D(1, -1, 1), Vector3D(0.5, 1, 0.5)]),
-            Polygon([Vector3D(0.5, 1, 0.5), Vector3D(-0.5, 1, 0.5), Vector3D(-1, -1, 1)]),
-            Polygon([Vector3D(1, -1, 1), Vector3D(-1, -1, 1), Vector3D(-1, -1, -1)]),
-            Polygon([Vector3D(-1, -1, -1), Vector3D(1, -1, -1), Vector3D(1, -1, 1)]),
-            Polygon([Vector3D(-0.5, 1, -0.5), Vector3D(-0.5, 1, 0.5), Vector3D(0.5, 1, -0.5)]),
-            Polygon([Vector3D(0.5, 1, 0.5), Vector3D(0.5, 1, -0.5), Vector3D(-0.5, 1, 0.5)]),
+        vertices = [
+            (-1, -1, -1), (-1, -1, 1), (-0.5, 1, -0.5), (-0.5, 1, 0.5),
+            (1, -1, -1), (0.5, 1, -0.5), (1, -1, 1), (0.5, 1, 0.5),
         ]
-        super().__init__(polygons)
+        super().__init__(Mesh(vertices, BOX_INDICES))
+
+
+def make_sphere_mesh(rings: int, segments: int) -> Mesh:
+    """
+    Build UV sphere of radius 1 with 2 * segments * (rings - 1) triangles
+    :param rings: Number of bands between the poles, at least 2
+    :param segments: Number of vertices on every circle of latitude, at least 3
+    """
+    theta = np.linspace(0, np.pi, rings + 1)[1:-1, None]  # Latitudes without poles
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)[None, :]
+    circles = np.stack([np.sin(theta) * np.cos(phi), np.cos(theta) + 0 * phi, np.sin(theta) * np.sin(phi)], axis=-1)
+    vertices = np.vstack([[(0, 1, 0)], circles.reshape(-1, 3), [(0, -1, 0)]])
+
+    column = np.arange(segments)
+    next_column = (column + 1) % segments
+    bottom = len(vertices) - 1
+    faces = [np.stack([np.zeros(segments, dtype=np.int64), 1 + next_column, 1 + column], axis=1)]
+    for ring in range(rings - 2):
+        upper = 1 + ring * segments
+        lower = upper + segments
+        faces.append(np.stack([upper + column, upper + next_column, lower + column], axis=1))
+        faces.append(np.stack([upper + next_column, lower + next_column, lower + column], axis=1))
+    last = 1 + (rings - 2) * segments
+    faces.append(np.stack([np.full(segments, bottom), last + column, last + next_column], axis=1))
+    return Mesh(vertices, np.concatenate(faces))
+
+
+class Sphere(Object3D):
+    def __init__(self, rings: int = 16, segments: int = 32):
+        super().__init__(make_sphere_mesh(rings, segments))
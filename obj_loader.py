@@ -0,0 +1,213 @@
+from itertools import chain
+from operator import methodcaller
+import numpy as np
+from objects import Mesh
+
+CHUNK_SIZE = 1 << 22  # Bytes read from file at once
+PARSER_VERSION = 2  # Increased whenever parsed meshes may change, so meshes cached by older versions are rebuilt
+
+
+class ArrayBuilder:
+    """
+    Growable 2D array that doubles its capacity when full, so rows are appended without per-row objects
+    """
+    def __init__(self, columns: int, dtype, capacity: int = 1024):
+        self._data = np.empty((capacity, columns), dtype=dtype)
+        self.size = 0
+
+    def extend(self, rows: np.ndarray):
+        new_size = self.size + len(rows)
+        if new_size > len(self._data):
+            data = np.empty((max(new_size, 2 * len(self._data)), self._data.shape[1]), dtype=self._data.dtype)
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+        self._data[self.size:new_size] = rows
+        self.size = new_size
+
+    def get_rows(self) -> np.ndarray:
+        """
+        Get view of added rows, valid until the next <extend>
+        """
+        return self._data[:self.size]
+
+    def get_array(self) -> np.ndarray:
+        """
+        Get array with added rows. Unused capacity is released in place, without copying
+        """
+        self._data.resize((self.size, self._data.shape[1]), refcheck=False)
+        return self._data
+
+
+class ObjParser:
+    """
+    Streaming parser of Wavefront .obj files. Reads <v>, <vt>, <vn> and <f> statements, faces with any number
+    of vertices in forms "v", "v/vt", "v//vn" and "v/vt/vn" are triangulated as fans. Other statements are ignored
+    """
+    def __init__(self):
+        self.vertices = ArrayBuilder(4, np.float32)
+        self.uvs = ArrayBuilder(2, np.float32)
+        self.normals = ArrayBuilder(3, np.float32)
+        self.indices = ArrayBuilder(3, np.int32)
+        self.uv_indices = ArrayBuilder(3, np.int32)
+        self.normal_indices = ArrayBuilder(3, np.int32)
+
+    def parse_file(self, file_path: str, chunk_size: int = CHUNK_SIZE, hasher=None):
+        """
+        :param file_path: Path to .obj file
+        :param chunk_size: Number of bytes read at once
+        :param hasher: Object from hashlib, updated with content of the file while it is read
+        """
+        with open(file_path, "rb") as file:
+            tail = b""
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                if hasher is not None:
+                    hasher.update(chunk)
+                lines = (tail + chunk).replace(b"\r", b"").replace(b"\t", b" ").split(b"\n")
+                tail = lines.pop()  # Last line may continue in the next chunk
+                self.parse_lines(lines)
+            self.parse_lines([tail])
+
+    def parse_lines(self, lines: list[bytes]):
+        self._parse_statements(self._clean_lines(lines))
+
+    @staticmethod
+    def _clean_lines(lines: list[bytes]) -> list[bytes]:
+        """
+        Remove comments (from # to the end of line) and leading whitespace, so statements start at line beginning
+        """
+        return [line.split(b"#", 1)[0].lstrip() if b"#" in line else line.lstrip() for line in lines]
+
+    def _parse_statements(self, lines: list[bytes]):
+        vertex_lines = [line[2:] for line in lines if line[:2] == b"v "]
+        uv_lines = [line[3:] for line in lines if line[:3] == b"vt "]
+        normal_lines = [line[3:] for line in lines if line[:3] == b"vn "]
+        face_lines = [line[2:] for line in lines if line[:2] == b"f "]
+
+        # Relative (negative) indices of faces refer to the elements defined before the face
+        if face_lines and (vertex_lines or uv_lines or normal_lines) and b"-" in b"".join(face_lines):
+            self._parse_lines_in_order(lines)
+            return
+
+        if vertex_lines:
+            vertices = np.ones((len(vertex_lines), 4), dtype=np.float32)
+            vertices[:, :3] = self._parse_floats(vertex_lines, 3)
+            self.vertices.extend(vertices)
+        if uv_lines:
+            self.uvs.extend(self._parse_floats(uv_lines, 2))
+        if normal_lines:
+            self.normals.extend(self._parse_floats(normal_lines, 3))
+        if face_lines:
+            self._add_faces(face_lines)
+
+    def _parse_lines_in_order(self, lines: list[bytes]):
+        """
+        Parse lines in groups of consecutive statements of the same kind, so relative indices are resolved right
+        """
+        group = []
+        group_is_face = False
+        for line in lines:
+            is_face = line[:2] == b"f "
+            if is_face != group_is_face:
+                self._parse_statements(group)
+                group = []
+                group_is_face = is_face
+            group.append(line)
+        self._parse_statements(group)
+
+    def get_mesh(self) -> Mesh:
+        """
+        Get parsed mesh. Parser should not be used after that
+        :raises ValueError: If faces refer to vertices, texture coordinates or normals the file does not define
+        """
+        self._check_references(self.indices, self.vertices.size, "vertex", allow_absent=False)
+        self._check_references(self.uv_indices, self.uvs.size, "texture coordinate")
+        self._check_references(self.normal_indices, self.normals.size, "normal")
+        uvs = uv_indices = normals = normal_indices = None
+        if self.uvs.size:
+            uvs = self.uvs.get_array()
+            uv_indices = self.uv_indices.get_array()
+        if self.normals.size:
+            normals = self.normals.get_array()
+            normal_indices = self.normal_indices.get_array()
+        return Mesh(self.vertices.get_array(), self.indices.get_array(), uvs, uv_indices, normals, normal_indices)
+
+    @staticmethod
+    def _check_references(references: ArrayBuilder, count: int, name: str, allow_absent: bool = True):
+        if allow_absent and not count:  # References are not used when there is nothing to refer to
+            return
+        used = references.get_rows()
+        if allow_absent:
+            used = used[used != -1]
+        if used.size and (used.min() < 0 or used.max() >= count):
+            raise ValueError(f"Face refers to {name} outside of {count} defined ones")
+
+    @staticmethod
+    def _parse_floats(lines: list[bytes], columns: int) -> np.ndarray:
+        values = np.array(b" ".join(lines).split(), dtype=np.float32)
+        if len(values) == len(lines) * columns:
+            return values.reshape(-1, columns)
+        # Some lines have optional values (w of vertices, colors etc.), only first <columns> are taken
+        return np.array([line.split()[:columns] for line in lines], dtype=np.float32)
+
+    def _add_faces(self, face_lines: list[bytes]):
+        faces = [line.split() for line in face_lines]
+        sizes = np.fromiter(map(len, faces), dtype=np.int64, count=len(faces))
+        tokens = list(chain.from_iterable(faces))
+
+        # Converting every token to (vertex, uv, normal), 0 stands for absent index. Splitting all tokens at once
+        # is only right when every one of them has the same number of slashes
+        slash_counts = set(map(methodcaller("count", b"/"), tokens))
+        components = slash_counts.pop() + 1 if len(slash_counts) == 1 else 0
+        values = ()
+        if components:
+            text = b" ".join(tokens).replace(b"//", b"/0/").replace(b"/", b" ")
+            values = np.array(text.split(), dtype=np.int64)
+        if not components or len(values) != len(tokens) * components:  # Forms of vertices are mixed or empty
+            values = np.array([self._parse_face_token(token) for token in tokens], dtype=np.int64)
+            components = 3
+        values = values.reshape(-1, components)
+        references = np.zeros((len(tokens), 3), dtype=np.int64)
+        references[:, :components] = values
+
+        for column, builder in enumerate((self.vertices, self.uvs, self.normals)):
+            refs = references[:, column]
+            absent = refs == 0
+            refs[refs > 0] -= 1
+            relative = refs < 0
+            refs[relative] += builder.size  # Relative to elements defined so far
+            if (refs[relative] < 0).any():
+                raise ValueError("Face refers to element before the first one")
+            refs[absent] = -1
+
+        # Triangulating faces as fans: (0, i, i + 1)
+        triangle_counts = np.maximum(sizes - 2, 0)
+        face_starts = np.cumsum(sizes) - sizes
+        triangle_face = np.repeat(np.arange(len(faces)), triangle_counts)
+        local = np.arange(len(triangle_face)) - np.repeat(np.cumsum(triangle_counts) - triangle_counts,
+                                                           triangle_counts)
+        first = face_starts[triangle_face]
+        corners = np.stack([first, first + local + 1, first + local + 2], axis=1)
+
+        self.indices.extend(references[corners, 0])
+        self.uv_indices.extend(references[corners, 1])
+        self.normal_indices.extend(references[corners, 2])
+
+    @staticmethod
+    def _parse_face_token(token: bytes) -> list[int]:
+        parts = [int(part) if part else 0 for part in token.split(b"/")]
+        return (parts + [0, 0])[:3]
+
+
+def load_obj(file_path: str, chunk_size: int = CHUNK_SIZE) -> Mesh:
+    """
+    Load triangle mesh from .obj file, reading it in chunks of <chunk_size> bytes
+    :param file_path: Path to .obj file
+    :param chunk_size: Number of bytes read at once
+    :return: Mesh with vertices and triangles, also texture coordinates and normals if the file has them
+    """
+    parser = ObjParser()
+    parser.parse_file(file_path, chunk_size)
+    return parser.get_mesh()
@@ -1,9 +1,18 @@
 from __future__ import annotations  # For cases when we need to specify parameter's ClassType inside ClassType's method
 from typing import Union
-from math_objects import Matrix4x4, Vector3D
+from itertools import count
+from math_objects import Matrix4x4, Vector3D, deg_to_rad
+from math import tan
 from console_drawer import ConsoleDrawer
+from pygame_drawer import PygameDrawer
+from scene import SceneNode
+import pipeline
+import bvh
+import lod
+import textures
+from telemetry import profiler
+import numpy as np
 import pygame
-import copy
 
 
 class Polygon:
@@ -41,27 +50,12 @@ class Polygon:
         return s / 3
 
     def draw(self, surface: pygame.Surface, color: tuple[int, int, int]):
-        p1 = self.points[0]
-        p2 = self.points[1]
-        p3 = self.points[2]
-
-        width = surface.get_width() / 2
-        height = surface.get_height() / 2
-
-        p1.x = p1.x / p1.w * width
-        p2.x = p2.x / p2.w * width
-        p3.x = p3.x / p3.w * width
-
-        p1.y = p1.y / p1.w * width
-        p2.y = p2.y / p2.w * width
-        p3.y = p3.y / p3.w * width
-
-        color = self.get_white_hue_for_light(Vector3D(0, 0, -1))
-
-        pygame.draw.polygon(surface, color,
-                            [Object3D.center_coords(surface, p1.x, p1.y),
-                             Object3D.center_coords(surface, p2.x, p2.y),
-                             Object3D.center_coords(surface, p3.x, p3.y)])
+        # Points keep their clip coordinates, so the polygon can be drawn again
+        half_width = surface.get_width() / 2
+        half_height = surface.get_height() / 2
+        points = [(p.x / p.w * half_width + half_width, p.y / p.w * half_width + half_height) for p in self.points]
+        brightness = self.get_white_hue_for_light(Vector3D(0, 0, -1))[0] / 255
+        pygame.draw.polygon(surface, tuple(int(c * brightness) for c in color), points)
 
     def draw_console(self, console_drawer: ConsoleDrawer):
         p1 = self.points[0]
@@ -81,31 +75,269 @@ class Polygon:
 
         color = ConsoleDrawer.get_char_by_brightness(self.get_white_hue_for_light(Vector3D(0, 0, -1))[0] / 255)
 
-        console_drawer.fill_triangle((p1.x, p1.y),
-                                     (p2.x, p2.y),
-                                     (p3.x, p3.y), color)
+        console_drawer.fill_triangle((p1.x, p1.y, p1.z / p1.w),
+                                     (p2.x, p2.y, p2.z / p2.w),
+                                     (p3.x, p3.y, p3.z / p3.w), color)
+
+
+class Mesh:
+    """
+    Triangle mesh stored as two contiguous arrays: vertex buffer of shape (N, 4) with homogeneous coordinates
+    and index buffer of shape (M, 3) with indices of vertices of every triangle.
+    Optionally has texture coordinates (T, 2) and normals (L, 3) with their own index buffers of shape (M, 3),
+    where -1 means that the corner of the triangle has none
+    """
+    def __init__(self, vertices, indices, uvs=None, uv_indices=None, normals=None, normal_indices=None):
+        vertices = np.asarray(vertices, dtype=np.float32)
+        if vertices.size == 0:
+            vertices = vertices.reshape(0, 4)
+        if vertices.shape[1] == 3:  # Adding w = 1 to points given without it
+            vertices = np.hstack((vertices, np.ones((len(vertices), 1), dtype=np.float32)))
+        self.vertices = np.ascontiguousarray(vertices)
+        self.indices = np.ascontiguousarray(np.asarray(indices, dtype=np.int32).reshape(-1, 3))
+        self.uvs: np.ndarray = uvs
+        self.uv_indices: np.ndarray = uv_indices
+        self.normals: np.ndarray = normals
+        self.normal_indices: np.ndarray = normal_indices
+
+        # Bounding volumes in model space, computed on first request
+        self._bounding_box: Union[tuple[np.ndarray, np.ndarray], None] = None
+        self._bounding_sphere: Union[tuple[np.ndarray, float], None] = None
+        self._bvh: Union[bvh.MeshBVH, None] = None
+        self._lod_meshes: Union[list[Mesh], None] = None
+        self._lod_levels = 0  # Number of levels requested when _lod_meshes were built
+        self._face_normals: Union[np.ndarray, None] = None
+        self._vertex_normals: Union[np.ndarray, None] = None
+        self._corner_uvs: Union[np.ndarray, None] = None
 
+    @staticmethod
+    def from_polygons(polygons: list[Polygon]) -> Mesh:
+        """
+        Build mesh from list of polygons, merging vertices with equal coordinates
+        :param polygons: List of polygons
+        :return: Mesh with shared vertices
+        """
+        vertex_ids = {}
+        vertices = []
+        indices = []
+        for polygon in polygons:
+            face = []
+            for point in polygon.points:
+                key = (point.x, point.y, point.z, point.w)
+                if key not in vertex_ids:
+                    vertex_ids[key] = len(vertices)
+                    vertices.append(key)
+                face.append(vertex_ids[key])
+            indices.append(face)
+        return Mesh(np.array(vertices, dtype=np.float32).reshape(-1, 4), indices)
+
+    def get_vertex_count(self) -> int:
+        return len(self.vertices)
+
+    def get_face_count(self) -> int:
+        return len(self.indices)
+
+    def get_bounding_box(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get axis-aligned bounding box of vertices. It is computed once, so vertices should not be changed after that
+        :return: Minimal and maximal coordinates, arrays of shape (3,)
+        """
+        if self._bounding_box is None:
+            if len(self.vertices) == 0:
+                self._bounding_box = (np.zeros(3), np.zeros(3))
+            else:
+                points = self.vertices[:, :3]
+                self._bounding_box = (points.min(axis=0).astype(np.float64), points.max(axis=0).astype(np.float64))
+        return self._bounding_box
+
+    def get_bounding_sphere(self) -> tuple[np.ndarray, float]:
+        """
+        Get sphere containing all vertices, centered in the center of the bounding box
+        :return: Center, array of shape (3,), and radius
+        """
+        if self._bounding_sphere is None:
+            box_min, box_max = self.get_bounding_box()
+            center = (box_min + box_max) / 2
+            radius = float(np.linalg.norm(self.vertices[:, :3] - center, axis=1).max()) if len(self.vertices) else 0.0
+            self._bounding_sphere = (center, radius)
+        return self._bounding_sphere
+
+    def get_face_normals(self) -> np.ndarray:
+        """
+        Get unit normals of faces in model space, computed once like bounding volumes
+        :return: Array of shape (M, 3)
+        """
+        if self._face_normals is None:
+            self._compute_normals()
+        return self._face_normals
+
+    def get_vertex_normals(self) -> np.ndarray:
+        """
+        Get unit normals of vertices, averaged from normals of faces around them weighted by their areas
+        :return: Array of shape (N, 3)
+        """
+        if self._vertex_normals is None:
+            self._compute_normals()
+        return self._vertex_normals
+
+    def _compute_normals(self):
+        area_normals = pipeline.get_face_normals(self.vertices, self.indices, normalize=False)
+        vertex_normals = pipeline.get_vertex_normals(len(self.vertices), self.indices, area_normals)
+        lengths = np.linalg.norm(area_normals, axis=1)
+        area_normals /= np.where(lengths > 0, lengths, 1)[:, None]
+        self._face_normals = area_normals.astype(np.float32)
+        self._vertex_normals = vertex_normals.astype(np.float32)
+
+    def has_uvs(self) -> bool:
+        return self.uvs is not None and len(self.uvs) > 0
+
+    def get_corner_uvs(self) -> np.ndarray:
+        """
+        Get texture coordinates of vertices of every triangle, computed once like bounding volumes.
+        Corners without texture coordinates get (0, 0)
+        :return: Array of shape (M, 3, 2)
+        """
+        if self._corner_uvs is None:
+            uv_indices = np.asarray(self.uv_indices)
+            self._corner_uvs = np.asarray(self.uvs, dtype=np.float32)[np.maximum(uv_indices, 0)]
+            self._corner_uvs[uv_indices < 0] = 0
+        return self._corner_uvs
 
-class Object3D:
-    def __init__(self, polygons: list[Polygon]):
-        self.polygons = polygons
+    def get_bvh(self) -> bvh.MeshBVH:
+        """
+        Get bounding volume hierarchy over triangles, built on first request
+        """
+        if self._bvh is None:
+            self._bvh = bvh.MeshBVH(self.vertices, self.indices)
+        return self._bvh
 
-        self.x = 0
-        self.y = 0
-        self.z = 0
+    def build_lod_chain(self, levels: int) -> list[Mesh]:
+        """
+        Build simplified meshes (see lod.build_chain). Their triangles keep texture coordinates and normals
+        of the triangles of this mesh they come from
+        :param levels: Maximal number of levels, including this mesh
+        :return: List of simplified meshes, without this mesh
+        """
+        meshes = []
+        for vertices, indices, faces in lod.build_chain(self.vertices, self.indices, levels):
+            uv_indices = None if self.uv_indices is None else self.uv_indices[faces]
+            normal_indices = None if self.normal_indices is None else self.normal_indices[faces]
+            meshes.append(Mesh(vertices, indices, self.uvs, uv_indices, self.normals, normal_indices))
+        return meshes
+
+    def get_lod_meshes(self, levels: int = 4, build_chain=None) -> list[Mesh]:
+        """
+        Get chain of simplified meshes, built once and shared by all objects using this mesh
+        :param levels: Maximal number of levels, including this mesh
+        :param build_chain: Function called with number of levels instead of build_lod_chain, for example one
+        reading levels from cache (see mesh_cache.load_lod_cached)
+        :return: List of meshes from the most detailed one, the first is this mesh
+        """
+        if self._lod_levels < levels:
+            chain = (build_chain or self.build_lod_chain)(levels)
+            self._lod_meshes = [self] + chain
+            self._lod_levels = levels
+        return self._lod_meshes[:levels]
+
+    def get_polygon(self, index: int) -> Polygon:
+        """
+        Get polygon with copies of vertices of triangle <index>
+        :param index: Index of triangle in index buffer
+        :return: Polygon
+        """
+        return Polygon([Vector3D(*(float(c) for c in self.vertices[i])) for i in self.indices[index]])
+
+    def get_polygons(self) -> list[Polygon]:
+        return [self.get_polygon(i) for i in range(len(self.indices))]
+
+
+class Object3D(SceneNode):
+    def __init__(self, mesh: Union[Mesh, list[Polygon]]):
+        super().__init__()
+        if not isinstance(mesh, Mesh):  # List of polygons
+            mesh = Mesh.from_polygons(mesh)
+        self.mesh = mesh
+
+        # Buffers of the transform stage, reused every frame
+        self._matrix_buffer = np.empty((4, 4), dtype=np.float32)
+        self._transformed_vertices = np.empty_like(self.mesh.vertices)
+        self._screen_vertices = np.empty((len(self.mesh.vertices), 3), dtype=np.float32)
+        self._transform_matrix = Matrix4x4()
+        self._transform_key = None  # World matrix version and camera matrix version used for _transform_matrix
+        self._matrix_buffer_key = None  # Same for _matrix_buffer
+        self._world_bounds = None  # World space bounding sphere and box
+        self._world_bounds_version = None  # World matrix version used for _world_bounds
+        self._world_bounds_mesh = None  # Mesh used for _world_bounds, geometry may be replaced
+        self._normal_matrix = None  # Moves normals of the mesh into camera's view space
+        self._normal_key = None  # Same as _transform_key, for _normal_matrix
+
+        # Gouraud shading: brightness is computed for vertices and interpolated inside faces
+        self.smooth_shading = False
+        # Texture or path of image file, got from textures.texture_cache when drawn. Used by PygameDrawer
+        # for meshes with texture coordinates
+        self.texture: Union[textures.Texture, str, None] = None
+
+        # Level of detail, only the full mesh is drawn until enable_lod is called
+        self.lod_meshes: list[Mesh] = [self.mesh]
+        self.lod_level = 0
+        self.lod_bias = 0
+
+        # Position and rotation are stored by SceneNode
         self.vx = 0
         self.vy = 0
         self.vz = 0
 
-        self.x_rot = 0
-        self.y_rot = 0
-        self.z_rot = 0
         self.vx_rot = 0
         self.vy_rot = 0
         self.vz_rot = 0
 
         self.scale = 100
 
+    @property
+    def polygons(self) -> list[Polygon]:
+        """
+        List of polygons built from the mesh. Kept for compatibility, every call creates new Polygon objects
+        with copies of vertices, so changing them does not change the object. To change geometry, assign a new
+        list of polygons or a new mesh
+        """
+        return self.mesh.get_polygons()
+
+    @polygons.setter
+    def polygons(self, polygons: list[Polygon]):
+        self.mesh = Mesh.from_polygons(polygons)
+        self.lod_meshes = [self.mesh]
+        self.lod_level = 0
+
+    def enable_lod(self, levels: int = 4):
+        """
+        Draw simplified versions of the mesh when the object covers a small part of the screen
+        :param levels: Maximal number of levels of detail, including the full mesh
+        """
+        self.lod_meshes = self.mesh.get_lod_meshes(levels)
+
+    def get_render_mesh(self) -> Mesh:
+        """
+        Get mesh of the level of detail chosen by the last call of select_lod
+        """
+        if self.lod_meshes[0] is not self.mesh:  # Mesh was replaced
+            self.lod_meshes = [self.mesh]
+            self.lod_level = 0
+        return self.lod_meshes[self.lod_level]
+
+    def select_lod(self, camera: Camera3D, scale_x: float, scale_y: float) -> int:
+        """
+        Choose level of detail from the size of the object's bounding sphere on the screen
+        :param scale_x: Number of pixels in half of the screen's width
+        :param scale_y: Number of pixels in half of the screen's height
+        :return: Chosen level
+        """
+        if len(self.lod_meshes) > 1:
+            center, radius, _, _ = self.get_world_bounds()
+            pixel_radius = camera.get_projected_radius(center, radius, scale_x, scale_y)
+            self.lod_level = lod.select_level([mesh.get_face_count() for mesh in self.lod_meshes],
+                                              pixel_radius, self.lod_bias)
+        return self.lod_level
+
     def set_pos(self, x, y, z):
         self.x = x
         self.y = y
@@ -129,60 +361,213 @@ class Object3D:
     def set_scale(self, scale):
         self.scale = scale
 
-    def update_rotation(self):
-        self.x_rot += self.vx_rot
-        self.y_rot += self.vy_rot
-        self.z_rot += self.vz_rot
+    def update_rotation(self, dt: float = 1):
+        self.x_rot += self.vx_rot * dt
+        self.y_rot += self.vy_rot * dt
+        self.z_rot += self.vz_rot * dt
 
-    def update_movement(self):
-        self.x += self.vx
-        self.y += self.vy
-        self.z += self.vz
+    def update_movement(self, dt: float = 1):
+        self.x += self.vx * dt
+        self.y += self.vy * dt
+        self.z += self.vz * dt
 
-    def update(self):
-        self.update_rotation()
-        self.update_movement()
+    def update(self, dt: float = 1):
+        """
+        Move and rotate the object by its speeds multiplied by <dt>
+        """
+        self.update_rotation(dt)
+        self.update_movement(dt)
 
     def get_transform_matrix(self, camera: Camera3D) -> Matrix4x4:
-        transform_matrix = Matrix4x4.get_scale(self.scale, self.scale, self.scale)
-        transform_matrix = Matrix4x4.multiply(transform_matrix, Matrix4x4.get_rotate_x(self.x_rot))
-        transform_matrix = Matrix4x4.multiply(transform_matrix, Matrix4x4.get_rotate_y(self.y_rot))
-        transform_matrix = Matrix4x4.multiply(transform_matrix, Matrix4x4.get_rotate_z(self.z_rot))
-        transform_matrix = Matrix4x4.multiply(transform_matrix, Matrix4x4.get_translation(self.x, self.y, self.z))
-        transform_matrix = Matrix4x4.multiply(transform_matrix, camera.get_camera_matrix())
-        return transform_matrix
-
-    def draw(self, surface: pygame.Surface, color: tuple[int, int, int], camera: Camera3D):
         """
-        Draw object on surface <surface> with color <color> according to position and angle of camera <camera>
-        :param surface: pygame surface that we draw on
-        :param color: RGB color of object
-        :param camera: camera object in 3D space
+        Get matrix that moves points of the mesh into camera's clip space.
+        It is recomputed only when the object, one of its ancestors or the camera has changed
         """
-        transform_matrix = self.get_transform_matrix(camera)
-        obj_polygons = copy.deepcopy(self.polygons)  # Creating a copy of list of polygons
+        world_matrix = self.get_world_matrix()
+        camera_matrix = camera.get_camera_matrix()
+        key = (self.world_version, id(camera), camera.matrix_version)
+        if key != self._transform_key:
+            Matrix4x4.multiply(world_matrix, camera_matrix, out=self._transform_matrix)
+            self._transform_key = key
+        return self._transform_matrix
+
+    def get_normal_matrix(self, camera: Camera3D) -> np.ndarray:
+        """
+        Get matrix that moves normals of the mesh into camera's view space (see pipeline.get_normal_matrix).
+        It is recomputed only when the object, one of its ancestors or the camera has changed
+        :return: Array of shape (3, 3)
+        """
+        world_matrix = self.get_world_matrix()
+        view_matrix = camera.get_view_matrix()
+        key = (self.world_version, id(camera), camera.matrix_version)
+        if key != self._normal_key:
+            linear = np.array(world_matrix._values, dtype=np.float64)[:3, :3]
+            linear = linear @ np.array(view_matrix._values, dtype=np.float64)[:3, :3]
+            self._normal_matrix = pipeline.get_normal_matrix(linear).astype(np.float32)
+            self._normal_key = key
+        return self._normal_matrix
+
+    def get_vertex_brightness(self, camera: Camera3D) -> np.ndarray:
+        """
+        Get brightness of every vertex of the render mesh for Gouraud shading, from its cached normals
+        :return: Array of shape (N,) with values in range [0; 1]
+        """
+        return pipeline.shade_normals(self.get_render_mesh().get_vertex_normals(), self.get_normal_matrix(camera))
 
-        for i in range(len(obj_polygons)):  # Applying matrix to every polygon
-            obj_polygons[i].apply_matrix(transform_matrix)
+    def get_texture(self) -> Union[textures.Texture, None]:
+        """
+        Get texture to draw the render mesh with, None if there is no texture or the mesh has no texture coordinates
+        """
+        if self.texture is None or not self.get_render_mesh().has_uvs():
+            return None
+        if isinstance(self.texture, str):
+            return textures.texture_cache.get(self.texture)
+        return self.texture
 
-        obj_polygons = sorted(obj_polygons, key=lambda x: x.get_mean_z(), reverse=True)  # Sorting by z-coordinate
-        for polygon in obj_polygons:  # Drawing polygons
-            if polygon.is_visible(camera):
-                polygon.draw(surface, color)
-        self.update()
+    def get_world_bounds(self) -> tuple[np.ndarray, float, np.ndarray, np.ndarray]:
+        """
+        Get bounding volumes of the mesh moved into world space, recomputed only when the world matrix or the mesh
+        has changed
+        :return: Center and radius of bounding sphere, minimal and maximal coordinates of axis-aligned bounding box
+        """
+        world_matrix = self.get_world_matrix()
+        if self._world_bounds_version != self.world_version or self._world_bounds_mesh is not self.mesh:
+            matrix = np.array(world_matrix._values, dtype=np.float64)
+            center, radius = self.mesh.get_bounding_sphere()
+            world_center = center @ matrix[:3, :3] + matrix[3, :3]
+            world_radius = radius * np.sqrt((matrix[:3, :3] ** 2).sum(axis=1).max())  # Largest scale of axes
+            box_min, box_max = self.mesh.get_bounding_box()
+            corners = np.array([[box_max[0] if i & 1 else box_min[0],
+                                 box_max[1] if i & 2 else box_min[1],
+                                 box_max[2] if i & 4 else box_min[2]] for i in range(8)])
+            corners = corners @ matrix[:3, :3] + matrix[3, :3]
+            self._world_bounds = (world_center, float(world_radius), corners.min(axis=0), corners.max(axis=0))
+            self._world_bounds_version = self.world_version
+            self._world_bounds_mesh = self.mesh
+        return self._world_bounds
+
+    def is_in_frustum(self, camera: Camera3D) -> bool:
+        """
+        Check if bounding sphere and bounding box of the object intersect camera's view frustum
+        """
+        planes = camera.get_frustum_planes()
+        center, radius, box_min, box_max = self.get_world_bounds()
+        return pipeline.sphere_in_frustum(planes, center, radius) and pipeline.box_in_frustum(planes, box_min, box_max)
 
-    def draw_console(self, console_drawer: ConsoleDrawer, camera: Camera3D):
+    def transform_vertices(self, camera: Camera3D) -> np.ndarray:
+        """
+        Transform every vertex of the mesh by the object's transform matrix in one batched operation.
+        Result is written into a buffer owned by the object, so it is only valid until the next call
+        :param camera: camera object in 3D space
+        :return: Array of shape (N, 4) with transformed vertices
+        """
+        vertices = self.get_render_mesh().vertices
+        if self._transformed_vertices.shape != vertices.shape:  # Mesh was replaced
+            self._transformed_vertices = np.empty_like(vertices)
         transform_matrix = self.get_transform_matrix(camera)
-        obj_polygons = copy.deepcopy(self.polygons)  # Creating a copy of list of polygons
+        if self._matrix_buffer_key != self._transform_key:
+            pipeline.matrix_to_array(transform_matrix, out=self._matrix_buffer)
+            self._matrix_buffer_key = self._transform_key
+        return pipeline.transform_vertices(vertices, self._matrix_buffer, out=self._transformed_vertices)
 
-        for i in range(len(obj_polygons)):  # Applying matrix to every polygon
-            obj_polygons[i].apply_matrix(transform_matrix)
+    def project_vertices(self, scale_x: float, scale_y: float, center_x: float, center_y: float) -> np.ndarray:
+        """
+        Map vertices produced by the last call of transform_vertices onto the screen (see pipeline.project_to_screen)
+        :return: Array of shape (N, 3) with screen x, screen y and depth of every vertex
+        """
+        if self._screen_vertices.shape[0] != self._transformed_vertices.shape[0]:
+            self._screen_vertices = np.empty((len(self._transformed_vertices), 3), dtype=np.float32)
+        return pipeline.project_to_screen(self._transformed_vertices, scale_x, scale_y, center_x, center_y,
+                                          out=self._screen_vertices)
 
-        obj_polygons = sorted(obj_polygons, key=lambda x: x.get_mean_z(), reverse=True)  # Sorting by z-coordinate
-        for polygon in obj_polygons:  # Drawing polygons
-            if polygon.is_visible(camera):
-                polygon.draw_console(console_drawer)
-        self.update()
+    def get_visible_faces(self, camera: Camera3D, scale_x: float, scale_y: float,
+                          width: int, height: int, sort: bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Choose level of detail and run transform, projection, culling and shading for its whole mesh
+        :param camera: camera object in 3D space
+        :param scale_x: Number of pixels in half of the screen's width
+        :param scale_y: Number of pixels in half of the screen's height
+        :param width: Width of the screen in pixels
+        :param height: Height of the screen in pixels
+        :param sort: Whether to sort faces by z-coordinate from far to near. Not needed when drawing with depth test
+        :return: Screen vertices, indices of visible faces and brightness of every face. Indices of faces refer
+        to the mesh returned by get_render_mesh
+        """
+        with profiler.stage("transform"):
+            self.select_lod(camera, scale_x, scale_y)
+            mesh = self.get_render_mesh()
+            indices = mesh.indices
+            clip_vertices = self.transform_vertices(camera)
+            screen_vertices = self.project_vertices(scale_x, scale_y, width / 2, height / 2)
+        with profiler.stage("cull"):
+            visible, brightness = pipeline.cull_and_shade(clip_vertices, screen_vertices, indices,
+                                                          width, height, camera.get_projection_scale(),
+                                                          mesh.get_face_normals(), self.get_normal_matrix(camera))
+            faces = np.flatnonzero(visible)
+        profiler.count("triangles_submitted", len(indices))
+        profiler.count("triangles_culled", len(indices) - len(faces))
+        if sort:
+            with profiler.stage("sort"):
+                mean_z = clip_vertices[indices[faces], 2].mean(axis=1)
+                faces = faces[np.argsort(-mean_z, kind="stable")]  # Sorting by z-coordinate
+        return screen_vertices, faces, brightness
+
+    def draw(self, surface: Union[pygame.Surface, PygameDrawer], color: tuple[int, int, int], camera: Camera3D):
+        """
+        Draw object on surface <surface> with color <color> according to position and angle of camera <camera>
+        :param surface: PygameDrawer to rasterize faces into with depth test (or FrameState to record them for it),
+        or pygame surface to draw faces on one by one in back to front order
+        :param color: RGB color of object, faces are darkened by their brightness. Texture is multiplied by it
+        :param camera: camera object in 3D space
+        """
+        if not self.is_in_frustum(camera):
+            profiler.count("objects_culled")
+            return
+        if not isinstance(surface, pygame.Surface):  # PygameDrawer or FrameState recording triangles for it
+            width = surface.width
+            height = surface.height
+            screen_vertices, faces, brightness = self.get_visible_faces(camera, width / 2, width / 2, width, height,
+                                                                        sort=False)
+            indices = self.get_render_mesh().indices[faces]
+            shades = None
+            if self.smooth_shading:
+                colors = np.broadcast_to(np.asarray(color, dtype=np.uint8), (len(faces), 3))
+                shades = self.get_vertex_brightness(camera)
+            else:
+                colors = PygameDrawer.get_colors_by_brightness(brightness[faces], color)
+            texture = self.get_texture()
+            if texture is None:
+                surface.fill_triangles(screen_vertices, indices, colors, shades)
+            else:
+                surface.fill_triangles(screen_vertices, indices, colors, shades, texture,
+                                       self.get_render_mesh().get_corner_uvs()[faces], self._transformed_vertices[:, 3])
+            return
+
+        width = surface.get_width()
+        height = surface.get_height()
+        screen_vertices, faces, brightness = self.get_visible_faces(camera, width / 2, width / 2, width, height)
+        with profiler.stage("raster"):
+            points = screen_vertices[self.get_render_mesh().indices[faces], :2].tolist()
+            colors = PygameDrawer.get_colors_by_brightness(brightness[faces], color).tolist()
+            for triangle, face_color in zip(points, colors):  # Drawing polygons
+                pygame.draw.polygon(surface, face_color, triangle)
+        profiler.count("triangles_rasterized", len(faces))
+
+    def draw_console(self, console_drawer: ConsoleDrawer, camera: Camera3D, sort: bool = False):
+        """
+        Draw object into console drawer <console_drawer> according to position and angle of camera <camera>
+        :param sort: Whether to sort faces by z-coordinate first. Not needed for the image, the drawer has depth test
+        """
+        if not self.is_in_frustum(camera):
+            profiler.count("objects_culled")
+            return
+        width = console_drawer.width
+        height = console_drawer.height
+        screen_vertices, faces, brightness = self.get_visible_faces(camera, width / 2, height / 2, width, height,
+                                                                    sort)
+        colors = ConsoleDrawer.get_codes_by_brightness(brightness[faces])
+        shades = self.get_vertex_brightness(camera) if self.smooth_shading else None
+        console_drawer.fill_triangles(screen_vertices, self.get_render_mesh().indices[faces], colors, shades)
 
     @staticmethod
     def center_coords(surface, x, y):
@@ -190,6 +575,8 @@ class Object3D:
 
 
 class Camera3D:
+    _matrix_versions = count(1)  # Shared by all cameras, so a new camera never repeats versions of a deleted one
+
     def __init__(self, pos: Vector3D, target: Vector3D, up: Vector3D):
         self.pos = pos
         self.target = target
@@ -201,26 +588,99 @@ class Camera3D:
         self.far = -1000
 
         self.camera_matrix = Matrix4x4()
+        self.view_matrix = Matrix4x4()
+        self.matrix_version = 0  # Changed every time camera matrix is rebuilt
+        self._matrix_dirty = False
+        self._frustum_planes = None
+        self._frustum_version = None  # Camera matrix version used for _frustum_planes
         self.update_camera_matrix()
 
     def update_camera_matrix(self):
-        view_matrix = Matrix4x4.get_look_at(self.pos, self.target, self.up)
+        self.view_matrix = Matrix4x4.get_look_at(self.pos, self.target, self.up)
         projection_matrix = Matrix4x4.get_perspective_projection(self.fov, self.aspect_ratio, self.near, self.far)
-        self.camera_matrix = Matrix4x4.multiply(view_matrix, projection_matrix)
+        Matrix4x4.multiply(self.view_matrix, projection_matrix, out=self.camera_matrix)
+        self.matrix_version = next(Camera3D._matrix_versions)
+        self._matrix_dirty = False
+
+    def invalidate_camera_matrix(self):
+        """
+        Mark camera matrix as outdated. It is rebuilt once, when it is requested next time
+        """
+        self._matrix_dirty = True
+
+    def get_frustum_planes(self) -> np.ndarray:
+        """
+        Get planes of the view frustum in world space (see pipeline.get_frustum_planes)
+        """
+        camera_matrix = self.get_camera_matrix()
+        if self._frustum_version != self.matrix_version:
+            self._frustum_planes = pipeline.get_frustum_planes(camera_matrix._values, self.near, self.far)
+            self._frustum_version = self.matrix_version
+        return self._frustum_planes
+
+    def get_projection_scale(self) -> tuple[float, float]:
+        """
+        Get scales of x and y coordinates applied by the perspective projection
+        """
+        sy = 1 / tan(deg_to_rad(self.fov) / 2)
+        return sy / self.aspect_ratio, sy
+
+    def get_ray(self, screen_x: float, screen_y: float, scale_x: float, scale_y: float,
+                center_x: float, center_y: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get ray in world space going from camera through a point of the screen. Screen mapping is the same as in
+        pipeline.project_to_screen
+        :return: Origin and direction of the ray, arrays of shape (3,)
+        """
+        camera_matrix = np.array(self.get_camera_matrix()._values, dtype=np.float64)
+        origin = np.array([self.pos.x, self.pos.y, self.pos.z], dtype=np.float64)
+        forward = self.get_direction_vector()
+        # Clip coordinates of a point one unit in front of the camera give z and w of that depth
+        clip = np.array([origin[0] + forward.x, origin[1] + forward.y, origin[2] + forward.z, 1]) @ camera_matrix
+        clip[0] = (screen_x - center_x) / scale_x * clip[3]
+        clip[1] = (screen_y - center_y) / scale_y * clip[3]
+        point = clip @ np.linalg.inv(camera_matrix)
+        return origin, point[:3] / point[3] - origin
+
+    def get_projected_radius(self, center: np.ndarray, radius: float, scale_x: float, scale_y: float) -> float:
+        """
+        Get approximate radius in pixels of a sphere drawn on the screen, along the axis with larger pixel scale
+        :param center: Center of the sphere in world space
+        :param radius: Radius of the sphere
+        :param scale_x: Number of pixels in half of the screen's width
+        :param scale_y: Number of pixels in half of the screen's height
+        """
+        forward = self.get_direction_vector()
+        depth = ((center[0] - self.pos.x) * forward.x + (center[1] - self.pos.y) * forward.y +
+                 (center[2] - self.pos.z) * forward.z)
+        if depth <= radius:  # Camera is inside or too close to the sphere
+            return float("inf")
+        projection_x, projection_y = self.get_projection_scale()
+        return radius / depth * max(projection_x * scale_x, projection_y * scale_y)
 
     def get_camera_matrix(self):
+        if self._matrix_dirty:
+            self.update_camera_matrix()
         return self.camera_matrix
 
+    def get_view_matrix(self) -> Matrix4x4:
+        """
+        Get matrix that moves points into camera's view space, without projection
+        """
+        if self._matrix_dirty:
+            self.update_camera_matrix()
+        return self.view_matrix
+
     def move_to(self, pos: Vector3D):
         direction_vector = self.get_direction_vector()
         self.pos = pos
         self.target = self.pos + direction_vector
-        self.update_camera_matrix()
+        self.invalidate_camera_matrix()
 
     def move_by(self, d_pos: Vector3D):
         self.pos += d_pos
         self.target += d_pos
-        self.update_camera_matrix()
+        self.invalidate_camera_matrix()
 
     # WIP
     # def turn_left(self, scale: Union[int, float]):
@@ -237,15 +697,15 @@ class Camera3D:
 
     def set_up(self, up: Vector3D):
         self.up = up
-        self.update_camera_matrix()
+        self.invalidate_camera_matrix()
 
     def set_fov(self, fov: float):
         self.fov = fov
-        self.update_camera_matrix()
+        self.invalidate_camera_matrix()
 
     def set_aspect_ratio(self, aspect_ratio: float):
         self.aspect_ratio = aspect_ratio
-        self.update_camera_matrix()
+        self.invalidate_camera_matrix()
 
 
 def main():
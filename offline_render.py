@@ -0,0 +1,270 @@
+"""
+Offline rendering of frame sequences. Frames are rendered in worker processes and written in order as they
+finish, while only a bounded number of them is kept in memory. Turntable preview of a model:
+
+    python offline_render.py untitled.obj --frames 120 --size 320x240 --format png --output preview/frame_{:05d}.png
+    python offline_render.py untitled.obj --mode ascii --size 80x24 --output preview.txt
+"""
+import argparse
+import os
+import struct
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from math import sin, cos, pi
+import numpy as np
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+from objects import Vector3D, Object3D, Camera3D
+from console_drawer import ConsoleDrawer
+from pygame_drawer import PygameDrawer
+import models
+
+MODES = ("rgb", "ascii")
+FORMATS = ("raw", "ppm", "png")
+PENDING_PER_WORKER = 2  # Frames rendered or waiting to be written at once, for every worker
+PNG_COMPRESSION = 6
+
+_worker_state: dict = {}  # Scene of a worker process, set by _init_worker
+
+
+class Turntable:
+    """
+    Camera path going around a point on a horizontal circle, one full turn in <frame_count> frames
+    """
+    def __init__(self, center=(0, 0, 0), radius: float = 3, height: float = 0, frame_count: int = 360,
+                 fov: float = 60):
+        self.center = center
+        self.radius = radius
+        self.height = height
+        self.frame_count = frame_count
+        self.fov = fov
+
+    def __call__(self, frame: int) -> Camera3D:
+        angle = 2 * pi * frame / self.frame_count
+        x, y, z = self.center
+        camera = Camera3D(Vector3D(x + self.radius * sin(angle), y + self.height, z + self.radius * cos(angle)),
+                          Vector3D(x, y, z), Vector3D(0, 1, 0))
+        camera.set_fov(self.fov)
+        return camera
+
+
+def render_frame(objects: list[Object3D], camera: Camera3D, width: int, height: int, mode: str = "rgb",
+                 color: tuple[int, int, int] = (255, 255, 255)) -> np.ndarray:
+    """
+    Render one frame with the same drawers as the interactive programs use
+    :param mode: "rgb" for image like graphics_3d draws, "ascii" for characters like console_graphics_3d prints
+    :return: Array of shape (H, W, 3) with RGB of pixels or (H, W) with ASCII codes of characters
+    """
+    if mode == "rgb":
+        drawer = PygameDrawer(width, height)
+        for obj in objects:
+            obj.draw(drawer, color, camera)
+        return drawer.color
+    if mode == "ascii":
+        camera.set_aspect_ratio(width / height)
+        drawer = ConsoleDrawer()
+        drawer.set_size(width, height)
+        for obj in objects:
+            obj.draw_console(drawer, camera)
+        return drawer.surface
+    raise ValueError(f"Unknown mode {mode}, expected one of {MODES}")
+
+
+def encode_frame(image: np.ndarray, file_format: str) -> bytes:
+    """
+    :param image: Frame from render_frame
+    :param file_format: "raw" for bytes of pixels (lines of characters ending with new line for ASCII frames),
+    "ppm" or "png" for image files
+    """
+    if file_format == "raw":
+        if image.ndim == 2:  # Characters
+            lines = np.full((image.shape[0], image.shape[1] + 1), ord("\n"), dtype=np.uint8)
+            lines[:, :-1] = image
+            return lines.tobytes()
+        return image.tobytes()
+    if image.ndim != 3:
+        raise ValueError(f"{file_format} files can only be written from RGB frames")
+    height, width = image.shape[:2]
+    if file_format == "ppm":
+        return f"P6\n{width} {height}\n255\n".encode("ascii") + image.tobytes()
+    if file_format == "png":
+        return encode_png(image)
+    raise ValueError(f"Unknown format {file_format}, expected one of {FORMATS}")
+
+
+def encode_png(image: np.ndarray, compression: int = PNG_COMPRESSION) -> bytes:
+    """
+    Encode RGB image of shape (H, W, 3) as PNG file without filtering of lines
+    """
+    height, width = image.shape[:2]
+    lines = np.zeros((height, 1 + width * 3), dtype=np.uint8)  # Every line starts with filter type 0
+    lines[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)  # 8 bits per channel, RGB
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) +
+            chunk(b"IDAT", zlib.compress(lines.tobytes(), compression)) + chunk(b"IEND", b""))
+
+
+class StreamWriter:
+    """
+    Writes all frames one after another into one file or binary stream
+    """
+    def __init__(self, output):
+        """
+        :param output: Path of the file or binary stream
+        """
+        self._own_file = isinstance(output, str)
+        self.stream = open(output, "wb") if self._own_file else output
+
+    def write(self, frame: int, data: bytes):
+        self.stream.write(data)
+
+    def close(self):
+        if self._own_file:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class SequenceWriter:
+    """
+    Writes every frame into its own file
+    """
+    def __init__(self, path_pattern: str):
+        """
+        :param path_pattern: Path with a field for the number of the frame, like "frames/{:05d}.png"
+        """
+        self.path_pattern = path_pattern
+        directory = os.path.dirname(path_pattern)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame: int, data: bytes):
+        with open(self.path_pattern.format(frame), "wb") as file:
+            file.write(data)
+
+    def close(self):
+        pass
+
+
+def _init_worker(objects: list[Object3D], camera_path, width: int, height: int, mode: str, file_format: str,
+                 color: tuple[int, int, int]):
+    """
+    Receive the scene once per worker process, tasks only carry numbers of frames
+    """
+    _worker_state.update(objects=objects, camera_path=camera_path, width=width, height=height, mode=mode,
+                         file_format=file_format, color=color)
+
+
+def _render_task(frame: int) -> bytes:
+    state = _worker_state
+    camera = state["camera_path"](frame)
+    image = render_frame(state["objects"], camera, state["width"], state["height"], state["mode"], state["color"])
+    return encode_frame(image, state["file_format"])
+
+
+def render(objects: list[Object3D], camera_path, frames, width: int, height: int, writer, mode: str = "rgb",
+           file_format: str = "raw", color: tuple[int, int, int] = (255, 255, 255), workers: int = None,
+           max_pending: int = None) -> int:
+    """
+    Render frames in worker processes and give them to <writer> in order of <frames>.
+    Frames are encoded by the workers too. At most <max_pending> frames are rendered or wait for earlier
+    frames at once, so memory does not depend on the number of frames
+    :param objects: Objects of the scene, sent to every worker once. They must not be changed by camera_path
+    :param camera_path: Picklable function returning Camera3D for the number of a frame, like Turntable
+    :param frames: Numbers of frames to render, like range(360)
+    :param writer: Object with write(frame, data) and close(), like StreamWriter or SequenceWriter.
+    It is not closed here
+    :param mode: "rgb" or "ascii" (see render_frame)
+    :param file_format: "raw", "ppm" or "png" (see encode_frame)
+    :param workers: Number of worker processes, number of CPUs if not given. With 1, frames are rendered
+    in the calling process
+    :param max_pending: Limit of frames kept in memory, PENDING_PER_WORKER per worker if not given
+    :return: Number of written frames
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}, expected one of {MODES}")
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format {file_format}, expected one of {FORMATS}")
+    if mode == "ascii" and file_format != "raw":
+        raise ValueError(f"{file_format} files can only be written from RGB frames")
+    workers = workers or os.cpu_count() or 1
+    arguments = (objects, camera_path, width, height, mode, file_format, color)
+    written = 0
+    if workers == 1:
+        _init_worker(*arguments)
+        try:
+            for frame in frames:
+                writer.write(frame, _render_task(frame))
+                written += 1
+        finally:
+            _worker_state.clear()
+        return written
+
+    max_pending = max(max_pending or PENDING_PER_WORKER * workers, 1)
+    frames = iter(frames)
+    pending = deque()  # (frame, future) in order of frames
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=arguments) as pool:
+        try:
+            for frame in frames:
+                pending.append((frame, pool.submit(_render_task, frame)))
+                if len(pending) >= max_pending:
+                    break
+            while pending:
+                frame, future = pending.popleft()
+                data = future.result()  # Later frames keep rendering meanwhile
+                next_frame = next(frames, None)
+                if next_frame is not None:
+                    pending.append((next_frame, pool.submit(_render_task, next_frame)))
+                writer.write(frame, data)
+                written += 1
+        finally:
+            for _, future in pending:
+                future.cancel()
+    return written
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help=".obj file")
+    parser.add_argument("--frames", type=int, default=360, help="number of frames of one turn")
+    parser.add_argument("--size", default="320x240", help="like 320x240")
+    parser.add_argument("--mode", choices=MODES, default="rgb")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="taken from the extension of output")
+    parser.add_argument("--output", help="file for raw frames or pattern like out/{:05d}.png, stdout if not given")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--smooth", action="store_true", help="Gouraud shading")
+    parser.add_argument("--texture", help="image mapped onto the model by its texture coordinates")
+    args = parser.parse_args(argv)
+
+    width, height = (int(value) for value in args.size.split("x"))
+    file_format = args.format
+    if file_format is None:
+        extension = os.path.splitext(args.output or "")[1].lstrip(".").lower()
+        file_format = extension if extension in FORMATS else "raw"
+
+    obj = models.FileObject(args.model, texture_path=args.texture)
+    center, radius = obj.mesh.get_bounding_sphere()
+    obj.set_scale(1 / max(radius, 1e-9))  # Model is moved to the origin and fits into the unit sphere
+    obj.set_pos(*(-center / max(radius, 1e-9)))
+    obj.smooth_shading = args.smooth
+    obj.enable_lod()
+
+    if file_format == "raw":
+        writer = StreamWriter(args.output or sys.stdout.buffer)
+    else:
+        writer = SequenceWriter(args.output or f"frame_{{:05d}}.{file_format}")
+    try:
+        render([obj], Turntable(radius=3, frame_count=args.frames), range(args.frames), width, height, writer,
+               args.mode, file_format, workers=args.workers)
+    finally:
+        writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import numpy as np
+from math_objects import Matrix4x4
+
+
+def matrix_to_array(matrix: Matrix4x4, out: np.ndarray = None) -> np.ndarray:
+    """
+    Copy values of <matrix> into a (4, 4) float32 array
+    :param matrix: Matrix to copy
+    :param out: Array to write into. New array is created if not given
+    :return: Array with matrix values
+    """
+    if out is None:
+        out = np.empty((4, 4), dtype=np.float32)
+    out[:] = matrix._values
+    return out
+
+
+def transform_vertices(vertices: np.ndarray, matrix: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """
+    Multiply every vertex (row of <vertices>) by <matrix> in one operation
+    :param vertices: Array of shape (N, 4) with homogeneous coordinates of vertices
+    :param matrix: Array of shape (4, 4)
+    :param out: Array of shape (N, 4) to write result into. New array is created if not given
+    :return: Array of shape (N, 4) with transformed vertices
+    """
+    return np.matmul(vertices, matrix, out=out)
+
+
+def compose_transforms(positions: np.ndarray, rotations: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    Build many transform matrices at once, each equal to scale @ rotate_x @ rotate_y @ rotate_z @ translation
+    like the local matrix of a scene node
+    :param positions: Array of shape (K, 3)
+    :param rotations: Array of shape (K, 3) with angles around x, y and z axes in degrees
+    :param scales: Array of shape (K,) with uniform scales
+    :return: Array of shape (K, 4, 4)
+    """
+    angles = np.radians(rotations)
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+    count = len(positions)
+    rotate_x = np.zeros((count, 3, 3))
+    rotate_x[:, 0, 0] = 1
+    rotate_x[:, 1, 1] = rotate_x[:, 2, 2] = cos[:, 0]
+    rotate_x[:, 1, 2] = sin[:, 0]
+    rotate_x[:, 2, 1] = -sin[:, 0]
+    rotate_y = np.zeros((count, 3, 3))
+    rotate_y[:, 1, 1] = 1
+    rotate_y[:, 0, 0] = rotate_y[:, 2, 2] = cos[:, 1]
+    rotate_y[:, 0, 2] = -sin[:, 1]
+    rotate_y[:, 2, 0] = sin[:, 1]
+    rotate_z = np.zeros((count, 3, 3))
+    rotate_z[:, 2, 2] = 1
+    rotate_z[:, 0, 0] = rotate_z[:, 1, 1] = cos[:, 2]
+    rotate_z[:, 0, 1] = sin[:, 2]
+    rotate_z[:, 1, 0] = -sin[:, 2]
+
+    matrices = np.zeros((count, 4, 4))
+    matrices[:, :3, :3] = rotate_x @ rotate_y @ rotate_z * np.asarray(scales, dtype=np.float64)[:, None, None]
+    matrices[:, 3, :3] = positions
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+def project_to_screen(clip_vertices: np.ndarray, scale_x: float, scale_y: float, center_x: float, center_y: float,
+                      out: np.ndarray = None) -> np.ndarray:
+    """
+    Apply perspective division to transformed vertices and map them onto the screen:
+    x = x / w * <scale_x> + <center_x>, y = y / w * <scale_y> + <center_y>, depth = z / w
+    :param clip_vertices: Array of shape (N, 4) returned by the transform stage
+    :param scale_x: Number of pixels in half of the screen's width
+    :param scale_y: Number of pixels in half of the screen's height
+    :param center_x: X coordinate of the screen's center
+    :param center_y: Y coordinate of the screen's center
+    :param out: Array of shape (N, 3) to write result into. New array is created if not given
+    :return: Array of shape (N, 3) with screen x, screen y and depth of every vertex
+    """
+    if out is None:
+        out = np.empty((len(clip_vertices), 3), dtype=np.float32)
+    w = clip_vertices[:, 3]
+    with np.errstate(divide="ignore", invalid="ignore"):  # Vertices with w = 0 are culled later
+        np.divide(clip_vertices[:, :3], w[:, None], out=out)
+    out[:, 0] *= scale_x
+    out[:, 0] += center_x
+    out[:, 1] *= scale_y
+    out[:, 1] += center_y
+    return out
+
+
+def get_face_normals(vertices: np.ndarray, indices: np.ndarray, normalize: bool = True) -> np.ndarray:
+    """
+    :param vertices: Array of shape (N, 3) or (N, 4)
+    :param indices: Index buffer of shape (M, 3)
+    :param normalize: If False, length of every normal is twice the area of its face
+    :return: Array of shape (M, 3) with normals of faces, zero for degenerate faces
+    """
+    points = vertices[:, :3].astype(np.float64)[indices]
+    normals = np.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+    if normalize:
+        lengths = np.linalg.norm(normals, axis=1)
+        normals /= np.where(lengths > 0, lengths, 1)[:, None]
+    return normals
+
+
+def get_vertex_normals(vertex_count: int, indices: np.ndarray, area_normals: np.ndarray) -> np.ndarray:
+    """
+    Average normals of faces around every vertex, weighted by their areas
+    :param vertex_count: Number of vertices
+    :param indices: Index buffer of shape (M, 3)
+    :param area_normals: Normals of faces from get_face_normals with normalize=False
+    :return: Array of shape (N, 3) with unit normals, zero for vertices of no face
+    """
+    normals = np.zeros((vertex_count, 3))
+    for corner in range(3):
+        np.add.at(normals, indices[:, corner], area_normals)
+    lengths = np.linalg.norm(normals, axis=1)
+    normals /= np.where(lengths > 0, lengths, 1)[:, None]
+    return normals
+
+
+def get_normal_matrix(matrix: np.ndarray) -> np.ndarray:
+    """
+    Get matrix that moves normals like <matrix> moves points: inverse transpose of its linear part.
+    Normals are rows multiplied by it like points
+    :param matrix: Array of shape (4, 4) or (3, 3), or (K, 4, 4) or (K, 3, 3) for K matrices at once
+    :return: Array of shape (3, 3) or (K, 3, 3), zero for matrices that can not be inverted
+    """
+    linear = np.asarray(matrix, dtype=np.float64)[..., :3, :3]
+    try:
+        return np.swapaxes(np.linalg.inv(linear), -1, -2)
+    except np.linalg.LinAlgError:  # Object is scaled to zero
+        if linear.ndim == 2:
+            return np.zeros((3, 3))
+        return np.stack([get_normal_matrix(single) for single in linear]).reshape(-1, 3, 3)
+
+
+def shade_normals(normals: np.ndarray, normal_matrix: np.ndarray) -> np.ndarray:
+    """
+    Get brightness of surfaces with given normals under light pointing along camera's direction
+    :param normals: Array of shape (N, 3) in model space
+    :param normal_matrix: Matrix moving normals from model space into camera's view space, or array of shape
+    (N, 3, 3) with a matrix for every normal
+    :return: Array of shape (N,) with values in range [0; 1]
+    """
+    if normal_matrix.ndim == 3:
+        view_normals = np.matmul(normals[:, None], normal_matrix)[:, 0]
+    else:
+        view_normals = normals @ normal_matrix
+    lengths = np.linalg.norm(view_normals, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nan_to_num(np.abs(view_normals[:, 2]) / lengths).astype(np.float32)
+
+
+def cull_and_shade(clip_vertices: np.ndarray, screen_vertices: np.ndarray, indices: np.ndarray,
+                   width: int, height: int, projection_scale: tuple[float, float],
+                   face_normals: np.ndarray = None, normal_matrix: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find faces that should be rasterized and their brightness under light pointing along camera's direction.
+    Face is dropped if any of its vertices is behind the camera, if it is turned away from the camera
+    or degenerate, or if it does not cover the center of any pixel of <width>x<height> screen.
+    Pixel (i, j) has its center in point (i, j)
+    :param clip_vertices: Array of shape (N, 4) returned by the transform stage
+    :param screen_vertices: Array of shape (N, 3) returned by project_to_screen
+    :param indices: Index buffer of shape (M, 3)
+    :param width: Width of the screen in pixels
+    :param height: Height of the screen in pixels
+    :param projection_scale: Scales of x and y in camera's projection matrix, used to restore view space normals
+    :param face_normals: Array of shape (M, 3) with normals of faces in model space, computed once for the mesh.
+    If given with <normal_matrix> (see get_normal_matrix), brightness is found from them instead of from vertices.
+    For instances of a mesh, <normal_matrix> has shape (K, 3, 3) and faces of instance i are faces
+    i * M ... (i + 1) * M - 1 of <indices>, where M is the number of face normals
+    :return: Boolean visibility mask of shape (M,) and brightness in range [0; 1] of shape (M,)
+    """
+    faces = screen_vertices[indices]  # (M, 3, 3)
+    xs = faces[:, :, 0]
+    ys = faces[:, :, 1]
+    with np.errstate(invalid="ignore"):  # Vertices with w = 0 have infinite coordinates
+        # Doubled signed area, negative for faces turned to the camera
+        area = (xs[:, 1] - xs[:, 0]) * (ys[:, 2] - ys[:, 0]) - (ys[:, 1] - ys[:, 0]) * (xs[:, 2] - xs[:, 0])
+        visible = (clip_vertices[indices, 3] < 0).all(axis=1)  # w < 0 for points in front of the camera
+        visible &= area < 0
+        x_min = np.maximum(np.ceil(xs.min(axis=1)), 0)
+        x_max = np.minimum(np.floor(xs.max(axis=1)), width - 1)
+        y_min = np.maximum(np.ceil(ys.min(axis=1)), 0)
+        y_max = np.minimum(np.floor(ys.max(axis=1)), height - 1)
+        visible &= (x_min <= x_max) & (y_min <= y_max)
+
+    brightness = np.zeros(len(indices), dtype=np.float32)
+    if face_normals is not None and normal_matrix is not None:
+        if normal_matrix.ndim == 3:
+            instance, face = np.divmod(np.flatnonzero(visible), len(face_normals))
+            brightness[visible] = shade_normals(face_normals[face], normal_matrix[instance])
+        else:
+            brightness[visible] = shade_normals(face_normals[visible], normal_matrix)
+        return visible, brightness
+    points = clip_vertices[indices[visible]]
+    points[:, :, 0] /= projection_scale[0]  # View space coordinates are (x / sx, y / sy, -w)
+    points[:, :, 1] /= projection_scale[1]
+    points[:, :, 2] = -points[:, :, 3]
+    points = points[:, :, :3]
+    normals = np.cross(points[:, 0] - points[:, 1], points[:, 1] - points[:, 2])
+    lengths = np.linalg.norm(normals, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        brightness[visible] = np.nan_to_num(np.abs(normals[:, 2]) / lengths)
+    return visible, brightness
+
+
+def get_frustum_planes(camera_matrix: np.ndarray, near: float, far: float) -> np.ndarray:
+    """
+    Extract planes of the view frustum from camera's view-projection matrix. Point p is inside the frustum
+    if dot(plane[:3], p) + plane[3] >= 0 for every plane
+    :param camera_matrix: Array of shape (4, 4), points are multiplied by it as rows
+    :param near: Distance from camera to the near plane
+    :param far: Distance from camera to the far plane
+    :return: Array of shape (6, 4) with normalized planes: left, right, bottom, top, near, far
+    """
+    columns = np.asarray(camera_matrix, dtype=np.float64).T
+    x, y, w = columns[0], columns[1], columns[3]
+    # Points in front of the camera have w = -distance, and they are visible if |x| <= -w and |y| <= -w
+    planes = np.array([x - w, -x - w, y - w, -y - w, -w, w])
+    planes[4, 3] -= abs(near)
+    planes[5, 3] += abs(far)
+    return planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
+def sphere_in_frustum(planes: np.ndarray, center: np.ndarray, radius: float) -> bool:
+    """
+    Check if sphere intersects the frustum. May return True for some spheres lying outside near its corners
+    """
+    return bool(np.all(planes[:, :3] @ center + planes[:, 3] >= -radius))
+
+
+def spheres_in_frustum(planes: np.ndarray, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+    """
+    Same as sphere_in_frustum for many spheres at once
+    :param centers: Array of shape (K, 3)
+    :param radii: Array of shape (K,)
+    :return: Boolean mask of shape (K,)
+    """
+    return np.all(centers @ planes[:, :3].T + planes[:, 3] >= -np.asarray(radii)[:, None], axis=1)
+
+
+def box_in_frustum(planes: np.ndarray, box_min: np.ndarray, box_max: np.ndarray) -> bool:
+    """
+    Check if axis-aligned box intersects the frustum: for every plane, the corner of the box farthest
+    along plane's normal must be inside. May return True for some boxes lying outside near frustum's corners
+    """
+    farthest = np.where(planes[:, :3] >= 0, box_max, box_min)
+    return bool(np.all(np.einsum("ij,ij->i", planes[:, :3], farthest) + planes[:, 3] >= 0))
@@ -0,0 +1,110 @@
+from math import inf
+import numpy as np
+import pygame
+import rasterizer
+from telemetry import profiler
+from tiled_rasterizer import TiledRasterizer, TILE_SIZE
+
+BLACK = (0, 0, 0)
+
+
+class PygameDrawer:
+    """
+    Frame buffer for pygame windows. Triangles are filled into RGB and depth arrays by the same rasterizer
+    as ConsoleDrawer uses, and the finished image is copied to a pygame surface with one blit
+    """
+    def __init__(self, width: int = 0, height: int = 0, background: tuple[int, int, int] = BLACK):
+        self.color: np.ndarray = None  # Array of shape (H, W, 3) with RGB of pixels
+        self.depth: np.ndarray = None  # Depth of the nearest drawn point
+        self.width: int = 0
+        self.height: int = 0
+        self.background = background
+        self.tiled_rasterizer: TiledRasterizer = None  # Set by enable_tiled_rendering
+        self._scale_surface: pygame.Surface = None  # Image copied before scaling, see present
+        self.set_size(width, height)
+
+    def enable_tiled_rendering(self, workers: int = None, tile_size: int = TILE_SIZE):
+        """
+        Fill triangles in worker processes (see ConsoleDrawer.enable_tiled_rendering)
+        """
+        self.disable_tiled_rendering()
+        self.tiled_rasterizer = TiledRasterizer(self.width, self.height, channels=3, workers=workers,
+                                                tile_size=tile_size)
+        self.set_size(self.width, self.height)
+
+    def disable_tiled_rendering(self):
+        if self.tiled_rasterizer is not None:
+            self.color = self.depth = None
+            self.tiled_rasterizer.close()
+            self.tiled_rasterizer = None
+            self.set_size(self.width, self.height)
+
+    def clear(self):
+        self.color[:] = self.background
+        self.depth.fill(inf)
+
+    def set_size(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        if self.tiled_rasterizer is None:
+            self.color = np.empty((height, width, 3), dtype=np.uint8)
+            self.depth = np.empty((height, width), dtype=np.float32)
+        else:
+            self.color = self.depth = None  # Shared memory can not be freed while arrays use it
+            self.tiled_rasterizer.set_size(width, height)
+            self.color = self.tiled_rasterizer.color_buffer
+            self.depth = self.tiled_rasterizer.depth_buffer
+        self.clear()
+
+    def fill_triangles(self, screen_vertices: np.ndarray, indices: np.ndarray, colors: np.ndarray,
+                       shades: np.ndarray = None, texture=None, uvs: np.ndarray = None,
+                       clip_w: np.ndarray = None) -> int:
+        """
+        Fill many triangles at once with depth test (see rasterizer.fill_triangles).
+        Textured triangles are filled in the calling process even with tiled rendering
+        :param screen_vertices: Array of shape (N, 3) with screen x, screen y and depth of vertices
+        :param indices: Array of shape (K, 3) with indices of vertices of triangles to fill
+        :param colors: Array of shape (K, 3) with RGB color of every triangle
+        :param shades: Brightness of every vertex for Gouraud shading, colors are multiplied by brightness
+        interpolated inside triangles. Triangles with NaN brightness use their colors as is
+        :param texture: Texture multiplied by colors of triangles, see textures.Texture
+        :param uvs: Array of shape (K, 3, 2) with texture coordinates of vertices of every triangle
+        :param clip_w: Array of shape (N,) with clip w of vertices, for perspective correct texture coordinates
+        :return: Number of pixels written
+        """
+        with profiler.stage("raster"):
+            if texture is not None:  # Buffers of tiled rendering are shared memory, workers are not needed
+                written = rasterizer.fill_triangles(self.depth, self.color, screen_vertices, indices, colors,
+                                                    shades=shades, texture=texture, uvs=uvs, clip_w=clip_w)
+            elif self.tiled_rasterizer is not None:
+                written = self.tiled_rasterizer.fill_triangles(screen_vertices, indices, colors, shades)
+            else:
+                written = rasterizer.fill_triangles(self.depth, self.color, screen_vertices, indices, colors,
+                                                    shades=shades)
+        profiler.count("triangles_rasterized", len(indices))
+        profiler.count("cells_written", written)
+        return written
+
+    def present(self, surface: pygame.Surface):
+        """
+        Copy the image to <surface>, scaling it to the size of the surface if it differs (dynamic resolution)
+        """
+        with profiler.stage("present"):
+            # Surface arrays are indexed by x first, transposing only changes strides of the view
+            if surface.get_size() == (self.width, self.height):
+                pygame.surfarray.blit_array(surface, self.color.transpose(1, 0, 2))
+                return
+            if (self._scale_surface is None or self._scale_surface.get_size() != (self.width, self.height) or
+                    self._scale_surface.get_bitsize() != surface.get_bitsize()):
+                self._scale_surface = pygame.Surface((self.width, self.height), 0, surface)  # Format of <surface>
+            pygame.surfarray.blit_array(self._scale_surface, self.color.transpose(1, 0, 2))
+            pygame.transform.scale(self._scale_surface, surface.get_size(), surface)
+
+    @staticmethod
+    def get_colors_by_brightness(brightness: np.ndarray, color: tuple[int, int, int]) -> np.ndarray:
+        """
+        :param brightness: Array of shape (K,) with values in range [0; 1]
+        :return: Array of shape (K, 3) with <color> darkened by brightness
+        """
+        brightness = np.asarray(brightness, dtype=np.float32)
+        return (brightness[:, None] * np.asarray(color, dtype=np.float32)).astype(np.uint8)
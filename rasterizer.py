@@ -0,0 +1,172 @@
+import numpy as np
+
+MAX_FRAGMENTS = 1 << 18  # Number of candidate pixels processed at once, limits memory used by a call
+
+
+def fill_triangles(depth_buffer: np.ndarray, color_buffer: np.ndarray, screen_vertices: np.ndarray,
+                   indices: np.ndarray, colors: np.ndarray, max_fragments: int = MAX_FRAGMENTS,
+                   shades: np.ndarray = None, palette: np.ndarray = None, texture=None, uvs: np.ndarray = None,
+                   clip_w: np.ndarray = None) -> int:
+    """
+    Rasterize many triangles at once with depth test. Every pixel of a triangle's bounding box (clipped by the
+    buffers' size) is tested with edge functions, pixel (i, j) has its center in point (i, j). Among the pixels
+    inside the triangle, those nearer than the value in <depth_buffer> get triangle's color
+    :param depth_buffer: Array of shape (H, W), smaller values are nearer
+    :param color_buffer: Array of shape (H, W) or (H, W, C)
+    :param screen_vertices: Array of shape (N, 3) with screen x, screen y and depth of vertices
+    :param indices: Array of shape (K, 3) with indices of vertices of triangles to fill
+    :param colors: Array of shape (K,) or (K, C) with color of every triangle
+    :param max_fragments: Maximum number of candidate pixels tested at once
+    :param shades: Array of shape (N,) with brightness in range [0; 1] of every vertex, for Gouraud shading.
+    Brightness is interpolated like depth, and pixel gets triangle's color multiplied by it. Triangles having
+    NaN at a vertex are filled with their color as is
+    :param palette: Array of shape (P,) or (P, C). If given with <shades>, pixel gets color number
+    brightness * P of the palette instead
+    :param texture: Texture (see textures.Texture) for triangles with texture coordinates <uvs>. Pixel gets texel
+    multiplied by triangle's color / 255, colors must have shape (K, 3). Mipmap level is chosen for every
+    triangle from derivatives of texture coordinates on the screen
+    :param uvs: Array of shape (K, 3, 2) with texture coordinates of vertices of every triangle
+    :param clip_w: Array of shape (N,) with clip w of vertices. If given, texture coordinates are interpolated
+    with perspective correction, otherwise linearly in screen space
+    :return: Number of pixels written
+    """
+    if len(indices) == 0:
+        return 0
+    height, width = depth_buffer.shape
+    points = screen_vertices[indices].astype(np.float64)  # (K, 3, 3)
+    xs = points[:, :, 0]
+    ys = points[:, :, 1]
+
+    with np.errstate(invalid="ignore"):
+        x_min = np.maximum(np.ceil(xs.min(axis=1)), 0)
+        x_max = np.minimum(np.floor(xs.max(axis=1)), width - 1)
+        y_min = np.maximum(np.ceil(ys.min(axis=1)), 0)
+        y_max = np.minimum(np.floor(ys.max(axis=1)), height - 1)
+        box_widths = np.nan_to_num(x_max - x_min + 1).astype(np.int64)
+        box_heights = np.nan_to_num(y_max - y_min + 1).astype(np.int64)
+    counts = np.where((box_widths > 0) & (box_heights > 0), box_widths * box_heights, 0)
+
+    # Barycentric coordinate i of point (x, y) is a[i] * x + b[i] * y + c[i]
+    area = (xs[:, 1] - xs[:, 0]) * (ys[:, 2] - ys[:, 0]) - (ys[:, 1] - ys[:, 0]) * (xs[:, 2] - xs[:, 0])
+    counts[area == 0] = 0
+    area[area == 0] = 1
+    next_1 = [1, 2, 0]
+    next_2 = [2, 0, 1]
+    a = (ys[:, next_1] - ys[:, next_2]) / area[:, None]
+    b = (xs[:, next_2] - xs[:, next_1]) / area[:, None]
+    c = (xs[:, next_1] * ys[:, next_2] - xs[:, next_2] * ys[:, next_1]) / area[:, None]
+    # Depth is interpolated linearly in screen space: z = z_a * x + z_b * y + z_c
+    zs = points[:, :, 2]
+    planes = np.stack([(a * zs).sum(axis=1), (b * zs).sum(axis=1), (c * zs).sum(axis=1)], axis=1)
+    edges = np.stack([a, b, c], axis=1)  # (K, 3, 3), edges[:, j, i] is coefficient j of coordinate i
+    shade_planes = None
+    if shades is not None:  # Interpolated the same way as depth
+        vertex_shades = np.asarray(shades, dtype=np.float64)[indices]
+        shade_planes = np.stack([(a * vertex_shades).sum(axis=1), (b * vertex_shades).sum(axis=1),
+                                 (c * vertex_shades).sum(axis=1)], axis=1)
+    uv_planes = mip_levels = None
+    if texture is not None:
+        corner_uvs = np.asarray(uvs, dtype=np.float64)
+        # Derivatives of u and v by screen x and y, with coordinates taken as linear inside a triangle: (K, 2, 2)
+        derivatives = np.stack([(a[:, :, None] * corner_uvs).sum(axis=1), (b[:, :, None] * corner_uvs).sum(axis=1)],
+                               axis=2)
+        mip_levels = texture.get_mip_levels(derivatives)
+        # u / w, v / w and 1 / w are linear in screen space, their planes have shape (K, 3, 3)
+        weights = np.ones((len(indices), 3))
+        if clip_w is not None:
+            with np.errstate(divide="ignore"):
+                weights = 1 / np.asarray(clip_w, dtype=np.float64)[indices]
+        attributes = np.concatenate([corner_uvs * weights[:, :, None], weights[:, :, None]], axis=2)
+        uv_planes = np.stack([(a[:, :, None] * attributes).sum(axis=1), (b[:, :, None] * attributes).sum(axis=1),
+                              (c[:, :, None] * attributes).sum(axis=1)], axis=1)
+
+    flat_depth = depth_buffer.reshape(height * width)
+    flat_color = color_buffer.reshape(height * width, *color_buffer.shape[2:])
+    colors = np.asarray(colors)
+    box_origins = np.stack([x_min, y_min], axis=1).astype(np.int64)
+
+    written = 0
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(indices):
+        # Taking as many triangles as fit into max_fragments, but at least one
+        limit = (ends[start - 1] if start > 0 else 0) + max_fragments
+        end = max(int(np.searchsorted(ends, limit, side="right")), start + 1)
+        chunk = slice(start, end)
+        written += _fill_chunk(flat_depth, flat_color, width, counts[chunk], box_widths[chunk],
+                               box_origins[chunk], edges[chunk], planes[chunk], colors[chunk],
+                               None if shade_planes is None else shade_planes[chunk], palette,
+                               None if uv_planes is None else uv_planes[chunk],
+                               None if mip_levels is None else mip_levels[chunk], texture)
+        start = end
+    return written
+
+
+def _fill_chunk(flat_depth: np.ndarray, flat_color: np.ndarray, width: int, counts: np.ndarray,
+                box_widths: np.ndarray, box_origins: np.ndarray, edges: np.ndarray, planes: np.ndarray,
+                colors: np.ndarray, shade_planes: np.ndarray = None, palette: np.ndarray = None,
+                uv_planes: np.ndarray = None, mip_levels: np.ndarray = None, texture=None) -> int:
+    total = int(counts.sum())
+    if total == 0:
+        return 0
+    # Generating coordinates of every pixel of every bounding box
+    triangle = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    row, column = np.divmod(local, box_widths[triangle])
+    x = box_origins[triangle, 0] + column
+    y = box_origins[triangle, 1] + row
+
+    passed = np.ones(total, dtype=bool)
+    for i in range(3):
+        passed &= edges[triangle, 0, i] * x + edges[triangle, 1, i] * y + edges[triangle, 2, i] >= 0
+    triangle = triangle[passed]
+    x = x[passed]
+    y = y[passed]
+    z = planes[triangle, 0] * x + planes[triangle, 1] * y + planes[triangle, 2]
+    pixel = y * width + x
+    passed = z < flat_depth[pixel]
+    triangle = triangle[passed]
+    pixel = pixel[passed]
+    z = z[passed]
+    if len(pixel) == 0:
+        return 0
+
+    # Several triangles may cover the same pixel, the nearest one wins
+    order = np.lexsort((z, pixel))
+    pixel = pixel[order]
+    nearest = np.ones(len(pixel), dtype=bool)
+    nearest[1:] = pixel[1:] != pixel[:-1]
+    pixel = pixel[nearest]
+    flat_depth[pixel] = z[order][nearest]
+    triangle = triangle[order][nearest]
+    values = colors[triangle]
+    if uv_planes is not None:
+        values = _texture_pixels(pixel, width, triangle, values, uv_planes, mip_levels, texture)
+    if shade_planes is not None:
+        values = _shade_pixels(pixel, width, triangle, values, shade_planes, palette)
+    flat_color[pixel] = values
+    return len(pixel)
+
+
+def _texture_pixels(pixel: np.ndarray, width: int, triangle: np.ndarray, values: np.ndarray, uv_planes: np.ndarray,
+                    mip_levels: np.ndarray, texture) -> np.ndarray:
+    y, x = np.divmod(pixel, width)
+    planes = uv_planes[triangle]
+    u_w, v_w, inverse_w = (planes[:, 0] * x[:, None] + planes[:, 1] * y[:, None] + planes[:, 2]).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        texels = texture.sample(u_w / inverse_w, v_w / inverse_w, mip_levels[triangle])
+    return (texels.astype(np.uint16) * values // 255).astype(np.uint8)
+
+
+def _shade_pixels(pixel: np.ndarray, width: int, triangle: np.ndarray, values: np.ndarray, shade_planes: np.ndarray,
+                  palette: np.ndarray) -> np.ndarray:
+    y, x = np.divmod(pixel, width)
+    shade = shade_planes[triangle, 0] * x + shade_planes[triangle, 1] * y + shade_planes[triangle, 2]
+    smooth = ~np.isnan(shade)
+    shade = np.clip(shade[smooth], 0, 1)
+    if palette is None:
+        shaded = values[smooth] * (shade[:, None] if values.ndim > 1 else shade)
+    else:
+        shaded = palette[np.minimum((shade * len(palette)).astype(np.int64), len(palette) - 1)]
+    values[smooth] = shaded
+    return values
@@ -0,0 +1,146 @@
+from __future__ import annotations  # For cases when we need to specify parameter's ClassType inside ClassType's method
+from typing import Union, Iterator
+from math_objects import Matrix4x4
+
+
+class SceneNode:
+    """
+    Node of a scene graph. Position, rotation and scale of a node are relative to its parent.
+    Local and world matrices are cached and recomputed only after the node or one of its ancestors has changed.
+    They are rewritten in place, so returned matrices change with the node
+    """
+    def __init__(self):
+        self.parent: Union[SceneNode, None] = None
+        self.children: list[SceneNode] = []
+
+        self._x = 0
+        self._y = 0
+        self._z = 0
+        self._x_rot = 0
+        self._y_rot = 0
+        self._z_rot = 0
+        self._scale = 1
+
+        self._local_matrix = Matrix4x4.get_identity_matrix()
+        self._world_matrix = Matrix4x4.get_identity_matrix()
+        self._local_dirty = False
+        self._world_dirty = False
+        self.world_version = 0  # Incremented every time the world matrix is recomputed
+
+    def add_child(self, child: SceneNode):
+        if child.parent is not None:
+            child.parent.remove_child(child)
+        child.parent = self
+        self.children.append(child)
+        child._invalidate_world()
+
+    def remove_child(self, child: SceneNode):
+        self.children.remove(child)
+        child.parent = None
+        child._invalidate_world()
+
+    def walk(self) -> Iterator[SceneNode]:
+        """
+        Iterate over this node and all its descendants
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def _invalidate_local(self):
+        self._local_dirty = True
+        self._invalidate_world()
+
+    def _invalidate_world(self):
+        # Descendants of a dirty node are always dirty too, so there is nothing to do
+        if self._world_dirty:
+            return
+        self._world_dirty = True
+        for child in self.children:
+            child._invalidate_world()
+
+    def get_local_matrix(self) -> Matrix4x4:
+        if self._local_dirty:
+            # Scale, rotations around x, y, z and translation, multiplied in this order
+            Matrix4x4.compose_trs(self._scale, self._x_rot, self._y_rot, self._z_rot, self._x, self._y, self._z,
+                                  out=self._local_matrix)
+            self._local_dirty = False
+        return self._local_matrix
+
+    def get_world_matrix(self) -> Matrix4x4:
+        """
+        Get matrix that moves points from node's space into the space of the root of the graph
+        """
+        if self._world_dirty:
+            if self.parent is None:
+                self.get_local_matrix().copy(out=self._world_matrix)
+            else:
+                Matrix4x4.multiply(self.get_local_matrix(), self.parent.get_world_matrix(), out=self._world_matrix)
+            self._world_dirty = False
+            self.world_version += 1
+        return self._world_matrix
+
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        self._x = value
+        self._invalidate_local()
+
+    @property
+    def y(self):
+        return self._y
+
+    @y.setter
+    def y(self, value):
+        self._y = value
+        self._invalidate_local()
+
+    @property
+    def z(self):
+        return self._z
+
+    @z.setter
+    def z(self, value):
+        self._z = value
+        self._invalidate_local()
+
+    @property
+    def x_rot(self):
+        return self._x_rot
+
+    @x_rot.setter
+    def x_rot(self, value):
+        self._x_rot = value
+        self._invalidate_local()
+
+    @property
+    def y_rot(self):
+        return self._y_rot
+
+    @y_rot.setter
+    def y_rot(self, value):
+        self._y_rot = value
+        self._invalidate_local()
+
+    @property
+    def z_rot(self):
+        return self._z_rot
+
+    @z_rot.setter
+    def z_rot(self, value):
+        self._z_rot = value
+        self._invalidate_local()
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, value):
+        self._scale = value
+        self._invalidate_local()
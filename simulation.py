@@ -0,0 +1,111 @@
+import time
+import numpy as np
+from objects import Object3D
+
+DT = 1 / 60
+MAX_STEPS = 5  # Steps done for one frame at most, the rest of the time is dropped so slow frames do not pile up
+
+
+class Simulation:
+    """
+    Moves objects by their speeds with a fixed time step, independently of the frame rate. Speeds of objects
+    (vx, vy, vz, vx_rot, vy_rot, vz_rot) are in units and degrees per second.
+    Positions and rotations of all objects are kept in arrays and integrated together. Objects receive states
+    interpolated between the last two steps, so motion is smooth when frames do not match steps
+    """
+    def __init__(self, objects: list[Object3D] = (), dt: float = DT, max_steps: int = MAX_STEPS,
+                 clock=time.perf_counter):
+        self.dt = dt
+        self.max_steps = max_steps
+        self.clock = clock
+        self.objects: list[Object3D] = []
+        self.current = np.zeros((0, 6))  # Position and rotation of every object after the last step
+        self.previous = np.zeros((0, 6))  # Same before the last step
+        self.time = 0.0  # Simulated time
+        self.dropped_time = 0.0  # Time skipped because of the limit of steps per frame
+        self._accumulator = 0.0  # Time not simulated yet, less than dt
+        self._last_clock = None
+        self._applied = np.zeros((0, 6))  # States given to objects by the last apply
+        for obj in objects:
+            self.add(obj)
+
+    @staticmethod
+    def _get_state(obj: Object3D) -> list[float]:
+        return [obj.x, obj.y, obj.z, obj.x_rot, obj.y_rot, obj.z_rot]
+
+    def add(self, obj: Object3D):
+        state = np.array([self._get_state(obj)], dtype=np.float64)
+        self.objects.append(obj)
+        self.current = np.vstack((self.current, state))
+        self.previous = np.vstack((self.previous, state))
+        self._applied = np.vstack((self._applied, state))
+
+    def remove(self, obj: Object3D):
+        index = self.objects.index(obj)
+        del self.objects[index]
+        self.current = np.delete(self.current, index, axis=0)
+        self.previous = np.delete(self.previous, index, axis=0)
+        self._applied = np.delete(self._applied, index, axis=0)
+
+    def reload(self, obj: Object3D):
+        """
+        Take position and rotation of <obj> as its simulated state, after they were set outside the simulation
+        """
+        index = self.objects.index(obj)
+        self.current[index] = self.previous[index] = self._applied[index] = self._get_state(obj)
+
+    def get_speeds(self) -> np.ndarray:
+        """
+        :return: Array of shape (K, 6) with speeds of positions and rotations of all objects
+        """
+        speeds = [[obj.vx, obj.vy, obj.vz, obj.vx_rot, obj.vy_rot, obj.vz_rot] for obj in self.objects]
+        return np.array(speeds, dtype=np.float64).reshape(-1, 6)
+
+    def step(self, count: int = 1):
+        """
+        Advance all objects by <count> steps of dt. Speeds are constant during a step, so several steps are
+        integrated at once
+        """
+        speeds = self.get_speeds() * self.dt
+        self.previous = self.current + speeds * (count - 1)
+        self.current = self.current + speeds * count
+        self.time += self.dt * count
+
+    def advance(self, elapsed: float) -> float:
+        """
+        Do as many steps as fit into <elapsed> seconds and the time left from previous calls, but no more than
+        max_steps
+        :return: Part of a step between the last step and the current time, for interpolation
+        """
+        self._accumulator += elapsed
+        steps = int(self._accumulator / self.dt + 1e-9)  # Tolerance for rounding errors of sums of times
+        self._accumulator = max(self._accumulator - steps * self.dt, 0.0)
+        if steps > self.max_steps:
+            self.dropped_time += (steps - self.max_steps) * self.dt
+            steps = self.max_steps
+        if steps:
+            self.step(steps)
+        return min(self._accumulator / self.dt, 1.0)
+
+    def tick(self) -> float:
+        """
+        Advance by the time passed since the previous call of tick, measured with the clock
+        :return: Part of a step for interpolation (see advance)
+        """
+        now = self.clock()
+        elapsed = 0.0 if self._last_clock is None else now - self._last_clock
+        self._last_clock = now
+        return self.advance(elapsed)
+
+    def apply(self, alpha: float = 1.0):
+        """
+        Move objects into states interpolated between the last two steps. Objects that did not move keep
+        their cached matrices
+        :param alpha: 0 for the state before the last step, 1 for the state after it
+        """
+        states = self.previous + (self.current - self.previous) * alpha
+        changed = np.flatnonzero((states != self._applied).any(axis=1))
+        for index, state in zip(changed.tolist(), states[changed].tolist()):
+            self.objects[index].set_pos(*state[:3])
+            self.objects[index].set_rotation(*state[3:])
+        self._applied = states
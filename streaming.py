@@ -0,0 +1,279 @@
+"""
+Chunked scenes for worlds larger than memory. Geometry is split into chunks of a spatial grid, every chunk is
+stored in its own mesh cache file, and a StreamingScene keeps in memory only the chunks near the camera:
+
+    python streaming.py world.obj world_chunks --chunk-size 50
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from math import inf
+import numpy as np
+from objects import Object3D, Camera3D, Mesh
+from console_drawer import ConsoleDrawer
+from scene import SceneNode
+import mesh_cache
+
+INDEX_FILE = "scene.json"
+MEMORY_BUDGET = 256 << 20
+# Bytes per vertex and per face of a loaded chunk: mesh arrays, normals and transform buffers of Object3D
+VERTEX_BYTES = 16 + 12 + 16 + 12
+FACE_BYTES = 12 + 12
+
+
+def estimate_chunk_memory(vertex_count: int, face_count: int) -> int:
+    return vertex_count * VERTEX_BYTES + face_count * FACE_BYTES
+
+
+def write_chunked_scene(mesh: Mesh, directory: str, chunk_size: float) -> int:
+    """
+    Split <mesh> into chunks by centers of faces on a grid of cubes with side <chunk_size> and write them
+    into <directory> with index file. Mesh may be memory-mapped (see mesh_cache.load_obj_cached), its arrays
+    are read chunk by chunk
+    :return: Number of written chunks
+    """
+    os.makedirs(directory, exist_ok=True)
+    cells = np.empty((len(mesh.indices), 3), dtype=np.int64)
+    batch = 1 << 20
+    for start in range(0, len(mesh.indices), batch):
+        centers = mesh.vertices[mesh.indices[start:start + batch], :3].astype(np.float64).mean(axis=1)
+        cells[start:start + batch] = np.floor(centers / chunk_size)
+    keys, inverse = np.unique(cells, axis=0, return_inverse=True)
+    order = np.argsort(inverse.reshape(-1), kind="stable")
+    ends = np.cumsum(np.bincount(inverse.reshape(-1), minlength=len(keys)))
+
+    chunks = []
+    start = 0
+    for key, end in zip(keys.tolist(), ends.tolist()):
+        faces = np.asarray(mesh.indices[np.sort(order[start:end])])
+        start = end
+        used, local = np.unique(faces, return_inverse=True)
+        chunk = Mesh(np.asarray(mesh.vertices[used]), local.reshape(-1, 3))
+        file_name = "chunk_{}_{}_{}{}".format(*key, mesh_cache.CACHE_EXTENSION)
+        mesh_cache.write_mesh_cache(chunk, os.path.join(directory, file_name), {"chunk": key})
+        box_min, box_max = chunk.get_bounding_box()
+        chunks.append({"key": key, "file": file_name, "min": box_min.tolist(), "max": box_max.tolist(),
+                       "vertices": chunk.get_vertex_count(), "faces": chunk.get_face_count()})
+
+    with open(os.path.join(directory, INDEX_FILE), "w") as file:
+        json.dump({"chunk_size": chunk_size, "chunks": chunks}, file)
+    return len(chunks)
+
+
+class StreamingScene(SceneNode):
+    """
+    Scene node whose children are chunks of a chunked scene, loaded while the camera moves.
+    Every update orders chunks by distance from the camera, with chunks in front of it first, and keeps
+    as many of the nearest ones as fit into the memory budget. Missing chunks are read by a background thread,
+    and loaded chunks are attached to the scene by the next update, so drawing never waits for the disk.
+    Chunks that are no longer needed are evicted, least recently drawn first. A chunk that fails to load is not
+    requested again, its error is raised by the next update.
+    Update and drawing must be called from the same thread
+    """
+    def __init__(self, directory: str, memory_budget: int = MEMORY_BUDGET, load_distance: float = inf):
+        """
+        :param directory: Directory written by write_chunked_scene
+        :param memory_budget: Bytes of loaded chunks, see estimate_chunk_memory. Can be exceeded only by chunks
+        that were being loaded when they stopped being needed, until the next update
+        :param load_distance: Chunks farther from the camera are not loaded
+        """
+        super().__init__()
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.load_distance = load_distance
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            index = json.load(file)
+        self.chunks: list[dict] = index["chunks"]
+        self._box_min = np.array([chunk["min"] for chunk in self.chunks], dtype=np.float64).reshape(-1, 3)
+        self._box_max = np.array([chunk["max"] for chunk in self.chunks], dtype=np.float64).reshape(-1, 3)
+        self._sizes = np.array([estimate_chunk_memory(chunk["vertices"], chunk["faces"]) for chunk in self.chunks],
+                               dtype=np.int64)
+
+        self.loaded: OrderedDict[int, Object3D] = OrderedDict()  # Chunks attached to the scene, least recent first
+        self.memory_used = 0  # Estimated bytes of loaded chunks
+        self.loads = 0  # Number of chunks loaded so far
+        self.evictions = 0
+        self.failed: set[int] = set()  # Chunks that could not be loaded
+
+        # Shared with the loading thread
+        self._condition = threading.Condition()
+        self._requests: list[int] = []  # Chunks to load, most important first
+        self._loading: set[int] = set()  # Requested chunks that are not attached yet
+        self._ready: list[tuple[int, Object3D]] = []
+        self._errors: list[tuple[int, Exception]] = []  # Chunks that failed to load and their errors
+        self._stop = False
+        self._thread = threading.Thread(target=self._load_chunks, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_priorities(self, camera: Camera3D) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Order chunks by distance from the camera to their boxes. Distance to chunks behind the camera is
+        counted up to three times, so chunks in view are loaded first
+        :return: Indices of chunks closer than load distance, most important first, and their distances
+        """
+        world_matrix = np.array(self.get_world_matrix()._values, dtype=np.float64)
+        inverse = np.linalg.inv(world_matrix)
+        pos = np.array([camera.pos.x, camera.pos.y, camera.pos.z, 1]) @ inverse  # Camera in scene's space
+        pos = pos[:3] / pos[3]
+        scale = np.sqrt((world_matrix[:3, :3] ** 2).sum(axis=1).max())
+        closest = np.clip(pos, self._box_min, self._box_max)
+        distances = np.linalg.norm(closest - pos, axis=1) * scale
+
+        forward = camera.get_direction_vector()
+        forward = np.array([forward.x, forward.y, forward.z, 0]) @ inverse
+        centers = (self._box_min + self._box_max) / 2 - pos
+        lengths = np.linalg.norm(centers, axis=1) * np.linalg.norm(forward[:3])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosines = np.nan_to_num(centers @ forward[:3] / lengths, nan=1.0)
+        scores = distances * (2 - cosines)
+        candidates = np.flatnonzero(distances <= self.load_distance)
+        order = candidates[np.argsort(scores[candidates], kind="stable")]
+        return order, distances[order]
+
+    def update(self, camera: Camera3D):
+        """
+        Attach chunks loaded since the previous call, evict chunks that are not needed and request missing ones.
+        Does not wait for loading
+        :raises Exception: Error of the first chunk that failed to load since the previous call, after the update
+        is done
+        """
+        with self._condition:
+            ready = self._ready
+            self._ready = []
+            self._loading.difference_update(chunk for chunk, _ in ready)
+            errors = self._errors
+            self._errors = []
+        self.failed.update(chunk for chunk, _ in errors)
+        for chunk, obj in ready:
+            self.loaded[chunk] = obj
+            self.memory_used += int(self._sizes[chunk])
+            self.add_child(obj)
+            self.loads += 1
+
+        # Nearest chunks that fit into the budget
+        order, _ = self.get_priorities(camera)
+        if self.failed:
+            order = order[~np.isin(order, list(self.failed))]
+        fits = np.cumsum(self._sizes[order]) <= self.memory_budget
+        keep = order[fits].tolist()
+        keep_set = set(keep)
+        missing = [chunk for chunk in keep if chunk not in self.loaded]
+
+        with self._condition:
+            loading = self._loading.copy()
+        needed = int(sum(self._sizes[chunk] for chunk in missing if chunk not in loading))
+        in_flight = int(sum(self._sizes[chunk] for chunk in loading))
+        for chunk in list(self.loaded):  # Least recently drawn first
+            if self.memory_used + in_flight + needed <= self.memory_budget:
+                break
+            if chunk not in keep_set:
+                self._evict(chunk)
+
+        with self._condition:
+            self._requests = [chunk for chunk in missing if chunk not in self._loading]
+            if self._requests:
+                self._condition.notify()
+        if errors:
+            raise errors[0][1]
+
+    def _evict(self, chunk: int):
+        obj = self.loaded.pop(chunk)
+        self.remove_child(obj)
+        self.memory_used -= int(self._sizes[chunk])
+        self.evictions += 1
+
+    def wait_for_loads(self, timeout: float = None) -> bool:
+        """
+        Wait until all requested chunks are loaded or failed. They are attached by the next update
+        :return: False if timeout expired first
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._requests and len(self._ready) == len(self._loading),
+                                            timeout)
+
+    def _load_chunks(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._requests or self._stop)
+                if self._stop:
+                    return
+                chunk = self._requests.pop(0)
+                self._loading.add(chunk)
+            try:
+                obj = self.load_chunk(chunk)
+            except Exception as error:  # Passed to the thread calling update, loading goes on
+                with self._condition:
+                    self._loading.discard(chunk)
+                    self._errors.append((chunk, error))
+                    self._condition.notify_all()
+                continue
+            with self._condition:
+                self._ready.append((chunk, obj))
+                self._condition.notify_all()
+
+    def load_chunk(self, chunk: int) -> Object3D:
+        """
+        Read chunk into memory and prepare everything computed once per mesh, so first drawing is not slower
+        """
+        _, mapped = mesh_cache.read_mesh_cache(os.path.join(self.directory, self.chunks[chunk]["file"]))
+        mesh = Mesh(np.array(mapped.vertices), np.array(mapped.indices))  # Copies, file is not touched later
+        mesh.get_bounding_sphere()
+        mesh.get_face_normals()
+        obj = Object3D(mesh)
+        obj.set_scale(1)
+        return obj
+
+    def get_objects(self) -> list[Object3D]:
+        return list(self.loaded.values())
+
+    def get_visible_objects(self, camera: Camera3D) -> list[Object3D]:
+        """
+        Get loaded chunks intersecting camera's view frustum. They become the most recently used
+        """
+        visible = []
+        for chunk, obj in list(self.loaded.items()):
+            if obj.is_in_frustum(camera):
+                self.loaded.move_to_end(chunk)
+                visible.append(obj)
+        return visible
+
+    def draw(self, surface, color: tuple[int, int, int], camera: Camera3D):
+        """
+        Draw loaded chunks (see Object3D.draw)
+        """
+        for obj in self.get_visible_objects(camera):
+            obj.draw(surface, color, camera)
+
+    def draw_console(self, console_drawer: ConsoleDrawer, camera: Camera3D):
+        for obj in self.get_visible_objects(camera):
+            obj.draw_console(console_drawer, camera)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help=".obj file")
+    parser.add_argument("directory", help="directory to write chunks into")
+    parser.add_argument("--chunk-size", type=float, required=True, help="side of a chunk in model units")
+    args = parser.parse_args(argv)
+    count = write_chunked_scene(mesh_cache.load_obj_cached(args.model), args.directory, args.chunk_size)
+    print(f"{count} chunks written", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
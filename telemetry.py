@@ -0,0 +1,253 @@
+import atexit
+import json
+import os
+import sys
+import threading
+from contextlib import nullcontext
+from time import perf_counter
+import numpy as np
+
+HISTORY_SIZE = 600  # Number of last frames kept for percentiles of frame time
+_NULL_STAGE = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.add_time(self.name, perf_counter() - self.start)
+
+
+class _FrameScope:
+    __slots__ = ("local", "frame", "previous")
+
+    def __init__(self, local: threading.local, frame: int):
+        self.local = local
+        self.frame = frame
+
+    def __enter__(self):
+        self.previous = getattr(self.local, "frame", None)
+        self.local.frame = self.frame
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.local.frame = self.previous
+
+
+class Profiler:
+    """
+    Collects time of pipeline stages and counters of processed work for every frame, and keeps times of last
+    frames for percentiles. When disabled, stage returns a shared empty context manager and count returns
+    at once, so instrumented code costs only a method call.
+    Stages and counters may come from several threads. They go into the frame set for the thread by frame_scope,
+    or into the current frame (the next one to be closed by end_frame) outside of it
+    """
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        self.enabled = False
+        self.frame = 0  # Number of the current frame
+        self.last_frame: dict = {}  # Statistics of the last finished frame, as given to sinks
+        self.sinks = []  # Functions called with statistics of every finished frame
+        self._frames: dict[int, tuple[dict, dict]] = {}  # Stage times and counters of open frames by number
+        self._lock = threading.Lock()  # Guards open frames, stages and counters are added from several threads
+        self._local = threading.local()  # Frame set by frame_scope for every thread
+        self._history = np.zeros(history_size)  # Ring buffer of frame times in seconds
+        self._history_count = 0
+        self._frame_start = None
+
+    def enable(self):
+        self.enabled = True
+        self._frame_start = perf_counter()
+
+    def disable(self):
+        self.enabled = False
+
+    @property
+    def stage_times(self) -> dict[str, float]:
+        """
+        Seconds spent in every stage during the current frame so far
+        """
+        with self._lock:
+            return dict(self._frames.get(self.frame, ({}, {}))[0])
+
+    @property
+    def counters(self) -> dict[str, int]:
+        """
+        Counters of the current frame so far
+        """
+        with self._lock:
+            return dict(self._frames.get(self.frame, ({}, {}))[1])
+
+    def frame_scope(self, frame: int):
+        """
+        Context manager sending stages and counters of the calling thread into frame <frame>, so work on the next
+        frame done while the current one is rendered is not mixed into it
+        """
+        return _FrameScope(self._local, frame)
+
+    def stage(self, name: str):
+        """
+        Context manager measuring time of the code inside it as a part of stage <name>
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def _get_open_frame(self) -> tuple[dict, dict]:
+        """
+        Get stage times and counters of the frame of the calling thread. Lock must be held
+        """
+        frame = getattr(self._local, "frame", None)
+        if frame is None:
+            frame = self.frame
+        stats = self._frames.get(frame)
+        if stats is None:
+            stats = self._frames[frame] = ({}, {})
+        return stats
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            stage_times = self._get_open_frame()[0]
+            stage_times[name] = stage_times.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            with self._lock:
+                counters = self._get_open_frame()[1]
+                counters[name] = counters.get(name, 0) + value
+
+    def add_sink(self, sink):
+        """
+        :param sink: Function called with statistics of every finished frame: dict with "frame", "frame_ms",
+        "stages_ms" and "counters"
+        """
+        self.sinks.append(sink)
+
+    def end_frame(self, frame: int = None):
+        """
+        Close frame <frame>, the current one if not given: record its time, pass statistics to sinks and make the
+        next frame current. Statistics of earlier frames that were never closed (skipped ones) are dropped
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if frame is None:
+                frame = self.frame
+            now = perf_counter()
+            frame_time = now - self._frame_start
+            self._frame_start = now
+            self._history[self._history_count % len(self._history)] = frame_time
+            self._history_count += 1
+            stage_times, counters = self._frames.pop(frame, ({}, {}))
+            for number in [number for number in self._frames if number < frame]:
+                del self._frames[number]
+            self.last_frame = {
+                "frame": frame,
+                "frame_ms": 1000 * frame_time,
+                "stages_ms": {name: 1000 * seconds for name, seconds in stage_times.items()},
+                "counters": counters,
+            }
+            self.frame = frame + 1
+        for sink in self.sinks:
+            sink(self.last_frame)
+
+    def get_frame_times(self) -> np.ndarray:
+        """
+        :return: Times of last frames in seconds, up to history size
+        """
+        return self._history[:min(self._history_count, len(self._history))]
+
+    def get_percentiles(self, percentiles=(50, 95, 99)) -> dict[str, float]:
+        """
+        :return: Frame time percentiles in milliseconds over the last frames, like {"p50": 16.6, ...}
+        """
+        times = self.get_frame_times()
+        if len(times) == 0:
+            return {f"p{p}": 0.0 for p in percentiles}
+        values = np.percentile(times, percentiles) * 1000
+        return {f"p{p}": float(value) for p, value in zip(percentiles, values)}
+
+    def get_histogram(self, bins: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: Numbers of last frames in every bin and edges of bins in milliseconds
+        """
+        return np.histogram(self.get_frame_times() * 1000, bins=bins)
+
+    def format_overlay(self) -> str:
+        """
+        One line summary of the last frame and frame time percentiles
+        """
+        stats = self.last_frame
+        if not stats:
+            return ""
+        percentiles = self.get_percentiles()
+        parts = [f"{stats['frame_ms']:5.1f}ms " +
+                 " ".join(f"{name} {value:.1f}" for name, value in percentiles.items())]
+        if stats["stages_ms"]:
+            parts.append(" ".join(f"{name} {value:.1f}" for name, value in stats["stages_ms"].items()))
+        if stats["counters"]:
+            parts.append(" ".join(f"{name} {value}" for name, value in stats["counters"].items()))
+        return " | ".join(parts)
+
+
+class StderrOverlay:
+    """
+    Sink printing summary line into stderr every <interval> frames, over the previous line
+    """
+    def __init__(self, profiler: Profiler, interval: int = 30, stream=None):
+        self.profiler = profiler
+        self.interval = interval
+        self.stream = stream
+
+    def __call__(self, stats: dict):
+        if stats["frame"] % self.interval == 0:
+            stream = self.stream or sys.stderr
+            stream.write("\r\x1b[K" + self.profiler.format_overlay())
+            stream.flush()
+
+
+class JsonLinesWriter:
+    """
+    Sink writing statistics of every frame as a line of JSON. Every line is flushed at once, so it is kept when
+    the program is interrupted. File is closed by close or at exit
+    """
+    def __init__(self, file_path: str):
+        self.file = open(file_path, "a")
+        atexit.register(self.close)
+
+    def __call__(self, stats: dict):
+        self.file.write(json.dumps(stats) + "\n")
+        self.file.flush()
+
+    def close(self):
+        atexit.unregister(self.close)
+        self.file.close()
+
+
+def configure(profiler: Profiler, setting: str = None) -> bool:
+    """
+    Enable profiler and add sinks described by <setting>, taken from environment variable TELEMETRY if not given.
+    Setting is a comma separated list of "overlay" (summary drawn over the image), "stderr" (summary printed
+    into stderr) and file paths (statistics of every frame written as JSON lines)
+    :return: True if summary should be drawn over the image
+    """
+    if setting is None:
+        setting = os.environ.get("TELEMETRY", "")
+    overlay = False
+    for item in filter(None, (item.strip() for item in setting.split(","))):
+        if item == "overlay":
+            overlay = True
+        elif item == "stderr":
+            profiler.add_sink(StderrOverlay(profiler))
+        else:
+            profiler.add_sink(JsonLinesWriter(item))
+        profiler.enable()
+    return overlay
+
+
+profiler = Profiler()  # Shared by all instrumented code
@@ -1,5 +1,35 @@
 import unittest
-from objects import Vector3D, Matrix4x4
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+from objects import Vector3D, Matrix4x4, Mesh, Polygon, Object3D, Camera3D
+import models
+import pipeline
+import rasterizer
+import obj_loader
+import mesh_cache
+import bvh
+import lod
+import instancing
+import tiled_rasterizer
+import frame_loop
+import simulation
+import benchmark
+import telemetry
+import offline_render
+import streaming
+import textures
+import pygame
+from pygame_drawer import PygameDrawer
+import threading
+import time
+from scene import SceneNode
+from console_drawer import ConsoleDrawer
+
+OBJ_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "untitled.obj")
 
 
 class TestVectors(unittest.TestCase):
@@ -81,6 +111,27 @@ class TestVectors(unittest.TestCase):
         v6 = Vector3D.cross_product(v4, v5)
         self.check_vector_values(v6, -341, -254, 517, 0)
 
+    def test_output_arguments(self):
+        v1 = Vector3D(7, 17, 13)
+        v2 = Vector3D(-3, -5, 3)
+        out = Vector3D(0, 0, 0)
+        self.assertIs(v1.add(v2, out=out), out)
+        self.check_vector_values(out, 4, 12, 16, 1)
+        v1.sub(v2, out=out)
+        self.check_vector_values(out, 10, 22, 10, 1)
+        Vector3D.cross_product(v1, v2, out=v1)  # Output may be an operand
+        self.check_vector_values(v1, 116, -60, 16, 1)
+        v2.mul_by_scalar(2, out=v2)
+        self.check_vector_values(v2, -6, -10, 6, 1)
+        v2.normalize(out=v2)
+        self.assertAlmostEqual(v2.length(), 1)
+        matrix = Matrix4x4([[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12], [13, 14, 15, 16]])
+        v3 = Vector3D(3, 7, 5)
+        v3.mul_by_matrix(matrix, out=v3)
+        self.check_vector_values(v3, 96, 112, 128, 144)
+        with self.assertRaises(AttributeError):
+            v3.color = 1  # No instance dictionary
+
     def test_dot_product(self):
         v1 = Vector3D(7, 17, 13)
         v2 = Vector3D(-3, -5, 3)
@@ -105,6 +156,1505 @@ class TestMatrices(unittest.TestCase):
         correct_m = [[469, 320, 307, 214], [607, 410, 424, 293], [701, 496, 587, 380], [614, 430, 360, 386]]
         self.assertEqual(matrix3._values, correct_m)
 
+    def test_output_arguments(self):
+        m1 = [[13, 2, 9, 6], [14, 3, 16, 7], [7, 18, 11, 12], [7, 1, 18, 16]]
+        matrix1 = Matrix4x4(m1)
+        matrix2 = Matrix4x4([[18, 12, 11, 4], [14, 10, 19, 6], [13, 8, 12, 8], [15, 12, 3, 13]])
+        rows = list(matrix1._values)
+        self.assertIs(Matrix4x4.multiply(matrix1, matrix2, out=matrix1), matrix1)  # Output may be an operand
+        self.assertEqual(matrix1._values,
+                         [[469, 320, 307, 214], [607, 410, 424, 293], [701, 496, 587, 380], [614, 430, 360, 386]])
+        for row, old_row in zip(matrix1._values, rows):  # Written in place
+            self.assertIs(row, old_row)
+        self.assertEqual(m1, [[13, 2, 9, 6], [14, 3, 16, 7], [7, 18, 11, 12], [7, 1, 18, 16]])  # Rows were copied
+
+        copy = matrix2.copy()
+        self.assertEqual(copy._values, matrix2._values)
+        self.assertIsNot(copy[0], matrix2[0])
+        self.assertIs(matrix2.copy(out=matrix1), matrix1)
+        self.assertEqual(matrix1._values, matrix2._values)
+
+    def test_compose_trs(self):
+        expected = Matrix4x4.get_scale(3, 3, 3)
+        for matrix in (Matrix4x4.get_rotate_x(10), Matrix4x4.get_rotate_y(-70), Matrix4x4.get_rotate_z(130),
+                       Matrix4x4.get_translation(1, 2, -30)):
+            expected = Matrix4x4.multiply(expected, matrix)
+        out = Matrix4x4()
+        rows = list(out._values)
+        matrix = Matrix4x4.compose_trs(3, 10, -70, 130, 1, 2, -30, out=out)
+        self.assertIs(matrix, out)
+        for row, old_row in zip(matrix._values, rows):
+            self.assertIs(row, old_row)
+        np.testing.assert_allclose(matrix._values, expected._values, atol=1e-12)
+
+    def test_look_at(self):
+        eye, target, up = Vector3D(1, 2, 3), Vector3D(-4, 0, -7), Vector3D(0, 1, 0)
+        vz = (target - eye).normalize()
+        vx = Vector3D.cross_product(up, vz).normalize()
+        vy = Vector3D.cross_product(vz, vx).normalize()
+        rotation = Matrix4x4([[vx.x, vy.x, vz.x, 0], [vx.y, vy.y, vz.y, 0], [vx.z, vy.z, vz.z, 0], [0, 0, 0, 1]])
+        expected = Matrix4x4.multiply(Matrix4x4.get_translation(-1, -2, -3), rotation)
+        np.testing.assert_allclose(Matrix4x4.get_look_at(eye, target, up)._values, expected._values, atol=1e-12)
+
+    def test_transform_and_project(self):
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        matrix = camera.get_camera_matrix()
+        point = Vector3D(0.5, -0.3, -4)
+        clip = point.mul_by_matrix(matrix)
+        expected = pipeline.project_to_screen(np.array([[clip.x, clip.y, clip.z, clip.w]]), 40, 20, 40, 20)[0]
+        out = Vector3D(0, 0, 0)
+        projected = point.transform_and_project(matrix, 40, 20, 40, 20, out=out)
+        self.assertIs(projected, out)
+        np.testing.assert_allclose([projected.x, projected.y, projected.z], expected, rtol=1e-6)
+        self.assertAlmostEqual(projected.w, clip.w)
+
+
+class TestMesh(unittest.TestCase):
+    def test_creation(self):
+        mesh = Mesh([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [[0, 1, 2]])
+        self.assertEqual(mesh.vertices.shape, (3, 4))
+        self.assertEqual(mesh.indices.shape, (1, 3))
+        self.assertTrue(np.all(mesh.vertices[:, 3] == 1))
+
+    def test_from_polygons_shares_vertices(self):
+        polygons = [
+            Polygon([Vector3D(0, 0, 0), Vector3D(1, 0, 0), Vector3D(0, 1, 0)]),
+            Polygon([Vector3D(1, 1, 0), Vector3D(0, 1, 0), Vector3D(1, 0, 0)]),
+        ]
+        obj = Object3D(polygons)
+        self.assertEqual(obj.mesh.get_vertex_count(), 4)
+        self.assertEqual(obj.mesh.get_face_count(), 2)
+        self.assertEqual(obj.mesh.indices.tolist(), [[0, 1, 2], [3, 2, 1]])
+
+    def test_polygon_view(self):
+        cube = models.Cube()
+        self.assertEqual(cube.mesh.vertices.shape, (8, 4))
+        polygons = cube.polygons
+        self.assertEqual(len(polygons), 12)
+        self.assertEqual(polygons[3].points[0].to_string(), "1.0, 1.0, -1.0")
+
+    def test_file_object(self):
+        obj = models.FileObject(OBJ_PATH)
+        self.assertEqual(obj.mesh.vertices.shape, (64, 4))
+        self.assertEqual(obj.mesh.indices.shape, (96, 3))
+        self.assertEqual(obj.mesh.indices.min(), 0)
+        self.assertEqual(obj.mesh.indices.max(), 63)
+
+    def test_normals(self):
+        mesh = models.Cube().mesh
+        face_normals = mesh.get_face_normals()
+        self.assertIs(mesh.get_face_normals(), face_normals)  # Computed once
+        np.testing.assert_allclose(np.linalg.norm(face_normals, axis=1), 1, rtol=1e-6)
+        self.assertTrue(np.all(np.abs(face_normals).max(axis=1) == 1))  # Faces are parallel to axes
+        vertex_normals = mesh.get_vertex_normals()
+        np.testing.assert_allclose(np.linalg.norm(vertex_normals, axis=1), 1, rtol=1e-6)
+        self.assertTrue(np.all(np.abs(vertex_normals) > 0.3))  # Corners get normals of all three faces
+
+        # Area weighting: the large face decides the normal of the shared vertex
+        mesh = Mesh([(0, 0, 0), (10, 0, 0), (0, 10, 0), (0, 0, 1)], [[0, 1, 2], [0, 3, 1]])
+        normal = mesh.get_vertex_normals()[0]
+        self.assertGreater(abs(normal[2]), 0.99)
+        sphere = models.make_sphere_mesh(16, 32)
+        points = sphere.vertices[:, :3] / np.linalg.norm(sphere.vertices[:, :3], axis=1)[:, None]
+        cosines = np.abs(np.einsum("ij,ij->i", points, sphere.get_vertex_normals()))
+        self.assertTrue(np.all(cosines > 0.99))
+
+
+class TestTransformStage(unittest.TestCase):
+    def test_transform_matches_mul_by_matrix(self):
+        obj = models.CutPyramid()
+        obj.set_pos(10, -5, -300)
+        obj.set_rotation(15, 30, 45)
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        matrix = obj.get_transform_matrix(camera)
+        transformed = obj.transform_vertices(camera)
+        for vertex, row in zip(obj.mesh.vertices, transformed):
+            v = Vector3D(*(float(c) for c in vertex)).mul_by_matrix(matrix)
+            np.testing.assert_allclose(row, [v.x, v.y, v.z, v.w], rtol=1e-4, atol=1e-3)
+
+    def test_output_buffer_is_reused(self):
+        obj = models.Cube()
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        first = obj.transform_vertices(camera)
+        second = obj.transform_vertices(camera)
+        self.assertIs(first, second)
+
+
+class TestCullAndShade(unittest.TestCase):
+    def setUp(self):
+        self.camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+
+    def cull(self, obj, width=100, height=100):
+        clip_vertices = obj.transform_vertices(self.camera)
+        screen_vertices = obj.project_vertices(width / 2, height / 2, width / 2, height / 2)
+        return pipeline.cull_and_shade(clip_vertices, screen_vertices, obj.mesh.indices, width, height,
+                                       self.camera.get_projection_scale())
+
+    def test_matches_polygon_is_visible(self):
+        cube = models.Cube()
+        cube.set_pos(0, 0, -300)
+        cube.set_rotation(20, 30, 0)
+        visible, brightness = self.cull(cube)
+        matrix = cube.get_transform_matrix(self.camera)
+        for i, polygon in enumerate(cube.polygons):
+            polygon.apply_matrix(matrix)
+            self.assertEqual(bool(visible[i]), polygon.is_visible(self.camera))
+        self.assertTrue(np.all((brightness[visible] > 0) & (brightness[visible] <= 1)))
+        self.assertTrue(np.all(brightness[~visible] == 0))
+
+    def test_cached_normals_give_same_brightness(self):
+        cube = models.Cube()
+        cube.set_pos(3, -2, -300)
+        cube.set_rotation(20, 30, 50)
+        cube.set_scale(40)
+        visible, expected = self.cull(cube)
+        clip_vertices = cube.transform_vertices(self.camera)
+        screen_vertices = cube.project_vertices(50, 50, 50, 50)
+        normal_matrix = cube.get_normal_matrix(self.camera)
+        self.assertIs(cube.get_normal_matrix(self.camera), normal_matrix)
+        visible_2, brightness = pipeline.cull_and_shade(clip_vertices, screen_vertices, cube.mesh.indices, 100, 100,
+                                                        self.camera.get_projection_scale(),
+                                                        cube.mesh.get_face_normals(), normal_matrix)
+        np.testing.assert_array_equal(visible, visible_2)
+        np.testing.assert_allclose(brightness, expected, atol=1e-5)
+
+        # Every vertex of a cube is shared by three faces, brightness is between theirs
+        shades = cube.get_vertex_brightness(self.camera)
+        self.assertEqual(shades.shape, (8,))
+        self.assertTrue(np.all((shades >= 0) & (shades <= 1)))
+
+    def test_smooth_shading_in_frame_state(self):
+        sphere = Object3D(models.make_sphere_mesh(8, 16))
+        sphere.set_scale(1)
+        sphere.set_pos(0, 0, -4)
+        results = []
+        for smooth in (False, True):
+            sphere.smooth_shading = smooth
+            state = frame_loop.FrameState()
+            state.clear(40, 30)
+            sphere.draw_console(state, self.camera)
+            drawer = ConsoleDrawer(io.StringIO())
+            drawer.set_size(40, 30)
+            drawer.fill_triangles(*state.get_triangles(), state.get_shades())
+            results.append(drawer.surface.copy())
+            self.assertEqual(state.get_shades() is None, not smooth)
+        flat, smooth = results
+        np.testing.assert_array_equal(flat != ord(" "), smooth != ord(" "))  # Same coverage
+        self.assertGreater(len(np.unique(smooth)), len(np.unique(flat)))
+
+    def test_face_facing_camera_is_fully_lit(self):
+        obj = Object3D(Mesh([(-1, -1, 0), (1, -1, 0), (-1, 1, 0)], [[0, 1, 2]]))
+        obj.set_pos(0, 0, -10)
+        obj.set_scale(1)
+        visible, brightness = self.cull(obj)
+        self.assertTrue(visible[0])
+        self.assertAlmostEqual(float(brightness[0]), 1, places=5)
+
+    def test_drops_degenerate_subpixel_and_behind_camera(self):
+        mesh = Mesh([(0, 0, 0), (1, 1, 0), (2, 2, 0), (0.1, 0.1, 0), (0.2, 0.1, 0), (0.1, 0.2, 0)],
+                    [[0, 1, 2], [3, 5, 4]])
+        obj = Object3D(mesh)
+        obj.set_pos(0.2, 0.2, -1000)
+        obj.set_scale(1)
+        visible, _ = self.cull(obj)
+        self.assertEqual(visible.tolist(), [False, False])
+
+        obj = Object3D(Mesh([(-1, -1, 0), (1, -1, 0), (-1, 1, 0)], [[0, 1, 2]]))
+        obj.set_pos(0, 0, 10)
+        visible, _ = self.cull(obj)
+        self.assertFalse(visible[0])
+
+
+class TestConsoleDrawer(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.drawer = ConsoleDrawer(self.stream)
+        self.drawer.set_size(10, 6)
+        self.drawer.clear()
+
+    def line(self, y):
+        return self.drawer.surface[y].tobytes().decode()
+
+    def test_fill_triangle_covers_cell_centers(self):
+        self.drawer.fill_triangle((0, 0, 1), (4, 0, 1), (0, 4, 1), "#")
+        self.assertEqual(self.line(0), "#####     ")
+        self.assertEqual(self.line(2), "###       ")
+        self.assertEqual(self.line(5), " " * 10)
+
+    def test_depth_test_ignores_draw_order(self):
+        near = ((0, 0, 1), (9, 0, 1), (0, 5, 1))
+        far = ((0, 0, 2), (9, 0, 2), (0, 5, 2))
+        self.drawer.fill_triangle(*near, "N")
+        self.drawer.fill_triangle(*far, "F")
+        self.assertEqual(self.line(0)[0], "N")
+
+        self.drawer.clear()
+        self.assertEqual(self.line(0)[0], " ")
+        self.drawer.fill_triangle(*far, "F")
+        self.drawer.fill_triangle(*near, "N")
+        self.assertEqual(self.line(0)[0], "N")
+
+    def test_print_surface_writes_only_changes(self):
+        written = self.drawer.print_surface()
+        self.assertEqual(self.stream.getvalue(), "\x1b[H" + " " * 60)
+        self.assertEqual(written, 63)
+
+        self.assertEqual(self.drawer.print_surface(), 0)
+
+        self.drawer.surface[1, 2] = ord("a")
+        self.drawer.surface[1, 4] = ord("b")
+        self.drawer.surface[3, 9] = ord("c")
+        self.stream.seek(0)
+        self.stream.truncate()
+        written = self.drawer.print_surface()
+        self.assertEqual(self.stream.getvalue(), "\x1b[2;3Ha b\x1b[4;10Hc")
+        self.assertEqual(written, self.drawer.last_frame_bytes)
+        self.assertEqual(written, len(self.stream.getvalue()))
+
+
+class TestRasterizer(unittest.TestCase):
+    def random_triangles(self, count, size):
+        rng = np.random.default_rng(1)
+        vertices = np.column_stack((rng.uniform(-10, size + 10, (count * 3, 2)),
+                                    rng.uniform(1, 2, count * 3))).astype(np.float32)
+        return vertices, np.arange(count * 3).reshape(count, 3)
+
+    def test_chunking_does_not_change_result(self):
+        vertices, indices = self.random_triangles(50, 40)
+        colors = np.arange(50, dtype=np.uint8)
+        results = []
+        for max_fragments in (1, 500, rasterizer.MAX_FRAGMENTS):
+            depth = np.full((30, 40), np.inf, dtype=np.float32)
+            color = np.zeros((30, 40), dtype=np.uint8)
+            rasterizer.fill_triangles(depth, color, vertices, indices, colors, max_fragments)
+            results.append((depth, color))
+        for depth, color in results[1:]:
+            np.testing.assert_array_equal(depth, results[0][0])
+            np.testing.assert_array_equal(color, results[0][1])
+
+    def test_nearest_triangle_wins_in_one_call(self):
+        vertices = np.array([(-5, -5, 2), (20, -5, 2), (-5, 20, 2), (-5, -5, 1), (20, -5, 1), (-5, 20, 1)],
+                            dtype=np.float32)
+        depth = np.full((4, 4), np.inf, dtype=np.float32)
+        color = np.zeros((4, 4, 3), dtype=np.uint8)
+        written = rasterizer.fill_triangles(depth, color, vertices, np.array([[0, 1, 2], [3, 4, 5]]),
+                                            np.array([(255, 0, 0), (0, 255, 0)], dtype=np.uint8))
+        self.assertEqual(written, 16)
+        self.assertTrue(np.all(depth == 1))
+        self.assertTrue(np.all(color == (0, 255, 0)))
+
+    def test_gouraud_shading(self):
+        vertices = np.array([(0, 0, 1), (8, 0, 1), (0, 8, 1), (20, 0, 1), (30, 0, 1), (20, 8, 1)], dtype=np.float32)
+        shades = np.array([0, 1, 0, np.nan, np.nan, np.nan])
+        depth = np.full((10, 32), np.inf, dtype=np.float32)
+        color = np.zeros((10, 32, 3), dtype=np.uint8)
+        rasterizer.fill_triangles(depth, color, vertices, np.array([[0, 1, 2], [3, 4, 5]]),
+                                  np.array([(200, 100, 0), (10, 20, 30)], dtype=np.uint8), shades=shades)
+        np.testing.assert_array_equal(color[0, :9, 0], [200 * x // 8 for x in range(9)])  # Interpolated along x
+        np.testing.assert_array_equal(color[0, 4], (100, 50, 0))
+        np.testing.assert_array_equal(color[1, 20], (10, 20, 30))  # Flat triangle
+
+        palette = np.array([1, 2, 3, 4], dtype=np.uint8)
+        codes = np.zeros((10, 32), dtype=np.uint8)
+        depth.fill(np.inf)
+        rasterizer.fill_triangles(depth, codes, vertices, np.array([[0, 1, 2]]), np.array([9], dtype=np.uint8),
+                                  shades=shades, palette=palette)
+        self.assertEqual(codes[0, :9].tolist(), [1, 1, 2, 2, 3, 3, 4, 4, 4])
+
+    def test_codes_by_brightness(self):
+        brightness = np.linspace(0, 1, 101)
+        codes = ConsoleDrawer.get_codes_by_brightness(brightness)
+        self.assertEqual(bytes(codes).decode(), "".join(ConsoleDrawer.get_char_by_brightness(b) for b in brightness))
+
+
+class TestObjLoader(unittest.TestCase):
+    SOURCE = """# comment
+o Square
+
+v 0 0 0
+v 1 0 0
+v 1 1 0 1.0
+v 0 1 0
+vt 0 0
+vt 1 0
+vt 1 1
+vt 0 1
+vn 0 0 1
+s off
+f 1/1/1 2/2/1 3/3/1 4/4/1
+f -4//-1 -3//-1 -2//-1
+f 1 3 4
+"""
+
+    def load(self, source, chunk_size=obj_loader.CHUNK_SIZE):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "model.obj")
+            with open(path, "w") as file:
+                file.write(source)
+            return obj_loader.load_obj(path, chunk_size)
+
+    def test_statements_and_triangulation(self):
+        mesh = self.load(self.SOURCE)
+        self.assertEqual(mesh.vertices.shape, (4, 4))
+        self.assertEqual(mesh.indices.tolist(), [[0, 1, 2], [0, 2, 3], [0, 1, 2], [0, 2, 3]])
+        self.assertEqual(mesh.uvs.shape, (4, 2))
+        self.assertEqual(mesh.uv_indices.tolist(), [[0, 1, 2], [0, 2, 3], [-1, -1, -1], [-1, -1, -1]])
+        self.assertEqual(mesh.normals.tolist(), [[0, 0, 1]])
+        self.assertEqual(mesh.normal_indices.tolist(), [[0, 0, 0], [0, 0, 0], [0, 0, 0], [-1, -1, -1]])
+
+    def test_chunk_size_does_not_change_result(self):
+        expected = self.load(self.SOURCE)
+        for chunk_size in (1, 7, 64):
+            mesh = self.load(self.SOURCE.replace("\n", "\r\n"), chunk_size)
+            np.testing.assert_array_equal(mesh.vertices, expected.vertices)
+            np.testing.assert_array_equal(mesh.indices, expected.indices)
+            np.testing.assert_array_equal(mesh.uv_indices, expected.uv_indices)
+
+    def test_mesh_without_uvs_and_normals(self):
+        mesh = self.load("v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3")
+        self.assertEqual(mesh.indices.tolist(), [[0, 1, 2]])
+        self.assertIsNone(mesh.uvs)
+        self.assertIsNone(mesh.normals)
+
+    def test_inline_comments_and_indentation(self):
+        mesh = self.load("  v 0 0 0 # origin\n\tv 1 0 0\nv 0 1 0#\n  f 1 2 3  # triangle\n")
+        self.assertEqual(mesh.vertices[:, :3].tolist(), [[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+        self.assertEqual(mesh.indices.tolist(), [[0, 1, 2]])
+
+    def test_mixed_face_forms(self):
+        vertices = "".join(f"v {i} {i % 3} 0\n" for i in range(9))
+        mesh = self.load(vertices + "vt 0 0\nvt 1 0\nvt 1 1\nvn 0 0 1\nvn 0 1 0\nvn 1 0 0\n"
+                         "f 1/1 2/2 3/3\nf 4 5 6\nf 7//1 8//2 9//3\n")
+        self.assertEqual(mesh.indices.tolist(), [[0, 1, 2], [3, 4, 5], [6, 7, 8]])
+        self.assertEqual(mesh.uv_indices.tolist(), [[0, 1, 2], [-1, -1, -1], [-1, -1, -1]])
+        self.assertEqual(mesh.normal_indices.tolist(), [[-1, -1, -1], [-1, -1, -1], [0, 1, 2]])
+
+    def test_invalid_face_references(self):
+        for source in ("v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 4", "v 0 0 0\nv 1 0 0\nf -3 1 2",
+                       "v 0 0 0\nv 1 0 0\nv 0 1 0\nvt 0 0\nf 1/1 2/1 3/2"):
+            with self.subTest(source=source):
+                self.assertRaises(ValueError, self.load, source)
+
+
+class TestMeshCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "model.obj")
+        with open(self.path, "w") as file:
+            file.write(TestObjLoader.SOURCE)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load_without_parsing(self):
+        with mock.patch.object(obj_loader.ObjParser, "parse_file", side_effect=AssertionError("parsed")):
+            return mesh_cache.load_obj_cached(self.path)
+
+    def test_cache_is_created_and_used(self):
+        expected = obj_loader.load_obj(self.path)
+        mesh = mesh_cache.load_obj_cached(self.path)
+        self.assertTrue(os.path.exists(mesh_cache.get_cache_path(self.path)))
+        mesh = self.load_without_parsing()
+        for name in mesh_cache.ARRAY_NAMES:
+            np.testing.assert_array_equal(getattr(mesh, name), getattr(expected, name))
+
+    def test_touched_source_is_checked_by_hash(self):
+        mesh_cache.load_obj_cached(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.load_without_parsing()
+
+    def test_changed_source_invalidates_cache(self):
+        mesh_cache.load_obj_cached(self.path)
+        with open(self.path, "a") as file:
+            file.write("v 5 5 5\n")
+        mesh = mesh_cache.load_obj_cached(self.path)
+        self.assertEqual(len(mesh.vertices), 5)
+        self.assertEqual(len(self.load_without_parsing().vertices), 5)
+
+    def test_cache_of_other_parser_version_is_rebuilt(self):
+        mesh_cache.load_obj_cached(self.path)
+        with mock.patch.object(obj_loader, "PARSER_VERSION", obj_loader.PARSER_VERSION + 1):
+            self.assertRaisesRegex(AssertionError, "parsed", self.load_without_parsing)
+            mesh_cache.load_obj_cached(self.path)
+            self.load_without_parsing()
+
+    def test_broken_cache_is_rewritten(self):
+        with open(mesh_cache.get_cache_path(self.path), "wb") as file:
+            file.write(b"garbage")
+        mesh = mesh_cache.load_obj_cached(self.path)
+        self.assertEqual(len(mesh.vertices), 4)
+        self.load_without_parsing()
+
+
+class TestSceneGraph(unittest.TestCase):
+    def transform_point(self, node, x, y, z):
+        v = Vector3D(x, y, z).mul_by_matrix(node.get_world_matrix())
+        return v.x, v.y, v.z
+
+    def test_child_follows_parent(self):
+        parent = SceneNode()
+        child = SceneNode()
+        parent.add_child(child)
+        parent.x = 10
+        parent.scale = 2
+        child.y = 1
+        for actual, expected in zip(self.transform_point(child, 1, 0, 0), (12, 2, 0)):
+            self.assertAlmostEqual(actual, expected)
+
+        parent.y_rot = 90
+        for actual, expected in zip(self.transform_point(child, 1, 0, 0), (10, 2, -2)):
+            self.assertAlmostEqual(actual, expected)
+
+    def test_matrices_are_written_in_place(self):
+        parent = SceneNode()
+        child = SceneNode()
+        parent.add_child(child)
+        local, world, child_world = parent.get_local_matrix(), parent.get_world_matrix(), child.get_world_matrix()
+        self.assertIsNot(local, world)  # Root has its own world matrix
+        parent.x = 5
+        child.z = 2
+        self.assertIs(parent.get_local_matrix(), local)
+        self.assertIs(parent.get_world_matrix(), world)
+        self.assertIs(child.get_world_matrix(), child_world)
+        self.assertEqual(self.transform_point(child, 0, 0, 0), (5, 0, 2))
+
+    def test_matrices_are_cached(self):
+        parent = SceneNode()
+        child = SceneNode()
+        sibling = SceneNode()
+        parent.add_child(child)
+        parent.add_child(sibling)
+        for node in parent.walk():
+            node.get_world_matrix()
+        versions = [node.world_version for node in parent.walk()]
+        for node in parent.walk():
+            node.get_world_matrix()
+        self.assertEqual([node.world_version for node in parent.walk()], versions)
+
+        sibling.z = 5
+        for node in parent.walk():
+            node.get_world_matrix()
+        self.assertEqual([node.world_version for node in parent.walk()], [versions[0], versions[1], versions[2] + 1])
+
+        parent.x = 1
+        for node in parent.walk():
+            node.get_world_matrix()
+        self.assertEqual([node.world_version for node in parent.walk()],
+                         [versions[0] + 1, versions[1] + 1, versions[2] + 2])
+
+    def test_object_transform_matrix_matches_direct_product(self):
+        obj = models.Cube()
+        obj.set_pos(1, 2, -30)
+        obj.set_rotation(10, 20, 30)
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        expected = Matrix4x4.get_scale(100, 100, 100)
+        for matrix in (Matrix4x4.get_rotate_x(10), Matrix4x4.get_rotate_y(20), Matrix4x4.get_rotate_z(30),
+                       Matrix4x4.get_translation(1, 2, -30), camera.get_camera_matrix()):
+            expected = Matrix4x4.multiply(expected, matrix)
+        np.testing.assert_allclose(obj.get_transform_matrix(camera)._values, expected._values)
+
+    def test_camera_matrix_is_rebuilt_lazily(self):
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        version = camera.matrix_version
+        for _ in range(6):
+            camera.move_by(Vector3D(0, 0, -2))
+        self.assertEqual(camera.matrix_version, version)
+        matrix = camera.get_camera_matrix()
+        camera.get_camera_matrix()
+        self.assertEqual(camera.matrix_version, version + 1)
+        self.assertAlmostEqual(Vector3D(0, 0, -12).mul_by_matrix(matrix).w, 0)
+
+
+class TestFrustumCulling(unittest.TestCase):
+    def setUp(self):
+        self.camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        self.cube = models.Cube()
+        self.cube.set_scale(10)
+
+    def check(self, x, y, z):
+        self.cube.set_pos(x, y, z)
+        return self.cube.is_in_frustum(self.camera)
+
+    def test_bounding_volumes(self):
+        mesh = models.CutPyramid().mesh
+        box_min, box_max = mesh.get_bounding_box()
+        np.testing.assert_allclose(box_min, (-1, -1, -1))
+        np.testing.assert_allclose(box_max, (1, 1, 1))
+        center, radius = mesh.get_bounding_sphere()
+        np.testing.assert_allclose(center, (0, 0, 0))
+        self.assertAlmostEqual(radius, 3 ** 0.5, places=6)
+
+        self.cube.set_pos(5, 0, 0)
+        center, radius, box_min, box_max = self.cube.get_world_bounds()
+        np.testing.assert_allclose(center, (5, 0, 0))
+        self.assertAlmostEqual(radius, 10 * 3 ** 0.5, places=4)
+        np.testing.assert_allclose(box_min, (-5, -10, -10))
+        np.testing.assert_allclose(box_max, (15, 10, 10))
+
+    def test_objects_inside_and_outside(self):
+        self.assertTrue(self.check(0, 0, -100))
+        self.assertTrue(self.check(105, 0, -100))  # Partly visible at the right edge
+        self.assertFalse(self.check(0, 0, 100))  # Behind the camera
+        self.assertFalse(self.check(300, 0, -100))
+        self.assertFalse(self.check(0, -300, -100))
+        self.assertFalse(self.check(0, 0, -2000))  # Beyond the far plane
+
+    def test_frustum_follows_camera(self):
+        self.assertFalse(self.check(0, 0, 100))
+        self.camera.move_by(Vector3D(0, 0, 200))
+        self.assertTrue(self.check(0, 0, 100))
+
+    def test_bounds_follow_replaced_geometry(self):
+        self.assertFalse(self.check(300, 0, -100))
+        # Geometry moved into view without touching the position
+        shifted = Mesh(self.cube.mesh.vertices[:, :3] - (30, 0, 0), self.cube.mesh.indices)
+        self.cube.polygons = shifted.get_polygons()
+        self.assertTrue(self.cube.is_in_frustum(self.camera))
+        self.cube.mesh = Mesh(self.cube.mesh.vertices[:, :3] + (30, 0, 0), self.cube.mesh.indices)
+        self.assertFalse(self.cube.is_in_frustum(self.camera))
+
+    def test_invisible_object_is_not_transformed(self):
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(20, 10)
+        self.cube.set_pos(0, 0, 100)
+        with mock.patch.object(Object3D, "transform_vertices", side_effect=AssertionError("transformed")):
+            self.cube.draw_console(drawer, self.camera)
+
+
+class TestBVH(unittest.TestCase):
+    def setUp(self):
+        self.camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        self.cubes = []
+        for i in range(20):
+            cube = models.Cube()
+            cube.set_scale(5)
+            cube.set_pos(i * 50 - 500, 0, -100)
+            self.cubes.append(cube)
+        self.tree = bvh.ObjectBVH(self.cubes)
+
+    def test_frustum_query_matches_flat_culling(self):
+        visible = self.tree.query_frustum(self.camera.get_frustum_planes())
+        expected = [cube for cube in self.cubes if cube.is_in_frustum(self.camera)]
+        self.assertTrue(0 < len(expected) < len(self.cubes))
+        self.assertCountEqual(visible, expected)
+
+    def test_box_query_and_refit(self):
+        box_min = np.array([-10, -10, -110])
+        box_max = np.array([10, 10, -90])
+        self.assertEqual(self.tree.query_box(box_min, box_max), [self.cubes[10]])
+        self.cubes[0].set_pos(0, 0, -100)
+        self.assertEqual(self.tree.refit(), 1)
+        self.assertEqual(self.tree.refit(), 0)
+        self.assertCountEqual(self.tree.query_box(box_min, box_max), [self.cubes[0], self.cubes[10]])
+
+    def test_pick(self):
+        scale_x, scale_y = self.camera.get_projection_scale()
+        origin, direction = self.camera.get_ray(10, 5, 10, 10, 10, 5)  # Center of 20x10 screen
+        np.testing.assert_allclose(origin, (0, 0, 0))
+        np.testing.assert_allclose(direction / np.linalg.norm(direction), (0, 0, -1), atol=1e-9)
+
+        hit = self.tree.pick(self.camera, 10, 5, 10, 10, 10, 5)
+        self.assertIs(hit.obj, self.cubes[10])
+        self.assertAlmostEqual(hit.point[2], -95)
+        polygon = hit.obj.mesh.get_polygon(hit.triangle)
+        self.assertTrue(all(point.z == 1 for point in polygon.points))  # Front face of the cube
+
+        # Point projected to the screen gives ray through it
+        x, y = 50 / 100 * scale_x * 10 + 10, 0 + 5
+        hit = self.tree.pick(self.camera, x, y, 10, 10, 10, 5)
+        self.assertIs(hit.obj, self.cubes[11])
+        self.assertIsNone(self.tree.ray_cast(np.zeros(3), np.array([0, 1.0, 0])))
+
+    def test_mesh_bvh_matches_brute_force(self):
+        rng = np.random.default_rng(1)
+        vertices = rng.uniform(-1, 1, (300, 3))
+        indices = rng.integers(0, 300, (200, 3))
+        mesh_bvh = bvh.MeshBVH(vertices, indices)
+        for _ in range(20):
+            origin = rng.uniform(-2, 2, 3)
+            direction = rng.uniform(-1, 1, 3)
+            distances = bvh.ray_triangle_distances(origin, direction, vertices[indices])
+            hit = mesh_bvh.ray_cast(origin, direction)
+            if np.isinf(distances.min()):
+                self.assertIsNone(hit)
+            else:
+                self.assertAlmostEqual(hit[1], distances.min())
+
+
+class TestLOD(unittest.TestCase):
+    @staticmethod
+    def make_sphere(n):
+        theta, phi = np.meshgrid(np.linspace(0, np.pi, n), np.linspace(0, 2 * np.pi, n), indexing="ij")
+        points = np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], axis=-1)
+        grid = np.arange(n * n).reshape(n, n)[:-1, :-1].reshape(-1)
+        indices = np.concatenate([np.stack([grid, grid + n, grid + 1], axis=1),
+                                  np.stack([grid + 1, grid + n, grid + n + 1], axis=1)])
+        return Mesh(points.reshape(-1, 3), indices)
+
+    def test_simplify(self):
+        mesh = self.make_sphere(40)
+        vertices, indices = lod.simplify(mesh.vertices, mesh.indices, 500)
+        self.assertTrue(100 < len(indices) <= 500)
+        self.assertEqual(vertices.shape[1], 4)
+        self.assertLess(np.abs(np.linalg.norm(vertices[:, :3], axis=1) - 1).max(), 0.05)
+        self.assertTrue((indices < len(vertices)).all())
+
+    def test_chain_and_selection(self):
+        mesh = self.make_sphere(40)
+        meshes = mesh.get_lod_meshes(4)
+        self.assertIs(meshes[0], mesh)
+        self.assertIs(mesh.get_lod_meshes(4)[1], meshes[1])  # Chain is cached
+        counts = [m.get_face_count() for m in meshes]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertEqual(lod.select_level(counts, 1000), 0)
+        self.assertEqual(lod.select_level(counts, 0.1), len(counts) - 1)
+        self.assertGreaterEqual(lod.select_level(counts, 10, bias=4), lod.select_level(counts, 10))
+
+    def test_levels_keep_texture_coordinates(self):
+        sphere = self.make_sphere(20)
+        mesh = Mesh(sphere.vertices, sphere.indices, sphere.vertices[:, :2], sphere.indices)
+        level = mesh.get_lod_meshes(2)[1]
+        self.assertIs(level.uvs, mesh.uvs)
+        self.assertEqual(level.uv_indices.shape, level.indices.shape)
+        # Texture coordinates stay close to the moved vertices, as both come from the same part of the sphere
+        self.assertLess(np.abs(level.get_corner_uvs() - level.vertices[level.indices, :2]).max(), 0.3)
+
+    def test_levels_are_cached_next_to_mesh_cache(self):
+        sphere = self.make_sphere(20)
+        lines = [f"v {x} {y} {z}" for x, y, z, _ in sphere.vertices.tolist()]
+        lines += [f"vt {x} {y}" for x, y, _, _ in sphere.vertices.tolist()]
+        lines += ["f " + " ".join(f"{i + 1}/{i + 1}" for i in face) for face in sphere.indices.tolist()]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sphere.obj")
+            with open(path, "w") as file:
+                file.write("\n".join(lines))
+            obj = models.FileObject(path)
+            obj.enable_lod(3)
+            self.assertEqual(len(obj.lod_meshes), 3)
+            self.assertTrue(os.path.exists(mesh_cache.get_lod_cache_path(path, 2)))
+
+            with mock.patch("lod.build_chain", side_effect=AssertionError("built")):
+                cached = models.FileObject(path)
+                cached.enable_lod(3)
+            for level, expected in zip(cached.lod_meshes[1:], obj.lod_meshes[1:]):
+                np.testing.assert_array_equal(level.vertices, expected.vertices)
+                np.testing.assert_array_equal(level.uv_indices, expected.uv_indices)
+
+            with mock.patch.object(lod, "VERSION", lod.VERSION + 1):
+                rebuilt = models.FileObject(path)
+                with mock.patch("lod.build_chain", wraps=lod.build_chain) as build_chain:
+                    rebuilt.enable_lod(3)
+                build_chain.assert_called_once()
+
+    def test_object_uses_coarser_level_when_far(self):
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        obj = Object3D(self.make_sphere(40))
+        obj.set_scale(10)
+        obj.enable_lod()
+        obj.set_pos(0, 0, -15)
+        self.assertEqual(obj.select_lod(camera, 40, 40), 0)
+        obj.set_pos(0, 0, -900)
+        level = obj.select_lod(camera, 40, 40)
+        self.assertGreater(level, 0)
+        _, faces, _ = obj.get_visible_faces(camera, 40, 40, 80, 80)
+        self.assertLessEqual(faces.max(initial=0), obj.get_render_mesh().get_face_count())
+        self.assertEqual(len(obj.transform_vertices(camera)), obj.get_render_mesh().get_vertex_count())
+
+    def test_projected_radius(self):
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        # fov 90: sphere of radius 1 at distance 10 covers a tenth of half of the screen
+        self.assertAlmostEqual(camera.get_projected_radius(np.array([0, 0, -10]), 1, 40, 20), 4)
+        self.assertEqual(camera.get_projected_radius(np.array([0, 0, 0.5]), 1, 40, 20), float("inf"))
+
+
+class TestInstancing(unittest.TestCase):
+    def setUp(self):
+        self.camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        self.mesh = models.Cube().mesh
+        self.group = instancing.InstancedObject(self.mesh, capacity=2)
+        self.objects = []
+        for i in range(5):
+            position, rotation = (i * 30 - 60, i * 5, -150 - i * 10), (i * 10, i * 20, i * 7)
+            self.group.add_instance(*position, *rotation, scale=10)
+            obj = Object3D(self.mesh)
+            obj.set_pos(*position)
+            obj.set_rotation(*rotation)
+            obj.set_scale(10)
+            self.objects.append(obj)
+
+    def test_compose_transforms(self):
+        np.testing.assert_allclose(self.group.get_instance_matrices()[3],
+                                   self.objects[3].get_world_matrix()._values, atol=1e-9)
+
+    def test_renders_like_separate_objects(self):
+        expected = ConsoleDrawer(io.StringIO())
+        expected.set_size(80, 40)
+        for obj in self.objects:
+            obj.draw_console(expected, self.camera)
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(80, 40)
+        self.group.draw_console(drawer, self.camera)
+        self.assertGreater((drawer.surface != ord(" ")).sum(), 50)
+        self.assertGreater((drawer.surface == expected.surface).mean(), 0.99)
+
+    def test_groups_bound_buffers(self):
+        expected = ConsoleDrawer(io.StringIO())
+        expected.set_size(80, 40)
+        self.group.draw_console(expected, self.camera)
+        group = instancing.InstancedObject(self.mesh)
+        group.add_instances(self.group.positions[:5], self.group.rotations[:5], 10)
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(80, 40)
+        with mock.patch.object(instancing, "BATCH_VERTICES", 2 * len(self.mesh.vertices)):
+            group.draw_console(drawer, self.camera)
+        np.testing.assert_array_equal(drawer.surface, expected.surface)
+        self.assertEqual(len(group._transformed_vertices), 2 * len(self.mesh.vertices))
+        self.assertEqual(len(group._indices), 2 * len(self.mesh.indices))
+
+    def test_shading_uses_face_normals(self):
+        _, indices, brightness = self.group.get_visible_faces(self.camera, 40, 20, 80, 40, sort=False)
+        _, faces, expected = self.objects[0].get_visible_faces(self.camera, 40, 20, 80, 40, sort=False)
+        count = len(faces)
+        self.assertGreater(count, 0)
+        np.testing.assert_array_equal(indices[:count], self.mesh.indices[faces])
+        np.testing.assert_allclose(brightness[:count], expected[faces], atol=1e-5)
+
+    def test_culling_update_and_removal(self):
+        self.group.add_instance(0, 0, 500)  # Behind the camera
+        matrices = self.group.get_instance_matrices()
+        np.testing.assert_array_equal(self.group.get_visible_instances(self.camera, matrices), range(5))
+
+        self.group.velocities[:self.group.count] = (1, 0, 0)
+        self.group.update()
+        np.testing.assert_allclose(self.group.positions[0], (-59, 0, -150))
+
+        self.group.remove_instance(0)
+        self.assertEqual(self.group.count, 5)
+        np.testing.assert_allclose(self.group.positions[0], (1, 0, 500))
+
+
+class TestTiledRasterizer(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        centers = rng.uniform(0, 100, (60, 1, 2))
+        self.vertices = np.concatenate([centers + rng.uniform(-15, 15, (60, 3, 2)),
+                                        rng.uniform(0, 1, (60, 3, 1))], axis=2).reshape(-1, 3).astype(np.float32)
+        self.indices = np.arange(180).reshape(-1, 3)
+        self.colors = rng.integers(1, 255, 60).astype(np.uint8)
+        self.depth = np.full((70, 100), np.inf, dtype=np.float32)
+        self.color = np.zeros((70, 100), dtype=np.uint8)
+        self.written = rasterizer.fill_triangles(self.depth, self.color, self.vertices, self.indices, self.colors)
+
+    def check(self, workers):
+        with tiled_rasterizer.TiledRasterizer(100, 70, workers=workers, tile_size=16) as tiled:
+            written = tiled.fill_triangles(self.vertices, self.indices, self.colors)
+            np.testing.assert_array_equal(tiled.color_buffer, self.color)
+            np.testing.assert_array_equal(tiled.depth_buffer, self.depth)
+            self.assertEqual(written, self.written)
+
+    def test_same_as_rasterizer(self):
+        self.check(1)
+
+    def test_worker_processes(self):
+        self.check(2)
+
+    def test_shades(self):
+        shades = np.random.default_rng(4).uniform(0, 1, len(self.vertices))
+        palette = np.arange(100, 164, dtype=np.uint8)
+        depth = np.full((70, 100), np.inf, dtype=np.float32)
+        color = np.zeros((70, 100), dtype=np.uint8)
+        rasterizer.fill_triangles(depth, color, self.vertices, self.indices, self.colors, shades=shades,
+                                  palette=palette)
+        with tiled_rasterizer.TiledRasterizer(100, 70, workers=1, tile_size=16) as tiled:
+            tiled.fill_triangles(self.vertices, self.indices, self.colors, shades, palette)
+            np.testing.assert_array_equal(tiled.color_buffer, color)
+
+    def test_empty_tiles_are_skipped(self):
+        with tiled_rasterizer.TiledRasterizer(100, 70, workers=1, tile_size=16) as tiled:
+            points = np.array([[[1, 1, 0], [20, 1, 0], [1, 5, 0]]], dtype=np.float64)
+            tiles, starts, triangles = tiled.bin_triangles(points)
+            np.testing.assert_array_equal(tiles, [0, 1])
+            np.testing.assert_array_equal(triangles, [0, 0])
+
+    def test_console_drawer(self):
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(30, 20)
+        drawer.enable_tiled_rendering(workers=1, tile_size=8)
+        drawer.fill_triangle((0, 0, 0), (29, 0, 0), (0, 19, 0), "#")
+        drawer.set_size(40, 20)
+        drawer.fill_triangle((0, 0, 0), (39, 0, 0), (0, 19, 0), "#")
+        self.assertEqual(drawer.surface[0, 35], ord("#"))
+        self.assertEqual(drawer.surface[19, 39], ord(" "))
+        drawer.disable_tiled_rendering()
+        self.assertEqual(drawer.surface.shape, (20, 40))
+
+
+class TestFrameLoop(unittest.TestCase):
+    def test_pacer_sleeps_until_deadline(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+        pacer = frame_loop.FramePacer(10, clock=lambda: now[0], sleep=sleep)
+        pacer.wait()
+        now[0] += 0.03  # Frame took 30 ms
+        pacer.wait()
+        now[0] += 0.05
+        pacer.wait()
+        np.testing.assert_allclose(sleeps, [0.1, 0.07, 0.05])
+        now[0] += 0.5  # Much too late: no sleep, next deadline is counted from now
+        self.assertLess(pacer.wait(), 0)
+        now[0] += 0.02
+        pacer.wait()
+        self.assertAlmostEqual(sleeps[-1], 0.08)
+
+    def test_frame_state_records_triangles(self):
+        state = frame_loop.FrameState()
+        state.clear(10, 5)
+        vertices = np.zeros((3, 3), dtype=np.float32)
+        state.fill_triangles(vertices, [[0, 1, 2]], [1])
+        vertices += 1  # Caller reuses its buffer
+        state.fill_triangles(vertices, [[2, 1, 0]], [2])
+        screen_vertices, indices, colors = state.get_triangles()
+        np.testing.assert_array_equal(indices, [[0, 1, 2], [5, 4, 3]])
+        np.testing.assert_array_equal(screen_vertices[:, 0], [0, 0, 0, 1, 1, 1])
+        np.testing.assert_array_equal(colors, [1, 2])
+
+        cube = models.Cube()
+        cube.set_scale(2)
+        cube.set_pos(0, 0, -10)
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        state.clear(20, 20)
+        cube.draw_console(state, camera)
+        self.assertGreater(len(state.get_triangles()[1]), 0)
+
+    def test_stages_overlap(self):
+        rendering = threading.Event()
+        overlapped = []
+        prepared = []
+
+        def prepare(state):
+            overlapped.append(rendering.wait(0.2))
+            prepared.append(state)
+
+        def render(state):
+            rendering.set()
+            time.sleep(0.01)  # Next frame is prepared meanwhile
+            rendering.clear()
+        loop = frame_loop.PipelinedFrameLoop(prepare, render, fps=None)
+        self.assertEqual(loop.run(frames=5), 5)
+        self.assertTrue(all(overlapped[1:5]))
+        self.assertEqual(len({id(state) for state in prepared}), 2)  # Double buffering
+
+    def test_errors_and_stopping(self):
+        def fail(state):
+            raise ValueError("prepare failed")
+        with self.assertRaises(ValueError):
+            frame_loop.PipelinedFrameLoop(fail, lambda state: None, fps=None).run()
+        loop = frame_loop.PipelinedFrameLoop(lambda state: None, lambda state: False, fps=None)
+        self.assertEqual(loop.run(), 0)
+        counter = iter(range(3))
+        loop = frame_loop.PipelinedFrameLoop(lambda state: next(counter, None) is not None, lambda state: None,
+                                             fps=None)
+        self.assertEqual(loop.run(), 3)
+
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.moving = models.Cube()
+        self.moving.set_pos(1, 2, 3)
+        self.moving.set_speed(60, 0, -30)
+        self.moving.set_rotation_speed(0, 90, 0)
+        self.still = models.Cube()
+        self.simulation = simulation.Simulation([self.moving, self.still], dt=0.1, max_steps=3)
+
+    def test_fixed_steps_and_interpolation(self):
+        alpha = self.simulation.advance(0.25)  # Two steps and a half
+        self.assertAlmostEqual(alpha, 0.5)
+        self.assertAlmostEqual(self.simulation.time, 0.2)
+        np.testing.assert_allclose(self.simulation.current[0], (13, 2, -3, 0, 18, 0))
+        np.testing.assert_allclose(self.simulation.previous[0], (7, 2, 0, 0, 9, 0))
+        self.simulation.apply(alpha)
+        self.assertAlmostEqual(self.moving.x, 10)
+        self.assertAlmostEqual(self.moving.y_rot, 13.5)
+
+        # Speed does not depend on how time is split between frames
+        for _ in range(10):
+            self.simulation.advance(0.005)
+        self.assertAlmostEqual(self.simulation.current[0, 0], 19)
+        self.simulation.apply(self.simulation.advance(0))
+        self.assertAlmostEqual(self.moving.x, 13)  # Interpolated states are one step behind
+
+    def test_still_objects_keep_matrices(self):
+        self.still.get_world_matrix()
+        version = self.still.world_version
+        self.simulation.apply(self.simulation.advance(0.35))
+        self.still.get_world_matrix()
+        self.assertEqual(self.still.world_version, version)
+
+    def test_object_update_scales_by_time(self):
+        self.moving.update(0.1)
+        self.moving.update(0.15)
+        self.assertAlmostEqual(self.moving.x, 16)
+        self.assertAlmostEqual(self.moving.z, -4.5)
+        self.assertAlmostEqual(self.moving.y_rot, 22.5)
+
+    def test_frame_skipping_drops_time(self):
+        self.simulation.advance(1.0)  # Ten steps are due, only three are done
+        self.assertAlmostEqual(self.simulation.time, 0.3)
+        self.assertAlmostEqual(self.simulation.dropped_time, 0.7)
+
+    def test_drawing_does_not_move_objects(self):
+        camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(20, 10)
+        self.moving.set_pos(0, 0, -500)
+        self.moving.draw_console(drawer, camera)
+        self.assertEqual((self.moving.x, self.moving.y_rot), (0, 0))
+
+    def test_loop_skips_late_frames(self):
+        rendered = []
+
+        def render(state):
+            rendered.append(state.frame)
+            if state.frame == 1:
+                time.sleep(0.05)  # Three frame periods late
+        loop = frame_loop.PipelinedFrameLoop(lambda state: None, render, fps=60)
+        loop.run(frames=4)
+        self.assertEqual(loop.skipped_frames, 2)
+        self.assertEqual(rendered[:3], [0, 1, 4])
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_generated_meshes(self):
+        mesh = models.make_sphere_mesh(4, 8)
+        self.assertEqual(mesh.get_face_count(), 2 * 8 * 3)
+        self.assertEqual(mesh.get_vertex_count(), 2 + 3 * 8)
+        self.assertTrue(0.9 < benchmark.load_mesh("2k").get_face_count() / 2000 < 1.1)
+
+    def test_report_and_compare(self):
+        report = benchmark.run(["cube", "1k"], ["40x20"], [1, 4], frames=2, log=None)
+        self.assertEqual(len(report["results"]), 4)
+        result = report["results"][-1]
+        self.assertEqual((result["mesh"], result["objects"]), ("1k", 4))
+        self.assertEqual(set(result["stages_ms"]), set(benchmark.STAGES))
+        self.assertGreater(result["counters"]["cells_written"], 0)
+        self.assertGreater(result["peak_frame_memory_bytes"], 0)
+
+        self.assertEqual(benchmark.compare(report, report), [])
+        slower = {"results": [dict(r, fps=r["fps"] / 2) for r in report["results"]]}
+        self.assertEqual(len(benchmark.compare(slower, report)), 4)
+
+    def test_model_is_found_from_other_directory(self):
+        expected = benchmark.load_mesh("untitled")
+        directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as other:
+            os.chdir(other)
+            try:
+                mesh = benchmark.load_mesh("untitled")
+            finally:
+                os.chdir(directory)
+        np.testing.assert_array_equal(mesh.indices, expected.indices)
+
+    def test_stages_come_from_draw_path(self):
+        result = benchmark.run(["cube"], ["40x20"], [1], frames=2, sort=True, log=None)["results"][0]
+        self.assertFalse(telemetry.profiler.enabled)
+        self.assertGreater(result["stages_ms"]["sort"], 0)
+        counters = result["counters"]
+        self.assertEqual(counters["triangles_submitted"], 12)
+        self.assertEqual(counters["triangles_culled"] + counters["triangles_rasterized"], 12)
+
+
+class TestPygameDrawer(unittest.TestCase):
+    def setUp(self):
+        self.camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        self.cube = models.Cube()
+        self.cube.set_scale(1)
+        self.cube.set_pos(0, 0, -5)
+        self.cube.set_rotation(20, 30, 0)
+
+    def test_same_coverage_as_console(self):
+        drawer = PygameDrawer(40, 30)
+        self.cube.draw(drawer, (255, 128, 0), self.camera)
+        console = ConsoleDrawer(io.StringIO())
+        console.set_size(40, 30)
+        # Pygame scales y by half of the width too
+        screen_vertices, faces, brightness = self.cube.get_visible_faces(self.camera, 20, 20, 40, 30, sort=False)
+        console.fill_triangles(screen_vertices, self.cube.mesh.indices[faces], np.full(len(faces), ord("#")))
+        np.testing.assert_array_equal(drawer.depth, console.depth)
+        covered = drawer.depth != np.inf
+        self.assertTrue(covered.any())
+        self.assertTrue((drawer.color[covered, 2] == 0).all())  # Color of the object is kept
+        self.assertTrue((drawer.color[covered, 0] >= drawer.color[covered, 1]).all())
+        self.assertTrue((drawer.color[~covered] == 0).all())
+
+    def test_present(self):
+        drawer = PygameDrawer(6, 4, background=(10, 20, 30))
+        drawer.fill_triangles(np.array([[0, 0, 0], [5, 0, 0], [0, 3, 0]], dtype=np.float32), np.array([[0, 1, 2]]),
+                              np.array([[200, 100, 50]], dtype=np.uint8))
+        surface = pygame.Surface((6, 4))
+        drawer.present(surface)
+        self.assertEqual(tuple(surface.get_at((0, 0)))[:3], (200, 100, 50))
+        self.assertEqual(tuple(surface.get_at((5, 3)))[:3], (10, 20, 30))
+        np.testing.assert_array_equal(pygame.surfarray.array3d(surface).transpose(1, 0, 2), drawer.color)
+
+    def test_tiled(self):
+        drawer = PygameDrawer(40, 30)
+        drawer.enable_tiled_rendering(workers=1, tile_size=8)
+        self.cube.draw(drawer, (255, 255, 255), self.camera)
+        expected = PygameDrawer(40, 30)
+        self.cube.draw(expected, (255, 255, 255), self.camera)
+        np.testing.assert_array_equal(drawer.color, expected.color)
+        drawer.disable_tiled_rendering()
+        self.assertEqual(drawer.color.shape, (30, 40, 3))
+
+    def test_polygon_draw_keeps_points(self):
+        polygon = Polygon([Vector3D(-1, -1, 0, -2), Vector3D(1, -1, 0, -2), Vector3D(0, 1, 0, -2)])
+        surface = pygame.Surface((20, 20))
+        polygon.draw(surface, (0, 255, 0))
+        self.assertEqual(polygon.points[0].x, -1)
+        red, green, blue = tuple(surface.get_at((10, 10)))[:3]
+        self.assertEqual((red, blue), (0, 0))
+        self.assertGreater(green, 0)
+
+
+class TestTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.profiler = telemetry.Profiler(history_size=4)
+        self.camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+        self.cube = models.Cube()
+        self.cube.set_scale(1)
+        self.cube.set_pos(0, 0, -5)
+        self.cube.set_rotation(20, 30, 0)
+
+    def draw_frame(self):
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(40, 20)
+        with mock.patch("objects.profiler", self.profiler), mock.patch("console_drawer.profiler", self.profiler):
+            self.cube.draw_console(drawer, self.camera)
+            drawer.print_surface()
+        return drawer
+
+    def test_disabled(self):
+        self.assertIs(self.profiler.stage("raster"), self.profiler.stage("cull"))
+        self.draw_frame()
+        self.profiler.end_frame()
+        self.assertEqual(self.profiler.counters, {})
+        self.assertEqual(self.profiler.stage_times, {})
+        self.assertEqual(self.profiler.frame, 0)
+
+    def test_stages_and_counters(self):
+        frames = []
+        self.profiler.add_sink(frames.append)
+        self.profiler.enable()
+        drawer = self.draw_frame()
+        self.profiler.end_frame()
+        stats = frames[0]
+        self.assertEqual(set(stats["stages_ms"]), {"transform", "cull", "raster", "present"})
+        counters = stats["counters"]
+        self.assertEqual(counters["triangles_submitted"], 12)
+        self.assertEqual(counters["triangles_culled"] + counters["triangles_rasterized"], 12)
+        self.assertGreater(counters["triangles_rasterized"], 0)
+        self.assertEqual(counters["cells_written"], np.count_nonzero(drawer.surface != ord(" ")))
+        self.assertEqual(counters["bytes_presented"], drawer.last_frame_bytes)
+        self.assertEqual(self.profiler.counters, {})  # Next frame starts empty
+
+    def test_frame_scopes(self):
+        frames = []
+        self.profiler.add_sink(frames.append)
+        self.profiler.enable()
+        with self.profiler.frame_scope(1):  # Next frame prepared while frame 0 is rendered
+            self.profiler.count("prepared")
+        self.profiler.count("rendered")
+        self.profiler.end_frame(0)
+        with self.profiler.frame_scope(2):  # Frame 1 is skipped, its statistics are dropped with frame 2 closed
+            self.profiler.count("prepared")
+        self.profiler.end_frame(2)
+        self.assertEqual([stats["frame"] for stats in frames], [0, 2])
+        self.assertEqual([stats["counters"] for stats in frames], [{"rendered": 1}, {"prepared": 1}])
+        self.assertEqual(self.profiler._frames, {})
+
+    def test_counting_from_threads(self):
+        self.profiler.enable()
+
+        def work():
+            for _ in range(10000):
+                self.profiler.count("cells_written")
+                self.profiler.add_time("raster", 1)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.profiler.counters, {"cells_written": 40000})
+        self.assertEqual(self.profiler.stage_times, {"raster": 40000})
+
+    def test_frame_loop_separates_frames(self):
+        frames = []
+        self.profiler.add_sink(frames.append)
+        self.profiler.enable()
+
+        def render(state):
+            self.profiler.count("rendered")
+            time.sleep(0.002)  # Next frame is prepared meanwhile
+        with mock.patch("frame_loop.profiler", self.profiler):
+            loop = frame_loop.PipelinedFrameLoop(lambda state: self.profiler.count("prepared"), render, fps=None)
+            loop.run(frames=5)
+        self.assertEqual([stats["frame"] for stats in frames], list(range(5)))
+        for stats in frames:
+            self.assertEqual(stats["counters"], {"prepared": 1, "rendered": 1})
+
+    def test_json_lines_are_flushed_and_closed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stats.jsonl")
+            with mock.patch("atexit.register") as register:
+                writer = telemetry.JsonLinesWriter(path)
+            register.assert_called_once_with(writer.close)
+            writer({"frame": 0})
+            with open(path) as file:
+                self.assertEqual(json.loads(file.read()), {"frame": 0})  # Readable before the writer is closed
+            writer.close()
+            self.assertTrue(writer.file.closed)
+
+    def test_percentiles(self):
+        self.profiler._history_count = 6  # Ring buffer is full
+        self.profiler._history[:] = [0.01, 0.02, 0.03, 0.04]
+        percentiles = self.profiler.get_percentiles()
+        self.assertAlmostEqual(percentiles["p50"], 25)
+        self.assertTrue(38 < percentiles["p95"] < percentiles["p99"] <= 40)
+        counts, edges = self.profiler.get_histogram(bins=2)
+        self.assertEqual(counts.tolist(), [2, 2])
+        self.assertAlmostEqual(edges[0], 10)
+
+    def test_sinks(self):
+        stream = io.StringIO()
+        self.profiler.add_sink(telemetry.StderrOverlay(self.profiler, interval=2, stream=stream))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stats.jsonl")
+            overlay = telemetry.configure(self.profiler, f"overlay, {path}")
+            self.assertTrue(overlay)
+            self.assertTrue(self.profiler.enabled)
+            for _ in range(3):
+                self.profiler.count("cells_written", 5)
+                self.profiler.end_frame()
+            self.profiler.sinks[-1].close()
+            with open(path) as file:
+                lines = [json.loads(line) for line in file]
+        self.assertEqual([line["frame"] for line in lines], [0, 1, 2])
+        self.assertEqual(lines[1]["counters"], {"cells_written": 5})
+        self.assertEqual(stream.getvalue().count("cells_written 5"), 2)  # Frames 0 and 2
+
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(10, 2)
+        drawer.draw_text(2, 1, self.profiler.format_overlay())
+        self.assertEqual(drawer.surface[1, 2:].tobytes().decode(), self.profiler.format_overlay()[:8])
+
+
+class TestOfflineRender(unittest.TestCase):
+    def setUp(self):
+        self.cube = models.Cube()
+        self.cube.set_scale(1)
+        self.cube.set_rotation(20, 30, 0)
+        self.path = offline_render.Turntable(radius=5, frame_count=8)
+
+    def render(self, frames, **kwargs):
+        stream = io.BytesIO()
+        written = offline_render.render([self.cube], self.path, frames, 24, 16, offline_render.StreamWriter(stream),
+                                        **kwargs)
+        self.assertEqual(written, len(frames))
+        return stream.getvalue()
+
+    def test_frames_in_order(self):
+        expected = self.render(range(6), file_format="ppm", workers=1)
+        self.assertEqual(self.render(range(6), file_format="ppm", workers=2, max_pending=3), expected)
+        frame_size = len(expected) // 6
+        first = expected[:frame_size]
+        self.assertTrue(first.startswith(b"P6\n24 16\n255\n"))
+        self.assertEqual(expected[4 * frame_size:5 * frame_size], self.render([4], file_format="ppm", workers=1))
+        self.assertNotEqual(expected[frame_size:2 * frame_size], first)  # Camera moves
+
+    def test_formats(self):
+        camera = self.path(3)
+        image = offline_render.render_frame([self.cube], camera, 24, 16)
+        self.assertTrue((image != 0).any())
+        self.assertEqual(self.render([3], workers=1), image.tobytes())
+        with tempfile.TemporaryDirectory() as directory:
+            writer = offline_render.SequenceWriter(os.path.join(directory, "frames", "{:03d}.png"))
+            offline_render.render([self.cube], self.path, [3], 24, 16, writer, file_format="png", workers=1)
+            surface = pygame.image.load(os.path.join(directory, "frames", "003.png"))
+            np.testing.assert_array_equal(pygame.surfarray.array3d(surface).transpose(1, 0, 2), image)
+
+        text = self.render([3], mode="ascii", workers=1).decode("ascii").split("\n")
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(24, 16)
+        camera.set_aspect_ratio(24 / 16)
+        self.cube.draw_console(drawer, camera)
+        self.assertEqual(text[:16], [line.tobytes().decode() for line in drawer.surface])
+        with self.assertRaises(ValueError):
+            self.render([0], mode="ascii", file_format="png", workers=1)
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        # Row of 20 cubes along x-axis, 5 units apart, two in every chunk
+        cube = models.Cube().mesh
+        vertices = np.concatenate([cube.vertices[:, :3] + (5 * i + 2.5, 5, 5) for i in range(20)])
+        indices = np.concatenate([cube.indices + 8 * i for i in range(20)])
+        self.mesh = Mesh(vertices, indices)
+        self.directory = tempfile.TemporaryDirectory()
+        self.chunk_count = streaming.write_chunked_scene(self.mesh, self.directory.name, chunk_size=10)
+        self.camera = Camera3D(Vector3D(-10, 5, 5), Vector3D(0, 5, 5), Vector3D(0, 1, 0))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, scene):
+        scene.update(self.camera)
+        self.assertTrue(scene.wait_for_loads(timeout=5))
+        scene.update(self.camera)
+
+    def test_chunks(self):
+        self.assertEqual(self.chunk_count, 10)
+        with streaming.StreamingScene(self.directory.name) as scene:
+            self.load(scene)
+            self.assertEqual(len(scene.loaded), 10)
+            self.assertEqual(sum(obj.mesh.get_face_count() for obj in scene.get_objects()), 240)
+            points = np.concatenate([obj.mesh.vertices for obj in scene.get_objects()])
+            self.assertEqual(sorted(map(tuple, points.tolist())), sorted(map(tuple, self.mesh.vertices.tolist())))
+
+    def test_budget_and_eviction(self):
+        chunk_memory = streaming.estimate_chunk_memory(16, 24)
+        with streaming.StreamingScene(self.directory.name, memory_budget=3 * chunk_memory) as scene:
+            self.load(scene)
+            self.assertEqual(sorted(scene.loaded), [0, 1, 2])  # Nearest chunks
+            self.assertLessEqual(scene.memory_used, scene.memory_budget)
+            drawer = ConsoleDrawer(io.StringIO())
+            drawer.set_size(40, 20)
+            scene.draw_console(drawer, self.camera)
+            self.assertTrue((drawer.surface != ord(" ")).any())
+
+            self.camera.move_to(Vector3D(110, 5, 5))
+            self.load(scene)
+            self.assertEqual(sorted(scene.loaded), [7, 8, 9])
+            self.assertEqual(scene.evictions, 3)
+            self.assertEqual(scene.memory_used, 3 * chunk_memory)
+            self.assertEqual(len(scene.children), 3)
+
+    def test_failed_load(self):
+        with open(os.path.join(self.directory.name, streaming.INDEX_FILE)) as file:
+            os.remove(os.path.join(self.directory.name, json.load(file)["chunks"][1]["file"]))
+        with streaming.StreamingScene(self.directory.name) as scene:
+            scene.update(self.camera)
+            self.assertTrue(scene.wait_for_loads(timeout=5))
+            self.assertRaises(OSError, scene.update, self.camera)
+            self.assertEqual(scene.failed, {1})
+            self.load(scene)  # Other chunks are loaded, the failed one is not requested again
+            self.assertEqual(sorted(scene.loaded), [0] + list(range(2, 10)))
+
+    def test_view_direction_and_distance(self):
+        with streaming.StreamingScene(self.directory.name, load_distance=12) as scene:
+            self.camera.move_to(Vector3D(50, 5, 5))
+            order, distances = scene.get_priorities(self.camera)
+            # Chunks 4 and 5 are 1.5 units away, 3 and 6 are 11.5 units away. Those in front come first
+            self.assertEqual(order.tolist(), [5, 4, 6, 3])
+            np.testing.assert_allclose(distances, [1.5, 1.5, 11.5, 11.5])
+
+
+class TestTextures(unittest.TestCase):
+    QUAD = "v -1 -1 0\nv 1 -1 0\nv 1 1 0\nv -1 1 0\nvt 0 0\nvt 1 0\nvt 1 1\nvt 0 1\nf 1/1 2/2 3/3\nf 1/1 3/3 4/4\n"
+    # Red, green on the top row, blue, white on the bottom one
+    IMAGE = np.array([[(255, 0, 0), (0, 255, 0)], [(0, 0, 255), (255, 255, 255)]], dtype=np.uint8)
+
+    def test_mipmaps(self):
+        image = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+        texture = textures.Texture(image)
+        self.assertEqual([texture.get_level(i).shape[:2] for i in range(texture.get_level_count())],
+                         [(4, 6), (2, 3), (1, 2), (1, 1)])
+        np.testing.assert_array_equal(texture.get_level(0), image)
+        np.testing.assert_array_equal(texture.get_level(1)[0, 0], np.round(image[:2, :2].mean(axis=(0, 1))))
+        np.testing.assert_array_equal(texture.get_level(2)[0, 1], texture.get_level(1)[:, 2].mean(axis=0))
+        self.assertEqual(texture.get_memory(), (24 + 6 + 2 + 1) * 3)
+
+    def test_sample_and_mip_levels(self):
+        texture = textures.Texture(self.IMAGE)
+        u = np.array([0.25, 1.25, 0.75, -0.25, 0.5])
+        v = np.array([0.75, 0.75, 0.25, 0.25, 0.5])
+        np.testing.assert_array_equal(texture.sample(u, v, np.array([0, 0, 0, 0, 1])),
+                                      [(255, 0, 0), (255, 0, 0), (255, 255, 255), (255, 255, 255), (128, 128, 128)])
+
+        texture = textures.Texture(np.zeros((64, 64, 3), dtype=np.uint8))
+        derivatives = np.zeros((4, 2, 2))
+        derivatives[0, 0, 0] = 1 / 64  # One texel per pixel
+        derivatives[1, 1, 1] = 4 / 64
+        derivatives[2, 0, 1] = 3 / 64  # Footprint is rounded to the nearest level
+        derivatives[3] = 10
+        self.assertEqual(texture.get_mip_levels(derivatives).tolist(), [0, 2, 2, 6])
+        self.assertEqual(texture.get_mip_levels(derivatives, bias=1).tolist(), [1, 3, 3, 6])
+
+    def test_cache_evicts_least_recently_used(self):
+        loaded = []
+
+        def loader(path):
+            loaded.append(path)
+            return textures.Texture(np.zeros((16, 16, 3), dtype=np.uint8))
+        size = textures.Texture(np.zeros((16, 16, 3), dtype=np.uint8)).get_memory()
+        cache = textures.TextureCache(2 * size, loader)
+        first = cache.get("a")
+        cache.get("b")
+        self.assertIs(cache.get("a"), first)
+        cache.get("c")  # "b" is the least recently used
+        self.assertEqual(list(cache.textures), ["a", "c"])
+        self.assertEqual((cache.memory_used, cache.loads, cache.evictions), (2 * size, 3, 1))
+        cache.get("b")
+        self.assertEqual(loaded, ["a", "b", "c", "b"])
+
+        cache = textures.TextureCache(size // 2, loader)  # Texture larger than the budget is still kept
+        self.assertIsNotNone(cache.get("d"))
+        self.assertEqual(list(cache.textures), ["d"])
+
+    def test_rasterizer_perspective_correction(self):
+        texture = textures.Texture(np.repeat(np.arange(0, 256, 32, dtype=np.uint8), 3).reshape(1, 8, 3))
+        # Right edge is twice as far as the left one
+        vertices = np.array([(0, 0, 0.5), (16, 0, 0.5), (16, 4, 0.5), (0, 4, 0.5)], dtype=np.float32)
+        indices = np.array([[0, 1, 2], [0, 2, 3]])
+        uvs = np.array([[(0, 0), (1, 0), (1, 1)], [(0, 0), (1, 1), (0, 1)]])
+        colors = np.full((2, 3), 255, dtype=np.uint8)
+        rows = []
+        for clip_w in (None, np.array([-1, -2, -2, -1])):
+            depth = np.full((4, 16), np.inf, dtype=np.float32)
+            color = np.zeros((4, 16, 3), dtype=np.uint8)
+            rasterizer.fill_triangles(depth, color, vertices, indices, colors, texture=texture, uvs=uvs,
+                                      clip_w=clip_w)
+            rows.append(color[1, :, 0].tolist())
+        self.assertEqual(rows[0], [32 * (x // 2) for x in range(16)])
+        # Texture is magnified on the nearer left half of the quad, which shows less than half of it
+        self.assertEqual(rows[1], [0, 0, 0, 0, 32, 32, 32, 64, 64, 96, 96, 128, 128, 160, 192, 224])
+
+        depth = np.full((4, 16), np.inf, dtype=np.float32)
+        color = np.zeros((4, 16, 3), dtype=np.uint8)
+        rasterizer.fill_triangles(depth, color, vertices, indices, np.full((2, 3), (255, 128, 0), dtype=np.uint8),
+                                  texture=texture, uvs=uvs)
+        np.testing.assert_array_equal(color[1, 15], (224, 112, 0))  # Texel is multiplied by the color
+
+    def test_textured_file_object(self):
+        with tempfile.TemporaryDirectory() as directory:
+            model_path = os.path.join(directory, "quad.obj")
+            with open(model_path, "w") as file:
+                file.write(self.QUAD)
+            texture_path = os.path.join(directory, "quad.png")
+            with open(texture_path, "wb") as file:
+                file.write(offline_render.encode_png(self.IMAGE))
+            obj = models.FileObject(model_path, use_cache=False, texture_path=texture_path)
+            obj.set_scale(1)
+            obj.set_pos(0, 0, -3)
+            camera = Camera3D(Vector3D(0, 0, 0), Vector3D(0, 0, -1), Vector3D(0, 1, 0))
+            drawer = PygameDrawer(20, 20)
+            obj.draw(drawer, (255, 255, 255), camera)
+            self.assertIn(texture_path, textures.texture_cache.textures)
+
+            np.testing.assert_array_equal(drawer.color[8, 8], (255, 0, 0))
+            np.testing.assert_array_equal(drawer.color[8, 12], (0, 255, 0))
+            np.testing.assert_array_equal(drawer.color[12, 8], (0, 0, 255))
+            np.testing.assert_array_equal(drawer.color[12, 12], (255, 255, 255))
+
+            state = frame_loop.FrameState()
+            state.clear(20, 20)
+            obj.draw(state, (255, 255, 255), camera)
+            self.assertEqual(len(state.get_triangles()[1]), 0)
+            recorded = PygameDrawer(20, 20)
+            for batch in state.get_textured_batches():
+                recorded.fill_triangles(*batch)
+            np.testing.assert_array_equal(recorded.color, drawer.color)
+
+            obj.texture = None
+            drawer.clear()
+            obj.draw(drawer, (255, 255, 255), camera)
+            np.testing.assert_array_equal(drawer.color[8, 12], (255, 255, 255))
+            textures.texture_cache.clear()
+
+    def test_corner_uvs(self):
+        mesh = Mesh([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [[0, 1, 2], [2, 1, 0]], np.array([(0.5, 0.25), (1, 1)]),
+                    np.array([[0, 1, -1], [1, 1, 0]]))
+        np.testing.assert_array_equal(mesh.get_corner_uvs(), [[(0.5, 0.25), (1, 1), (0, 0)],
+                                                              [(1, 1), (1, 1), (0.5, 0.25)]])
+        self.assertFalse(Mesh([(0, 0, 0)], []).has_uvs())
+
+
+class TestDynamicResolution(unittest.TestCase):
+    @staticmethod
+    def run_frames(controller, frames, frame_time):
+        for _ in range(frames):
+            controller.add_frame_time(frame_time(controller))
+
+    def test_scale_settles_within_budget(self):
+        controller = frame_loop.ResolutionController(1 / 60, interval=10)
+        self.assertEqual(controller.get_size(200, 100), (200, 100))
+        # Frame time is proportional to the number of pixels: 40 ms at full size
+        self.run_frames(controller, 10, lambda c: 0.04 * c.scale ** 2)
+        self.assertAlmostEqual(0.04 * controller.scale ** 2, 0.85 / 60)  # Lowered at once
+        scale = controller.scale
+        self.run_frames(controller, 100, lambda c: 0.04 * c.scale ** 2)
+        self.assertEqual(controller.scale, scale)  # Steady
+        self.assertEqual(controller.get_size(200, 100), (round(200 * scale), round(100 * scale)))
+
+        scales = []
+        for _ in range(10):  # Load drops, scale goes up by steps
+            self.run_frames(controller, 10, lambda c: 0.01 * c.scale ** 2)
+            scales.append(controller.scale)
+        self.assertTrue(all(0 < b - a <= frame_loop.SCALE_STEP + 1e-9 for a, b in zip([scale] + scales, scales[:3])))
+        self.assertEqual(scales[-1], 1.0)
+
+    def test_lod_bias(self):
+        controller = frame_loop.ResolutionController(1 / 60, min_scale=0.5, interval=5, max_lod_bias=2)
+        self.run_frames(controller, 50, lambda c: 0.1)
+        self.assertEqual((controller.scale, controller.lod_bias), (0.5, 2))
+        self.run_frames(controller, 5, lambda c: 0.001)
+        self.assertEqual((controller.scale, controller.lod_bias), (0.5, 1))  # Detail comes back before resolution
+        self.run_frames(controller, 10, lambda c: 0.001)
+        self.assertEqual(controller.lod_bias, 0)
+        self.assertAlmostEqual(controller.scale, 0.5 + frame_loop.SCALE_STEP)
+
+        self.assertIsNone(frame_loop.configure_resolution(""))
+        controller = frame_loop.configure_resolution("33.3,lod")
+        self.assertAlmostEqual(controller.target_frame_time, 0.0333)
+        self.assertGreater(controller.max_lod_bias, 0)
+        self.assertEqual(frame_loop.configure_resolution("20").max_lod_bias, 0)
+
+    def test_loop_reports_frame_times(self):
+        class Recorder:
+            def __init__(self):
+                self.times = []
+
+            def add_frame_time(self, seconds):
+                self.times.append(seconds)
+
+        recorder = Recorder()
+        loop = frame_loop.PipelinedFrameLoop(lambda state: time.sleep(0.01), lambda state: None, fps=None,
+                                             resolution=recorder)
+        self.assertEqual(loop.run(frames=3), 3)
+        self.assertEqual(len(recorder.times), 3)
+        self.assertTrue(all(seconds >= 0.01 for seconds in recorder.times))  # Prepare is the slower stage
+
+    def test_scaled_output(self):
+        drawer = ConsoleDrawer(io.StringIO())
+        drawer.set_size(3, 2)
+        drawer.surface[:] = np.frombuffer(b"abcdef", dtype=np.uint8).reshape(2, 3)
+        drawer.set_output_size(6, 4)
+        drawer.draw_text(4, 3, "xyz")
+        drawer.print_surface()
+        self.assertEqual(drawer.stream.getvalue(), "\x1b[H" + "aabbcc" * 2 + "ddeeff" + "ddeexy")
+
+        drawer = PygameDrawer(2, 1)
+        drawer.color[0] = [(255, 0, 0), (0, 0, 255)]
+        surface = pygame.Surface((4, 2))
+        drawer.present(surface)
+        image = pygame.surfarray.array3d(surface).transpose(1, 0, 2)
+        np.testing.assert_array_equal(image[:, :2], np.full((2, 2, 3), (255, 0, 0)))
+        np.testing.assert_array_equal(image[:, 2:], np.full((2, 2, 3), (0, 0, 255)))
+
 
 if __name__ == '__main__':
     unittest.main()
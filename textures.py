@@ -0,0 +1,152 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pygame
+from telemetry import profiler
+
+TEXTURE_MEMORY_BUDGET = 64 << 20  # Bytes of mipmap pyramids kept by the shared texture cache
+
+
+def build_mipmaps(image: np.ndarray) -> list[np.ndarray]:
+    """
+    Build mipmap pyramid: every level is the previous one halved with a 2 x 2 box filter, down to 1 x 1.
+    Odd sizes are rounded up, the last row or column is repeated
+    :param image: Array of shape (H, W, C)
+    :return: List of arrays of the same dtype, from <image> to the 1 x 1 level
+    """
+    levels = [np.ascontiguousarray(image)]
+    level = image.astype(np.float32)
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        height, width = level.shape[:2]
+        level = np.pad(level, ((0, height % 2), (0, width % 2), (0, 0)), mode="edge")
+        level = level.reshape(level.shape[0] // 2, 2, level.shape[1] // 2, 2, -1).mean(axis=(1, 3))
+        levels.append(np.round(level).astype(image.dtype))
+    return levels
+
+
+class Texture:
+    """
+    RGB image with its mipmap pyramid, built once when the texture is created. All levels are stored one after
+    another in one array, so texels of any level are fetched with a single gather.
+    Texture coordinates repeat outside range [0; 1], v = 0 is the bottom of the image like in .obj files
+    """
+    def __init__(self, image: np.ndarray):
+        """
+        :param image: Array of shape (H, W, 3) with RGB of texels, the first row is the top of the image
+        """
+        levels = build_mipmaps(np.asarray(image, dtype=np.uint8))
+        self.height, self.width = levels[0].shape[:2]
+        self.widths = np.array([level.shape[1] for level in levels], dtype=np.int64)
+        self.heights = np.array([level.shape[0] for level in levels], dtype=np.int64)
+        sizes = self.widths * self.heights
+        self.offsets = np.cumsum(sizes) - sizes  # Index of the first texel of every level
+        self.texels = np.concatenate([level.reshape(-1, 3) for level in levels])
+
+    def get_level_count(self) -> int:
+        return len(self.widths)
+
+    def get_level(self, level: int) -> np.ndarray:
+        """
+        :return: View of shape (H, W, 3) on texels of mipmap level <level>
+        """
+        start = self.offsets[level]
+        return self.texels[start:start + self.widths[level] * self.heights[level]].reshape(
+            self.heights[level], self.widths[level], 3)
+
+    def get_memory(self) -> int:
+        """
+        :return: Bytes taken by texels of all levels
+        """
+        return self.texels.nbytes
+
+    def get_mip_levels(self, derivatives: np.ndarray, bias: float = 0) -> np.ndarray:
+        """
+        Choose mipmap level of every triangle from the rate texture coordinates change on the screen, so one
+        pixel covers about one texel of the level
+        :param derivatives: Array of shape (K, 2, 2) with derivatives of u and v (second axis) by screen x and y
+        (third axis) inside every triangle
+        :param bias: Added to the levels, positive values choose smaller levels
+        :return: Array of shape (K,) with levels
+        """
+        texel_x = derivatives[:, 0, :] * self.width  # Texels of the full image per pixel
+        texel_y = derivatives[:, 1, :] * self.height
+        footprint = np.sqrt(np.maximum(texel_x ** 2 + texel_y ** 2, 1e-12)).max(axis=1)
+        levels = np.floor(np.log2(footprint) + bias + 0.5)
+        return np.clip(np.nan_to_num(levels), 0, self.get_level_count() - 1).astype(np.int64)
+
+    def sample(self, u: np.ndarray, v: np.ndarray, levels: np.ndarray) -> np.ndarray:
+        """
+        Get nearest texels of the given mipmap levels
+        :param u: Array of shape (P,) with texture coordinates
+        :param v: Array of shape (P,)
+        :param levels: Array of shape (P,) with mipmap level of every point
+        :return: Array of shape (P, 3) with RGB of texels
+        """
+        widths = self.widths[levels]
+        heights = self.heights[levels]
+        with np.errstate(invalid="ignore"):
+            x = np.nan_to_num(np.floor(u * widths)).astype(np.int64) % widths
+            y = np.nan_to_num(np.floor((1 - v) * heights)).astype(np.int64) % heights
+        return self.texels[self.offsets[levels] + y * widths + x]
+
+
+def load_texture(file_path: str) -> Texture:
+    """
+    Load image file of any format supported by pygame and build its mipmap pyramid
+    """
+    surface = pygame.image.load(file_path)
+    return Texture(pygame.surfarray.array3d(surface).transpose(1, 0, 2))
+
+
+class TextureCache:
+    """
+    Textures loaded from files by path, with their mipmap pyramids. When memory of loaded textures exceeds
+    the budget, least recently used ones are evicted and loaded again when needed.
+    Objects should keep paths of their textures and get them from the cache when drawing, so evicted
+    textures are freed
+    """
+    def __init__(self, memory_budget: int = TEXTURE_MEMORY_BUDGET, loader=load_texture):
+        """
+        :param memory_budget: Bytes of loaded textures, see Texture.get_memory. Can be exceeded only by one
+        texture larger than the budget
+        :param loader: Function creating Texture from path of the file
+        """
+        self.memory_budget = memory_budget
+        self.loader = loader
+        self.textures: OrderedDict[str, Texture] = OrderedDict()  # Least recently used first
+        self.memory_used = 0
+        self.loads = 0  # Number of textures loaded so far
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str) -> Texture:
+        with self._lock:
+            texture = self.textures.get(file_path)
+            if texture is not None:
+                self.textures.move_to_end(file_path)
+                return texture
+        texture = self.loader(file_path)  # Not under the lock, other textures stay available meanwhile
+        profiler.count("textures_loaded")
+        with self._lock:
+            if file_path not in self.textures:
+                self.textures[file_path] = texture
+                self.memory_used += texture.get_memory()
+                self.loads += 1
+            self._evict(keep=file_path)
+            return self.textures[file_path]
+
+    def _evict(self, keep: str):
+        for file_path in list(self.textures):  # Least recently used first
+            if self.memory_used <= self.memory_budget:
+                break
+            if file_path != keep:
+                self.memory_used -= self.textures.pop(file_path).get_memory()
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.textures.clear()
+            self.memory_used = 0
+
+
+texture_cache = TextureCache()  # Shared by all objects with textures given by paths
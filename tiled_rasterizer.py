@@ -0,0 +1,183 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from math import inf
+from multiprocessing import shared_memory
+import numpy as np
+import rasterizer
+
+TILE_SIZE = 64
+
+_attached: dict = {}  # Shared memory blocks opened by a worker process, by name
+
+
+class TiledRasterizer:
+    """
+    Rasterizer that splits the screen into square tiles and fills them in worker processes. Depth and color
+    buffers live in shared memory, so workers write pixels directly and the main process reads them
+    without copying. Every tile is filled by one worker, so workers never write the same pixel
+    """
+    def __init__(self, width: int, height: int, channels: int = 0, workers: int = None, tile_size: int = TILE_SIZE):
+        """
+        :param width: Width of buffers in pixels
+        :param height: Height of buffers in pixels
+        :param channels: Number of values per pixel of color buffer, 0 for buffer of shape (H, W)
+        :param workers: Number of worker processes, number of CPUs if not given. With 1, tiles are filled
+        in the calling process
+        :param tile_size: Side of a tile in pixels
+        """
+        self.tile_size = tile_size
+        self.channels = channels
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        self._depth_memory = None
+        self._color_memory = None
+        self.set_size(width, height)
+
+    def set_size(self, width: int, height: int):
+        """
+        Allocate new buffers, worker processes are kept
+        """
+        self._free_buffers()
+        self.width = width
+        self.height = height
+        self.tiles_x = -(-width // self.tile_size)
+        self.tiles_y = -(-height // self.tile_size)
+        color_shape = (height, width, self.channels) if self.channels else (height, width)
+        self._depth_memory = shared_memory.SharedMemory(create=True, size=max(height * width * 4, 1))
+        self._color_memory = shared_memory.SharedMemory(create=True, size=max(int(np.prod(color_shape)), 1))
+        self.depth_buffer = np.ndarray((height, width), dtype=np.float32, buffer=self._depth_memory.buf)
+        self.color_buffer = np.ndarray(color_shape, dtype=np.uint8, buffer=self._color_memory.buf)
+        self.depth_buffer.fill(inf)
+
+    def _free_buffers(self):
+        if self._depth_memory is None:
+            return
+        # Arrays must be released before their memory is closed
+        self.depth_buffer = self.color_buffer = None
+        for memory in (self._depth_memory, self._color_memory):
+            memory.close()
+            memory.unlink()
+        self._depth_memory = self._color_memory = None
+
+    def close(self):
+        """
+        Stop worker processes and free shared memory. Buffers must not be used after that
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self._free_buffers()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def bin_triangles(self, points: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find tiles touched by bounding boxes of triangles. Triangles covering no pixel center are dropped
+        :param points: Array of shape (K, 3, 3) with screen x, screen y and depth of vertices of triangles
+        :return: Indices of non-empty tiles (row * tiles_x + column), start of every tile's range in the third
+        array and indices of triangles sorted by tile, in original order within a tile
+        """
+        xs = points[:, :, 0]
+        ys = points[:, :, 1]
+        with np.errstate(invalid="ignore"):
+            x_min = np.maximum(np.ceil(xs.min(axis=1)), 0)
+            x_max = np.minimum(np.floor(xs.max(axis=1)), self.width - 1)
+            y_min = np.maximum(np.ceil(ys.min(axis=1)), 0)
+            y_max = np.minimum(np.floor(ys.max(axis=1)), self.height - 1)
+            covered = (x_min <= x_max) & (y_min <= y_max)
+        triangles = np.flatnonzero(covered)
+        tile_x_min = (x_min[covered] // self.tile_size).astype(np.int64)
+        tile_x_max = (x_max[covered] // self.tile_size).astype(np.int64)
+        tile_y_min = (y_min[covered] // self.tile_size).astype(np.int64)
+        tile_y_max = (y_max[covered] // self.tile_size).astype(np.int64)
+        box_widths = tile_x_max - tile_x_min + 1
+        counts = box_widths * (tile_y_max - tile_y_min + 1)
+
+        # Pairs (tile, triangle) for every tile of every triangle's bounding box
+        triangle = np.repeat(np.arange(len(triangles)), counts)
+        local = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        row, column = np.divmod(local, box_widths[triangle])
+        tile = (tile_y_min[triangle] + row) * self.tiles_x + tile_x_min[triangle] + column
+        order = np.argsort(tile, kind="stable")
+        tile = tile[order]
+        tiles, starts = np.unique(tile, return_index=True)
+        return tiles, starts, triangles[triangle[order]]
+
+    def fill_triangles(self, screen_vertices: np.ndarray, indices: np.ndarray, colors: np.ndarray,
+                       shades: np.ndarray = None, palette: np.ndarray = None) -> int:
+        """
+        Same as rasterizer.fill_triangles for the shared buffers, tiles without triangles are skipped
+        :return: Number of pixels written
+        """
+        if len(indices) == 0:
+            return 0
+        points = screen_vertices[indices].astype(np.float64)
+        colors = np.asarray(colors)
+        corner_shades = None if shades is None else np.asarray(shades, dtype=np.float64)[indices]  # (K, 3)
+        tiles, starts, triangles = self.bin_triangles(points)
+        if len(tiles) == 0:
+            return 0
+        ends = np.append(starts[1:], len(triangles))
+
+        # Distributing tiles between tasks, neighbour tiles go to different tasks to balance the load
+        task_count = min(self.workers, len(tiles))
+        tasks = []
+        for task in range(task_count):
+            task_tiles = np.arange(task, len(tiles), task_count)
+            tile_triangles = [triangles[starts[i]:ends[i]] for i in task_tiles]
+            used, local = np.unique(np.concatenate(tile_triangles), return_inverse=True)
+            splits = np.cumsum([len(t) for t in tile_triangles])[:-1]
+            tasks.append((tiles[task_tiles], np.split(local.reshape(-1), splits), points[used], colors[used],
+                          None if corner_shades is None else corner_shades[used], palette))
+
+        if self._pool is None:
+            return sum(_fill_tiles(self.depth_buffer, self.color_buffer, self.tile_size, self.tiles_x, *task)
+                       for task in tasks)
+        buffers = (self._depth_memory.name, self._color_memory.name, self.color_buffer.shape)
+        futures = [self._pool.submit(_fill_tiles_shared, buffers, self.tile_size, self.tiles_x, *task)
+                   for task in tasks]
+        return sum(future.result() for future in futures)
+
+
+def _fill_tiles_shared(buffers: tuple[str, str, tuple], tile_size: int, tiles_x: int, tiles: np.ndarray,
+                       tile_triangles: list[np.ndarray], points: np.ndarray, colors: np.ndarray,
+                       corner_shades: np.ndarray = None, palette: np.ndarray = None) -> int:
+    """
+    Entry point of worker processes: open shared buffers and fill tiles
+    """
+    depth_name, color_name, color_shape = buffers
+    if depth_name not in _attached or color_name not in _attached:  # Buffers were reallocated
+        for memory in _attached.values():
+            memory.close()
+        _attached.clear()
+        for name in (depth_name, color_name):
+            _attached[name] = shared_memory.SharedMemory(name=name)
+    depth_buffer = np.ndarray(color_shape[:2], dtype=np.float32, buffer=_attached[depth_name].buf)
+    color_buffer = np.ndarray(color_shape, dtype=np.uint8, buffer=_attached[color_name].buf)
+    return _fill_tiles(depth_buffer, color_buffer, tile_size, tiles_x, tiles, tile_triangles, points, colors,
+                       corner_shades, palette)
+
+
+def _fill_tiles(depth_buffer: np.ndarray, color_buffer: np.ndarray, tile_size: int, tiles_x: int,
+                tiles: np.ndarray, tile_triangles: list[np.ndarray], points: np.ndarray, colors: np.ndarray,
+                corner_shades: np.ndarray = None, palette: np.ndarray = None) -> int:
+    written = 0
+    for tile, triangles in zip(tiles.tolist(), tile_triangles):
+        y, x = divmod(tile, tiles_x)
+        x *= tile_size
+        y *= tile_size
+        # Rasterizing into contiguous copies of the tile, with vertices moved to its origin
+        depth = depth_buffer[y:y + tile_size, x:x + tile_size].copy()
+        color = color_buffer[y:y + tile_size, x:x + tile_size].copy()
+        tile_points = points[triangles] - (x, y, 0)
+        shades = None if corner_shades is None else corner_shades[triangles].reshape(-1)
+        written += rasterizer.fill_triangles(depth, color, tile_points.reshape(-1, 3),
+                                             np.arange(len(tile_points) * 3).reshape(-1, 3), colors[triangles],
+                                             shades=shades, palette=palette)
+        depth_buffer[y:y + tile_size, x:x + tile_size] = depth
+        color_buffer[y:y + tile_size, x:x + tile_size] = color
+    return written